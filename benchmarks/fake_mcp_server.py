@@ -0,0 +1,39 @@
+"""stdio传输的假zotero-mcp服务，工具名和参数与zotero-mcp一致
+
+    python benchmarks/fake_mcp_server.py [--latency 0.05] [serve --transport stdio]
+
+--latency 设置每次工具调用的延迟（秒）。
+"""
+
+import argparse
+import time
+
+from mcp.server.fastmcp import FastMCP
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--latency", type=float, default=0.0)
+# 忽略zotero-mcp的命令行参数（serve --transport stdio）
+LATENCY = parser.parse_known_args()[0].latency
+
+mcp = FastMCP("fake-zotero", log_level="WARNING")
+
+
+@mcp.tool()
+def zotero_search_items(query: str, limit: int = 10) -> str:
+    """Search Zotero library items"""
+    time.sleep(LATENCY)
+    return "\n".join(
+        f"## {i + 1}. {query} 相关论文 {i + 1}\n**Item Key:** FAKE{i:04d}\n**Authors:** Author {i}\n**Date:** 2024"
+        for i in range(min(limit, 3))
+    )
+
+
+@mcp.tool()
+def zotero_get_item_metadata(item_key: str) -> str:
+    """Get metadata for a Zotero item"""
+    time.sleep(LATENCY)
+    return f"# {item_key}\n**Title:** Fake paper {item_key}\n**Abstract:** A fake abstract."
+
+
+if __name__ == "__main__":
+    mcp.run(transport="stdio")
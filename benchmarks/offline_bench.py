@@ -0,0 +1,407 @@
+"""离线基准测试
+
+所有外部依赖都换成本地替身（见stubs.py），不需要网络和API费用：
+
+    python benchmarks/offline_bench.py --suite all --requests 50 --concurrency 8 --json bench.json
+
+suite:
+    agent      Agent图端到端（supervisor -> search/chat），统计每个节点的延迟
+    mcp        MCP会话池的工具调用，以及MCPClient的一次ReAct搜索
+    startup    在新进程中测量导入、Agent构造、各后端惰性初始化和首个回答的耗时
+    publisher  AsyncMemoryPublisher（direct模式）publish调用的延迟和发送吞吐
+    consumer   发布器 -> AMQP替身 -> BatchMemoryConsumer 的端到端延迟和吞吐
+Celery模式依赖真实的broker，不在离线测试范围内。
+
+每个suite都报告吞吐、p50/p95/p99延迟（毫秒）和进程内存。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import pika  # noqa: E402
+
+from stubs import FakeBroker, FakeOpenAIServer, offline_env  # noqa: E402
+
+SEARCH_QUESTIONS = [
+    "帮我找一篇介绍multi-scale neighbor topology的论文",
+    "找一下图神经网络节点分类的文章",
+    "有没有关于检索增强生成的paper",
+]
+CHAT_QUESTIONS = [
+    "你好",
+    "解释一下什么是注意力机制",
+    "今天适合做什么",
+]
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(seconds: list[float]) -> dict:
+    """延迟统计，单位毫秒"""
+    if not seconds:
+        return {"count": 0}
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "mean": round(sum(ms) / len(ms), 3),
+        "p50": round(percentile(ms, 0.5), 3),
+        "p95": round(percentile(ms, 0.95), 3),
+        "p99": round(percentile(ms, 0.99), 3),
+        "max": round(max(ms), 3),
+    }
+
+
+def rss_mb() -> float | None:
+    """当前进程的常驻内存（MB）"""
+    try:
+        import psutil
+
+        return round(psutil.Process().memory_info().rss / 2**20, 1)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def questions(n: int, unique: bool, mix: str = "mixed") -> list[str]:
+    if mix == "search":
+        pool = SEARCH_QUESTIONS
+    elif mix == "chat":
+        pool = CHAT_QUESTIONS
+    else:
+        pool = [q for pair in zip(SEARCH_QUESTIONS, CHAT_QUESTIONS) for q in pair]
+    # unique时每个问题都不同，避免命中搜索结果缓存
+    return [f"{pool[i % len(pool)]} #{i}" if unique else pool[i % len(pool)] for i in range(n)]
+
+
+class NodeTimer(BaseCallbackHandler):
+    """按LangGraph节点统计耗时"""
+
+    run_inline = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.starts = {}
+        self.latencies: dict[str, list[float]] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            with self.lock:
+                self.starts[run_id] = (node, time.perf_counter())
+
+    def _finish(self, run_id):
+        with self.lock:
+            started = self.starts.pop(run_id, None)
+            if started:
+                node, start = started
+                self.latencies.setdefault(node, []).append(time.perf_counter() - start)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+
+def bench_agent(args, server: FakeOpenAIServer, broker: FakeBroker) -> dict:
+    from agent.graph import Agent
+    from agent.speculation import SPECULATIONS
+
+    start = time.perf_counter()
+    agent = Agent()
+    startup = time.perf_counter() - start
+    timer = NodeTimer()
+    agent.graph = agent.graph.with_config(callbacks=[timer])
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, errors = [], 0
+
+        async def one(question: str):
+            nonlocal errors
+            async with semaphore:
+                begin = time.perf_counter()
+                try:
+                    await agent.aask(question)
+                    latencies.append(time.perf_counter() - begin)
+                except Exception as e:
+                    errors += 1
+                    print(f"agent request failed: {e!r}", file=sys.stderr)
+
+        begin = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in questions(args.requests, not args.repeat_questions, args.mix)))
+        return latencies, errors, time.perf_counter() - begin
+
+    try:
+        latencies, errors, wall = asyncio.run(run_all())
+    finally:
+        agent.close()
+    return {
+        "startup_s": round(startup, 3),
+        "requests": args.requests,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "latency_ms": summarize(latencies),
+        "nodes_ms": {node: summarize(values) for node, values in sorted(timer.latencies.items())},
+        "llm_requests": dict(server.requests),
+        "speculation": {
+            outcome: SPECULATIONS.value(outcome=outcome) for outcome in ("hit", "miss", "expired")
+        },
+    }
+
+
+def bench_mcp(args, server: FakeOpenAIServer, broker: FakeBroker) -> dict:
+    from langchain_core.messages import HumanMessage
+    from langchain_openai import ChatOpenAI
+
+    from agent.mcp_agent import MCPClient, zotero_connection
+    from agent.mcp_pool import MCPSessionPool
+
+    start = time.perf_counter()
+    pool = MCPSessionPool(zotero_connection(), max_size=args.pool_size)
+    pool.warm_up(args.pool_size)
+    warm_up = time.perf_counter() - start
+
+    def call(i: int) -> float:
+        begin = time.perf_counter()
+        pool.background.run(pool.call_tool("zotero_search_items", {"query": f"q{i}"}))
+        return time.perf_counter() - begin
+
+    try:
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            tool_latencies = list(executor.map(call, range(args.requests)))
+        tool_wall = time.perf_counter() - begin
+    finally:
+        pool.close()
+
+    llm = ChatOpenAI(model="fake-react", openai_api_key="fake", openai_api_base=server.base_url)
+    client = MCPClient(llm=llm, pool_size=args.pool_size)
+    react_latencies = []
+    try:
+        for i in range(min(args.requests, 20)):
+            begin = time.perf_counter()
+            client.invoke_with_context([HumanMessage(content=f"找一篇论文 #{i}")])
+            react_latencies.append(time.perf_counter() - begin)
+    finally:
+        client.close()
+    return {
+        "pool_size": args.pool_size,
+        "warm_up_s": round(warm_up, 3),
+        "tool_calls": args.requests,
+        "tool_throughput_cps": round(args.requests / tool_wall, 2),
+        "tool_latency_ms": summarize(tool_latencies),
+        "react_search_ms": summarize(react_latencies),
+    }
+
+
+def _bind_memory_queue(broker: FakeBroker):
+    from mq_consumer import declare_topology
+
+    connection = broker.connection_factory()()
+    declare_topology(connection.channel())
+    connection.close()
+
+
+def bench_publisher(args, server: FakeOpenAIServer, broker: FakeBroker) -> dict:
+    from agent.celery.publisher import AsyncMemoryPublisher
+
+    _bind_memory_queue(broker)
+    publisher = AsyncMemoryPublisher(mode="direct", spill_path=os.path.join(args.workdir, "spill.jsonl"))
+    count = args.requests * 20
+    call_latencies = []
+    begin = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        publisher.publish({"type": "extract", "text": f"消息 {i}", "ts": int(time.time())})
+        call_latencies.append(time.perf_counter() - start)
+    deadline = time.monotonic() + 60
+    while publisher.stats()["published"] < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+    wall = time.perf_counter() - begin
+    publisher.close()
+    return {
+        "messages": count,
+        "published": broker.published,
+        "throughput_mps": round(broker.published / wall, 2),
+        "publish_call_ms": summarize(call_latencies),
+        "stats": publisher.stats(),
+    }
+
+
+def bench_consumer(args, server: FakeOpenAIServer, broker: FakeBroker) -> dict:
+    from agent.celery.publisher import AsyncMemoryPublisher
+    from mq_consumer import BatchMemoryConsumer
+
+    _bind_memory_queue(broker)
+    consumer = BatchMemoryConsumer(host="fake", batch_size=args.batch_size, workers=args.workers, max_wait=0.05)
+    thread = threading.Thread(target=consumer.run, name="bench-consumer", daemon=True)
+    thread.start()
+    publisher = AsyncMemoryPublisher(mode="direct", spill_path=os.path.join(args.workdir, "spill.jsonl"))
+    count = args.requests * 4
+    begin = time.perf_counter()
+    for i in range(count):
+        publisher.publish({"type": "extract", "text": f"我最近在研究图神经网络 {i}", "bench_t0": time.perf_counter()})
+    settled = broker.wait_settled(count, timeout=120)
+    wall = time.perf_counter() - begin
+    consumer.stop()
+    thread.join(timeout=30)
+    publisher.close()
+    latencies = [at - json.loads(body)["bench_t0"] for body, at in broker.settled]
+    return {
+        "messages": count,
+        "completed": settled,
+        "acked": broker.acked,
+        "nacked": broker.nacked,
+        "throughput_mps": round(len(latencies) / wall, 2),
+        "end_to_end_ms": summarize(latencies),
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+    }
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+from unittest import mock
+
+start = time.perf_counter()
+import agent.graph
+imported = time.perf_counter()
+
+import pika
+from stubs import FakeBroker
+from agent.lazy import lazy
+
+with mock.patch.object(pika, "BlockingConnection", FakeBroker().connection_factory()):
+    instance = agent.graph.Agent()
+    constructed = time.perf_counter()
+    instance.ask(sys.argv[1])
+    answered = time.perf_counter()
+    instance.close()
+# 搜索节点会把流式输出直接打印到stdout，先换行
+print("\\nSTARTUP " + json.dumps({
+    "import_s": imported - start,
+    "construct_s": constructed - imported,
+    "first_answer_s": answered - constructed,
+    "lazy_init_s": lazy.timings(instance),
+}))
+"""
+
+
+def _import_breakdown(stderr: str, top: int = 8) -> dict:
+    """解析 -X importtime 的输出，取累计耗时最多的顶层包"""
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if name.isidentifier() or name.startswith("agent."):
+            try:
+                packages[name] = max(packages.get(name, 0), int(cumulative) / 1e6)
+            except ValueError:
+                continue
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {name: round(seconds, 3) for name, seconds in ranked}
+
+
+def bench_startup(args, server: FakeOpenAIServer, broker: FakeBroker) -> dict:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([os.path.join(ROOT, "src"), os.path.join(ROOT, "benchmarks")])}
+    results = {}
+    # 关闭预热时首个回答承担全部初始化；打开预热时初始化与构造后的空闲时间重叠
+    for warm_up in ("false", "true"):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT, SEARCH_QUESTIONS[0]],
+            env={**env, "AGENT_WARM_UP": warm_up},
+            capture_output=True,
+            text=True,
+            timeout=300,
+            cwd=args.workdir,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"startup子进程失败:\n{proc.stderr[-2000:]}")
+        line = next(line for line in proc.stdout.splitlines() if line.startswith("STARTUP "))
+        timings = json.loads(line[len("STARTUP "):])
+        result = {key: round(value, 3) for key, value in timings.items() if key != "lazy_init_s"}
+        result["lazy_init_s"] = {key: round(value, 3) for key, value in timings["lazy_init_s"].items()}
+        result["imports_s"] = _import_breakdown(proc.stderr)
+        results["warm_up" if warm_up == "true" else "cold"] = result
+    return results
+
+
+SUITES = {"startup": bench_startup, "agent": bench_agent, "mcp": bench_mcp, "publisher": bench_publisher, "consumer": bench_consumer}
+
+
+def run_suite(name: str, args) -> dict:
+    with FakeOpenAIServer(latency=args.llm_latency, tokens_per_second=args.tokens_per_second, tokens=args.tokens) as server:
+        overrides = {"SPECULATIVE_SEARCH": "true"} if args.speculative_search else {}
+        with offline_env(server, mcp_latency=args.mcp_latency, **overrides) as workdir:
+            args.workdir = workdir
+            broker = FakeBroker()
+            with mock.patch.object(pika, "BlockingConnection", broker.connection_factory()):
+                if args.tracemalloc:
+                    tracemalloc.start()
+                rss_before = rss_mb()
+                result = SUITES[name](args, server, broker)
+                result["memory"] = {"rss_before_mb": rss_before, "rss_after_mb": rss_mb()}
+                if args.tracemalloc:
+                    result["memory"]["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+                    tracemalloc.stop()
+                return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument("--suite", choices=[*SUITES, "all"], default="all")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mix", choices=["mixed", "search", "chat"], default="mixed", help="agent suite的问题类型")
+    parser.add_argument("--repeat-questions", action="store_true", help="重复使用相同问题（会命中搜索缓存）")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="假模型服务的首token延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--tokens", type=int, default=32, help="每次回答生成的token数")
+    parser.add_argument("--mcp-latency", type=float, default=0.01, help="假MCP工具的调用延迟（秒）")
+    parser.add_argument("--speculative-search", action="store_true", help="supervisor分类的同时推测执行搜索")
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tracemalloc", action="store_true", help="统计Python分配峰值（会拖慢运行）")
+    parser.add_argument("--json", help="结果写入JSON文件")
+    args = parser.parse_args()
+
+    results = {}
+    for name in SUITES if args.suite == "all" else [args.suite]:
+        results[name] = run_suite(name, args)
+        print(f"== {name} ==")
+        print(json.dumps(results[name], ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
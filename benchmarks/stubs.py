@@ -0,0 +1,393 @@
+"""离线基准测试和集成测试用的本地替身
+
+- FakeOpenAIServer：OpenAI兼容的HTTP服务（chat/completions和embeddings），可配置首token延迟和生成速率
+- FakeBroker / FakeBlockingConnection：进程内的AMQP替身，实现pika.BlockingConnection中项目用到的接口
+- fake_mcp_server.py（同目录）：stdio传输的假zotero-mcp服务
+
+offline_env()把Agent需要的环境变量指向这些替身，不需要网络和API费用。
+"""
+
+import collections
+import contextlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+FAKE_MCP_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_mcp_server.py")
+
+_SEARCH_RE = re.compile(r"论文|文章|文献|paper|找")
+
+
+class FakeOpenAIServer:
+    """OpenAI兼容的假模型服务
+
+    - supervisor模型（模型名包含supervisor）：按关键词输出search或chat标签
+    - 请求中带工具且还没有工具结果时：调用名字包含search的工具（ReAct的第一步）
+    - 其它情况：在latency秒后开始输出tokens个token，速率为tokens_per_second
+    """
+
+    def __init__(self, latency: float = 0.05, tokens_per_second: float = 200.0, tokens: int = 32, port: int = 0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.requests = collections.Counter()
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---- 响应内容 ----
+
+    def _reply(self, body: dict) -> dict:
+        """返回 {"content": str} 或 {"tool_call": {...}}"""
+        messages = body.get("messages", [])
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        if isinstance(last_user, list):
+            last_user = "".join(part.get("text", "") for part in last_user if isinstance(part, dict))
+        if "supervisor" in body.get("model", ""):
+            label = "search" if _SEARCH_RE.search(last_user) else "chat"
+            if (body.get("response_format") or {}).get("type") == "json_schema":
+                return {"content": json.dumps({"label": label})}
+            return {"content": label}
+        tools = body.get("tools") or []
+        if tools and messages and messages[-1].get("role") != "tool":
+            names = [tool["function"]["name"] for tool in tools]
+            name = next((n for n in names if "search" in n), names[0])
+            return {"tool_call": {"id": f"call_{uuid.uuid4().hex[:8]}", "name": name, "arguments": json.dumps({"query": last_user}, ensure_ascii=False)}}
+        return {"content": " ".join(f"token{i}" for i in range(self.tokens))}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # 每个Handler对应一个TCP连接，用于观察连接复用
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                path = self.path.rstrip("/")
+                with server._lock:
+                    server.requests[path.rsplit("/", 1)[-1]] += 1
+                if path.endswith("/embeddings"):
+                    inputs = body.get("input")
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    self._json({
+                        "object": "list",
+                        "model": body.get("model"),
+                        "data": [{"object": "embedding", "index": i, "embedding": _embedding(str(text))} for i, text in enumerate(inputs)],
+                        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                    })
+                elif path.endswith("/chat/completions"):
+                    try:
+                        self._chat(body)
+                    except (BrokenPipeError, ConnectionResetError):
+                        # 客户端取消了请求（例如推测执行被取消）
+                        self.close_connection = True
+                else:
+                    self.send_error(404)
+
+            def _chat(self, body: dict):
+                reply = server._reply(body)
+                model = body.get("model", "fake")
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                time.sleep(server.latency)
+                words = reply.get("content", "").split(" ") if "content" in reply else []
+                usage = {"prompt_tokens": 10, "completion_tokens": max(1, len(words)), "total_tokens": 10 + max(1, len(words))}
+                tool_calls = None
+                if "tool_call" in reply:
+                    call = reply["tool_call"]
+                    tool_calls = [{"index": 0, "id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}]
+                if not body.get("stream"):
+                    time.sleep(len(words) / server.tokens_per_second)
+                    message = {"role": "assistant", "content": reply.get("content")}
+                    if tool_calls:
+                        message["tool_calls"] = [{k: v for k, v in c.items() if k != "index"} for c in tool_calls]
+                    self._json({
+                        "id": completion_id,
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                        "usage": usage,
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(delta: dict, finish_reason=None, extra=None):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                        **(extra or {}),
+                    }
+                    self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+                if tool_calls:
+                    send({"role": "assistant", "content": None, "tool_calls": tool_calls})
+                    send({}, "tool_calls")
+                else:
+                    for i, word in enumerate(words):
+                        send({"role": "assistant", "content": word if i == 0 else " " + word})
+                        time.sleep(1 / server.tokens_per_second)
+                    send({}, "stop")
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self._chunk(f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model, 'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+
+            def _chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def _embedding(text: str, dim: int = 64) -> list[float]:
+    """按词哈希的确定性向量，相同文本得到相同向量"""
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()) or [text]:
+        vector[zlib.crc32(word.encode("utf-8")) % dim] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+# ---- AMQP替身 ----
+
+
+class FakeBroker:
+    """进程内的direct交换机和队列，记录每条消息发布和确认的时间"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.bindings: dict[tuple[str, str], set] = collections.defaultdict(set)
+        self.queues: dict[str, collections.deque] = collections.defaultdict(collections.deque)
+        self.published = 0
+        self.acked = 0
+        self.nacked = 0
+        self.settled: list[tuple[bytes, float]] = []
+
+    def publish(self, exchange: str, routing_key: str, body):
+        body = body.encode("utf-8") if isinstance(body, str) else body
+        with self.cond:
+            for queue in self.bindings.get((exchange, routing_key), ()):
+                self.queues[queue].append(body)
+            self.published += 1
+            self.cond.notify_all()
+
+    def settle(self, body: bytes, ok: bool):
+        with self.cond:
+            if ok:
+                self.acked += 1
+            else:
+                self.nacked += 1
+            self.settled.append((body, time.perf_counter()))
+            self.cond.notify_all()
+
+    def wait_settled(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.acked + self.nacked < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def connection_factory(self):
+        """替换pika.BlockingConnection的工厂"""
+        return lambda parameters=None: FakeBlockingConnection(self)
+
+
+class FakeChannel:
+    def __init__(self, connection: "FakeBlockingConnection"):
+        self.connection = connection
+        self.broker = connection.broker
+        self.is_open = True
+        self.prefetch = 0
+        self.consumers = []
+        self.unacked: dict[int, bytes] = {}
+        self._tags = 0
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.is_open
+
+    def exchange_declare(self, exchange, exchange_type="direct", durable=False, **kwargs):
+        pass
+
+    def queue_declare(self, queue, durable=False, **kwargs):
+        with self.broker.cond:
+            self.broker.queues[queue]
+
+    def queue_bind(self, queue, exchange, routing_key=None, **kwargs):
+        with self.broker.cond:
+            self.broker.bindings[(exchange, routing_key)].add(queue)
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch = prefetch_count
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.broker.publish(exchange, routing_key, body)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, **kwargs):
+        self.consumers.append((queue, on_message_callback))
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.broker.settle(self.unacked.pop(delivery_tag), True)
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.broker.settle(self.unacked.pop(delivery_tag), False)
+
+    def _deliver(self) -> bool:
+        delivered = False
+        for queue, callback in self.consumers:
+            while not self.prefetch or len(self.unacked) < self.prefetch:
+                with self.broker.cond:
+                    if not self.broker.queues[queue]:
+                        break
+                    body = self.broker.queues[queue].popleft()
+                self._tags += 1
+                self.unacked[self._tags] = body
+                callback(self, SimpleNamespace(delivery_tag=self._tags), SimpleNamespace(), body)
+                delivered = True
+        return delivered
+
+    def start_consuming(self):
+        while self.is_open:
+            self.connection.process_data_events(time_limit=0.1)
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeBlockingConnection:
+    """实现项目用到的pika.BlockingConnection接口，回调都在调用process_data_events的线程中执行"""
+
+    def __init__(self, broker: FakeBroker):
+        self.broker = broker
+        self.is_open = True
+        self._channels: list[FakeChannel] = []
+        self._callbacks = collections.deque()
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.is_open
+
+    def channel(self) -> FakeChannel:
+        channel = FakeChannel(self)
+        self._channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.append(callback)
+        with self.broker.cond:
+            self.broker.cond.notify_all()
+
+    def process_data_events(self, time_limit=0):
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            busy = False
+            while self._callbacks:
+                self._callbacks.popleft()()
+                busy = True
+            for channel in self._channels:
+                busy = channel._deliver() or busy
+            remaining = deadline - time.monotonic()
+            if busy or remaining <= 0:
+                return
+            with self.broker.cond:
+                self.broker.cond.wait(min(remaining, 0.01))
+
+    def close(self):
+        self.is_open = False
+        for channel in self._channels:
+            channel.close()
+
+
+# ---- 环境 ----
+
+
+@contextlib.contextmanager
+def offline_env(server: FakeOpenAIServer, mcp_latency: float = 0.0, **overrides):
+    """把Agent依赖的外部服务指向本地替身，退出时恢复环境变量"""
+    workdir = tempfile.mkdtemp(prefix="agent-bench-")
+    env = {
+        "QWEN_API_BASE": server.base_url,
+        "OLLAMA_API_BASE": server.base_url,
+        "QWEN_API_KEY": "fake",
+        "OPENAI_API_KEY": "fake",
+        "LANGSMITH_API_KEY": "",
+        "LANGSMITH_TRACING": "false",
+        "TRACING": "off",
+        "ZOTERO_MCP_COMMAND": sys.executable,
+        "ZOTERO_MCP_ARGS": f'"{FAKE_MCP_SERVER}" --latency {mcp_latency}',
+        "MEMORY_PUBLISH_MODE": "direct",
+        "CONTEXT_TOKENIZER": "heuristic",
+        "SUPERVISOR_LOG_PATH": os.path.join(workdir, "supervisor.jsonl"),
+        "SEARCH_CACHE_PATH": os.path.join(workdir, "search_cache.sqlite3"),
+        "LONG_MEMORY_PATH": os.path.join(workdir, "long_memory.sqlite3"),
+        "CHECKPOINT_PATH": os.path.join(workdir, "checkpoints.sqlite3"),
+        "ZOTERO_INDEX_DIR": os.path.join(workdir, "zotero_index"),
+        **{key: str(value) for key, value in overrides.items()},
+    }
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield workdir
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
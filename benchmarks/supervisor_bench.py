@@ -0,0 +1,101 @@
+"""supervisor解码模式基准测试
+
+对比 free / constrained / json 三种模式的延迟和生成token数：
+
+    python benchmarks/supervisor_bench.py --base-url http://localhost:11434/v1 --repeat 3
+
+问题文件可以是每行一个问题的文本文件，也可以是带 text/question 字段的jsonl。
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+
+from agent.supervisor import SUPERVISOR_MODES, bind_supervisor, parse_label, supervisor_prompt
+
+LABELS = ["search", "rag", "chat", "other"]
+
+DEFAULT_QUESTIONS = [
+    "我想找一篇文章，我记得是介绍multi-scale neighbor topology技术的，然后对Transformer模型进行了改进",
+    "你好",
+    "根据我库里的论文总结一下图神经网络的最新进展",
+    "今天晚饭吃什么",
+    "帮我解释一下什么是注意力机制",
+]
+
+
+def load_questions(path: str | None) -> list[str]:
+    if not path:
+        return DEFAULT_QUESTIONS
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                line = record.get("text") or record.get("question") or record.get("title", "")
+            questions.append(line)
+    return questions
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_mode(llm, mode: str, questions: list[str], repeat: int) -> dict:
+    model = bind_supervisor(llm, mode, LABELS)
+    latencies, tokens, labels, invalid = [], [], [], 0
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            response = model.invoke([SystemMessage(content=supervisor_prompt(mode)), HumanMessage(content=question)])
+            latencies.append(time.perf_counter() - start)
+            usage = response.usage_metadata or {}
+            tokens.append(usage.get("output_tokens", 0))
+            label = parse_label(response.content, LABELS)
+            invalid += label is None
+            labels.append(label)
+    return {
+        "mode": mode,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "mean_tokens": statistics.mean(tokens),
+        "max_tokens": max(tokens),
+        "invalid": invalid,
+        "labels": labels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:11434/v1")
+    parser.add_argument("--api-key", default="ollama")
+    parser.add_argument("--model", default="qwen3_lora_sft_supervisor_dpo")
+    parser.add_argument("--questions", help="问题文件（txt或jsonl）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=list(SUPERVISOR_MODES), choices=SUPERVISOR_MODES)
+    args = parser.parse_args()
+
+    llm = ChatOpenAI(openai_api_base=args.base_url, openai_api_key=args.api_key, model=args.model)
+    questions = load_questions(args.questions)
+    results = [run_mode(llm, mode, questions, args.repeat) for mode in args.modes]
+
+    baseline = results[0]["labels"]
+    print(f"{'mode':<12}{'p50(ms)':>10}{'p95(ms)':>10}{'tokens':>10}{'max':>6}{'invalid':>9}{'agree':>8}")
+    for result in results:
+        agree = sum(a == b for a, b in zip(result["labels"], baseline)) / len(baseline)
+        print(
+            f"{result['mode']:<12}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+            f"{result['mean_tokens']:>10.1f}{result['max_tokens']:>6}{result['invalid']:>9}{agree:>8.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""批量运行问题
+
+从JSONL文件逐行读取问题，按设定的并发数交给Agent回答，每完成一个就把回答和耗时追加写入输出JSONL。
+中断后用相同的输出文件再次运行，已经成功的id会被跳过，只重跑失败和未完成的问题。
+
+    python -m agent.batch_runner requests.jsonl -o resource/batch/answers.jsonl --concurrency 8
+
+输入的每一行是一个JSON对象，id取--id-field（默认依次尝试id、request_id），
+问题取--question-field，可以指定多次，多个字段用空行拼接（默认依次尝试question、text、body、title）。
+
+输出的每一行：
+    {"id": ..., "status": "ok" | "error", "answer": ..., "error": ..., "route": "search",
+     "latency_s": 3.2, "ttft_s": 0.8, "tokens": 120, "tool_calls": 2, "finished_at": ...}
+route是最后输出token的节点，tokens是流式token事件数，ttft_s是第一个token事件的时间。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from contextlib import aclosing
+
+from loguru import logger
+
+DEFAULT_ID_FIELDS = ("id", "request_id")
+DEFAULT_QUESTION_FIELDS = ("question", "text", "body", "title")
+
+
+def completed_ids(path: str) -> set[str]:
+    """输出文件中已经成功的id，中断时写了一半的最后一行会被忽略"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"{path} 第 {line_number} 行不完整，已忽略")
+                continue
+            if record.get("status") == "ok":
+                done.add(str(record["id"]))
+    return done
+
+
+def drop_partial_line(path: str) -> int:
+    """截掉文件末尾没有换行符的半行（中断时写了一半），返回截掉的字节数
+
+    不截掉的话续跑追加的第一条结果会接在半行后面，两条记录都无法解析
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        # 从文件末尾向前按块查找最后一个换行符
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            chunk = f.read(end - start)
+            if end == size and chunk.endswith(b"\n"):
+                return 0
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+    logger.warning(f"{path} 末尾有 {size - end} 字节不完整的记录，已截掉")
+    return size - end
+
+
+def read_questions(path: str, id_field: str | None = None, question_fields: list[str] | None = None):
+    """逐行产出 (id, 问题)，不会一次读入整个文件"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"{path} 第 {line_number} 行不是合法的JSON，已跳过")
+                continue
+            if id_field:
+                item_id = record.get(id_field)
+            else:
+                item_id = next((record[field] for field in DEFAULT_ID_FIELDS if record.get(field) is not None), None)
+            if item_id is None:
+                item_id = f"line-{line_number}"
+            if question_fields:
+                question = "\n\n".join(str(record[field]) for field in question_fields if record.get(field))
+            else:
+                question = next((record[field] for field in DEFAULT_QUESTION_FIELDS if record.get(field)), "")
+            if not question:
+                logger.warning(f"{path} 第 {line_number} 行没有问题内容，已跳过")
+                continue
+            yield str(item_id), question
+
+
+async def answer(agent, item_id: str, question: str, timeout: float | None = None) -> dict:
+    """回答一个问题并记录耗时，失败时返回错误信息而不是抛出异常"""
+    result = {"id": item_id, "question": question}
+    start = time.perf_counter()
+    stats = {"ttft_s": None, "tokens": 0, "tool_calls": 0, "route": None}
+
+    async def consume():
+        # 拿到final后立即关闭事件流，不等垃圾回收
+        async with aclosing(agent.astream(question)) as events:
+            async for event in events:
+                if event["type"] == "token":
+                    if stats["ttft_s"] is None:
+                        stats["ttft_s"] = round(time.perf_counter() - start, 3)
+                    stats["tokens"] += 1
+                    stats["route"] = event.get("node")
+                elif event["type"] == "tool_call":
+                    stats["tool_calls"] += 1
+                elif event["type"] == "final":
+                    return event["content"]
+
+    try:
+        result["answer"] = await asyncio.wait_for(consume(), timeout)
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = repr(e) if isinstance(e, asyncio.TimeoutError) else f"{type(e).__name__}: {e}"
+    result.update(stats)
+    result["latency_s"] = round(time.perf_counter() - start, 3)
+    result["finished_at"] = time.time()
+    return result
+
+
+def _summary(latencies: list[float], counts: dict) -> str:
+    latencies = sorted(latencies)
+    if not latencies:
+        return f"完成 {counts['ok']} 个，失败 {counts['error']} 个，跳过 {counts['skipped']} 个"
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return (
+        f"完成 {counts['ok']} 个，失败 {counts['error']} 个，跳过 {counts['skipped']} 个，"
+        f"延迟 p50 {p50:.2f}s / p95 {p95:.2f}s"
+    )
+
+
+async def run(
+    agent,
+    input_path: str,
+    output_path: str,
+    concurrency: int = 8,
+    id_field: str | None = None,
+    question_fields: list[str] | None = None,
+    timeout: float | None = None,
+    limit: int | None = None,
+) -> dict:
+    """批量回答input_path中的问题，结果追加写入output_path，返回各状态的数量"""
+    drop_partial_line(output_path)
+    done = completed_ids(output_path)
+    if done:
+        logger.info(f"{output_path} 中已有 {len(done)} 个成功的回答，将跳过")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    latencies: list[float] = []
+    # 有界队列：读取速度跟随回答速度，大文件不会一次全部读入
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def produce():
+        seen = set()
+        submitted = 0
+        for item_id, question in read_questions(input_path, id_field, question_fields):
+            if item_id in done or item_id in seen:
+                counts["skipped"] += 1
+                continue
+            if limit is not None and submitted >= limit:
+                break
+            seen.add(item_id)
+            submitted += 1
+            await queue.put((item_id, question))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    with open(output_path, "a", encoding="utf-8") as output:
+
+        async def work():
+            while (item := await queue.get()) is not None:
+                result = await answer(agent, *item, timeout=timeout)
+                # 每个结果单独写一行并立即刷新，中断时最多丢失正在回答的问题
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                counts[result["status"]] += 1
+                latencies.append(result["latency_s"])
+                if result["status"] == "error":
+                    logger.warning(f"{result['id']} 失败: {result['error']}")
+                finished = counts["ok"] + counts["error"]
+                if finished % 10 == 0:
+                    logger.info(f"已完成 {finished} 个，{_summary(latencies, counts)}")
+
+        await asyncio.gather(produce(), *(work() for _ in range(concurrency)))
+    logger.info(_summary(latencies, counts))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量回答JSONL文件中的问题，支持中断后续跑")
+    parser.add_argument("input", help="输入JSONL文件")
+    parser.add_argument("-o", "--output", default="resource/batch/answers.jsonl", help="输出JSONL文件，已有的成功结果会被跳过")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "8")))
+    parser.add_argument("--id-field", help="id字段，默认依次尝试 id、request_id，都没有时使用行号")
+    parser.add_argument("--question-field", action="append", help="问题字段，可指定多次，默认依次尝试 question、text、body、title")
+    parser.add_argument("--timeout", type=float, default=None, help="单个问题的超时时间（秒）")
+    parser.add_argument("--limit", type=int, default=None, help="本次最多回答的问题数")
+    args = parser.parse_args()
+
+    from agent.graph import Agent
+
+    agent = Agent()
+    try:
+        counts = asyncio.run(
+            run(
+                agent,
+                args.input,
+                args.output,
+                concurrency=args.concurrency,
+                id_field=args.id_field,
+                question_fields=args.question_field,
+                timeout=args.timeout,
+                limit=args.limit,
+            )
+        )
+    except KeyboardInterrupt:
+        logger.warning(f"已中断，已完成的结果保存在 {args.output}，再次运行会从中断处继续")
+        raise SystemExit(130)
+    finally:
+        agent.close()
+    raise SystemExit(1 if counts["error"] else 0)
+
+
+if __name__ == "__main__":
+    main()
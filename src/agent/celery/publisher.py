@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from collections import deque
+import pika
+from loguru import logger
+
+
+class AsyncMemoryPublisher:
+    """进程内的异步记忆消息发布器
+
+    publish只把消息放进本地有界缓冲区就立即返回，后台线程负责批量发送：
+    - celery模式：调用send_memory_message.delay，保持原有的Celery链路
+    - direct模式：开启publisher confirms，直接发布到memory.direct交换机，省掉Celery这一跳
+    缓冲区满或broker不可用时，按overflow策略丢弃（drop）或写入磁盘（spill），
+    broker恢复后自动重放磁盘上的消息。写磁盘只在后台线程中进行，publish不会因为磁盘IO阻塞。
+    """
+
+    def __init__(
+        self,
+        mode: str = "celery",
+        host: str = "localhost",
+        exchange: str = "memory.direct",
+        routing_key: str = "memory.info",
+        queue_name: str = "memory.queue",
+        max_buffer: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        overflow: str = "spill",
+        spill_path: str = "resource/memory_spill/memory_spill.jsonl",
+        max_backoff: float = 30.0,
+    ):
+        if mode not in ("celery", "direct"):
+            raise ValueError(f"Invalid publish mode: {mode}. Must be 'celery' or 'direct'.")
+        if overflow not in ("drop", "spill"):
+            raise ValueError(f"Invalid overflow policy: {overflow}. Must be 'drop' or 'spill'.")
+        self.mode = mode
+        self.host = host
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.queue_name = queue_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.max_backoff = max_backoff
+        self.published = 0
+        self.dropped = 0
+        self.spilled = 0
+        self._queue = queue.Queue(maxsize=max_buffer)
+        # 缓冲区满时等待后台线程写入磁盘的消息，同样有上限，超过后丢弃
+        self._overflowed = deque()
+        self._max_overflowed = max_buffer
+        self._stop = threading.Event()
+        # 重放失败后下一次重放的时间和退避间隔
+        self._replay_after = 0.0
+        self._replay_backoff = 0.5
+        self._spill_lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+        self._thread = threading.Thread(target=self._run, name="memory-publisher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def publish(self, data: dict) -> bool:
+        """非阻塞发布，返回消息是否进入了发送缓冲区"""
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            if self.overflow == "spill" and len(self._overflowed) < self._max_overflowed:
+                self._overflowed.append(data)
+            else:
+                self._drop([data], "发送缓冲区已满")
+            return False
+
+    def _spill_overflowed(self):
+        """把缓冲区满时暂存的消息写入磁盘，只在后台线程和close中调用"""
+        items = []
+        while self._overflowed:
+            items.append(self._overflowed.popleft())
+        if items:
+            self._overflow(items, "发送缓冲区已满")
+
+    def _overflow(self, items: list, reason: str):
+        if self.overflow == "spill":
+            try:
+                with self._spill_lock:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.spill_path)), exist_ok=True)
+                    with open(self.spill_path, "a", encoding="utf-8") as f:
+                        for item in items:
+                            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                self.spilled += len(items)
+                logger.warning(f"{reason}，{len(items)} 条记忆消息已写入磁盘")
+                return
+            except OSError as e:
+                logger.error(f"写入磁盘失败: {e}")
+        self._drop(items, reason)
+
+    def _drop(self, items: list, reason: str):
+        self.dropped += len(items)
+        logger.warning(f"{reason}，丢弃 {len(items)} 条记忆消息")
+
+    def _take_batch(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _ensure_channel(self):
+        if self._channel is not None and self._channel.is_open:
+            return self._channel
+        self._connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+        self._channel = self._connection.channel()
+        # 与mq_consumer.declare_topology相同的拓扑，消费者启动之前发布的消息也有队列可去，
+        # 否则mandatory消息会被退回并反复写入磁盘
+        self._channel.exchange_declare(exchange=self.exchange, exchange_type="direct", durable=True)
+        self._channel.queue_declare(queue=self.queue_name, durable=True)
+        self._channel.queue_bind(exchange=self.exchange, queue=self.queue_name, routing_key=self.routing_key)
+        # publisher confirms，broker确认后basic_publish才返回，失败会抛出异常
+        self._channel.confirm_delivery()
+        logger.info(f"记忆发布器已连接到 {self.host}")
+        return self._channel
+
+    def _close_connection(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+        self._channel = None
+
+    def _send(self, batch: list):
+        """发送一批消息，返回前全部成功，否则抛出异常并返回未发送的部分"""
+        for i, data in enumerate(batch):
+            try:
+                if self.mode == "celery":
+                    from agent.celery.tasks import send_memory_message
+                    send_memory_message.delay(data)
+                else:
+                    self._ensure_channel().basic_publish(
+                        exchange=self.exchange,
+                        routing_key=self.routing_key,
+                        body=json.dumps(data),
+                        properties=pika.BasicProperties(delivery_mode=2, content_type="application/json"),
+                        mandatory=True,
+                    )
+            except Exception as e:
+                raise _PublishError(batch[i:]) from e
+            self.published += 1
+
+    def _replay_spill(self):
+        """broker恢复后重放磁盘上的消息
+
+        磁盘上的消息先移到.replay文件再读取；上次重放没有完成留下的.replay会一起重放，不会被覆盖
+        """
+        replay_path = self.spill_path + ".replay"
+        if self.overflow != "spill" or not (os.path.exists(self.spill_path) or os.path.exists(replay_path)):
+            return
+        if time.monotonic() < self._replay_after:
+            return
+        with self._spill_lock:
+            if os.path.exists(self.spill_path):
+                if os.path.exists(replay_path):
+                    with open(self.spill_path, encoding="utf-8") as src, open(replay_path, "a", encoding="utf-8") as dst:
+                        dst.writelines(src)
+                    os.remove(self.spill_path)
+                else:
+                    os.replace(self.spill_path, replay_path)
+        items = []
+        with open(replay_path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 写了一半或损坏的行，跳过，不影响其它消息
+                    logger.warning(f"{replay_path} 第 {line_number} 行不是合法的JSON，已跳过: {line[:200]!r}")
+        os.remove(replay_path)
+        logger.info(f"重放磁盘上的 {len(items)} 条记忆消息")
+        for start in range(0, len(items), self.batch_size):
+            try:
+                self._send(items[start:start + self.batch_size])
+            except _PublishError as e:
+                # 重放失败后指数退避，不在每轮发送循环中重试
+                self._replay_after = time.monotonic() + self._replay_backoff
+                self._replay_backoff = min(self._replay_backoff * 2, self.max_backoff)
+                # 连同后面还没重放的消息一起重新写回磁盘
+                raise _PublishError(e.pending + items[start + self.batch_size:]) from e.__cause__
+        self._replay_backoff = 0.5
+
+    def _run(self):
+        backoff = 0.5
+        while not (self._stop.is_set() and self._queue.empty()):
+            self._spill_overflowed()
+            batch = self._take_batch()
+            try:
+                if batch:
+                    self._send(batch)
+                self._replay_spill()
+                backoff = 0.5
+            except _PublishError as e:
+                self._close_connection()
+                self._overflow(e.pending, f"发布记忆消息失败({e.__cause__})")
+                if self._stop.is_set():
+                    continue
+                # broker不可用，指数退避后重连
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            except Exception as e:
+                logger.error(f"记忆发布线程异常: {e}")
+        self._close_connection()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self._queue.qsize(),
+            "published": self.published,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+        }
+
+    def close(self, timeout: float = 5.0):
+        """停止后台线程，尽量发送完缓冲区中的消息"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        # 没来得及发送的消息按overflow策略处理
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if pending:
+            self._overflow(pending, "发布器已关闭")
+        self._spill_overflowed()
+
+
+class _PublishError(Exception):
+    def __init__(self, pending: list):
+        super().__init__(f"{len(pending)} messages not published")
+        self.pending = pending
@@ -1,36 +1,112 @@
 import pika
 import json
+import os
+import time
+import random
+import inspect
 import threading
 import atexit
-import weakref
+from contextlib import contextmanager
 from loguru import logger
 from typing import Optional
 
+
+class PooledChannel:
+    """连接池中的一个连接和它的channel，同一时间只会被一个线程借出"""
+
+    def __init__(self, connection: pika.BlockingConnection, channel):
+        self.connection = connection
+        self.channel = channel
+        self.last_used = time.monotonic()
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_used
+
+    def healthy(self) -> bool:
+        """健康检查，顺便处理心跳帧；会读写socket，不能在池的锁内调用"""
+        if self.connection.is_closed or self.channel.is_closed:
+            return False
+        try:
+            self.connection.process_data_events(time_limit=0)
+            return True
+        except Exception as e:
+            logger.warning(f"RabbitMQ连接健康检查失败: {e}")
+            return False
+
+    def close(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception as e:
+            logger.warning(f"关闭RabbitMQ连接时出现异常: {e}")
+
+
 class RabbitMQConnectionPool:
-    """RabbitMQ连接池单例类，管理连接复用"""
-    _instance = None
+    """RabbitMQ连接池，相同配置共享同一个实例
+
+    pika.BlockingConnection不是线程安全的，所以池中每一项都是独立的连接+channel，
+    通过channel()上下文管理器借出，同一时间只属于一个线程。
+
+    BlockingConnection只在调用方读写socket时处理心跳，空闲在池中的连接收不到心跳，
+    超过max_idle秒（默认为心跳间隔）没有使用的连接可能已经被broker断开，借出时直接丢弃重建；
+    其余连接借出时先做健康检查。
+    """
+    _instances: dict = {}
     _lock = threading.Lock()
-    
-    def __new__(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super().__new__(cls)
-                    cls._instance._initialized = False
-        return cls._instance
-    
-    def __init__(self):
+
+    def __new__(cls, *args, **kwargs):
+        # 按完整配置区分实例，不同参数得到不同的池，而不是沿用第一次创建时的参数
+        key = cls._config_key(*args, **kwargs)
+        with cls._lock:
+            instance = cls._instances.get(key)
+            if instance is None:
+                instance = cls._instances[key] = super().__new__(cls)
+                instance._initialized = False
+        return instance
+
+    @classmethod
+    def _config_key(cls, *args, **kwargs) -> tuple:
+        bound = inspect.signature(cls.__init__).bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        config = dict(bound.arguments)
+        del config["self"]
+        config["host"] = config["host"] or os.getenv("RABBITMQ_HOST", "localhost")
+        config["max_size"] = config["max_size"] or int(os.getenv("RABBITMQ_POOL_SIZE", "8"))
+        return tuple(sorted(config.items()))
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        max_size: Optional[int] = None,
+        heartbeat: int = 30,
+        acquire_timeout: float = 10.0,
+        max_retries: int = 5,
+        backoff_base: float = 0.2,
+        backoff_max: float = 10.0,
+        max_idle: Optional[float] = None,
+    ):
         if not getattr(self, '_initialized', False):
-            self.connection: Optional[pika.BlockingConnection] = None
-            self.channel: Optional[pika.channel.Channel] = None
-            self.host = 'localhost'
-            self._setup_lock = threading.Lock()
+            self.host = host or os.getenv("RABBITMQ_HOST", "localhost")
+            self.max_size = max_size or int(os.getenv("RABBITMQ_POOL_SIZE", "8"))
+            self.heartbeat = heartbeat
+            self.max_idle = heartbeat if max_idle is None else max_idle
+            self.acquire_timeout = acquire_timeout
+            self.max_retries = max_retries
+            self.backoff_base = backoff_base
+            self.backoff_max = backoff_max
+            self._idle: list[PooledChannel] = []
+            self._size = 0
+            self._closed = False
+            self._available = threading.Condition(threading.Lock())
+            # 已经声明过的交换机/队列拓扑，避免每个channel重复声明
+            self._declared: set = set()
+            self._declare_lock = threading.Lock()
             self._initialized = True
-            
+
             # 注册程序退出时的清理函数
             atexit.register(self._cleanup_on_exit)
-            logger.info("RabbitMQ连接池初始化完成，已注册退出清理")
-    
+            logger.info(f"RabbitMQ连接池初始化完成 (最大连接数 {self.max_size})，已注册退出清理")
+
     def _cleanup_on_exit(self):
         """程序退出时自动清理资源"""
         try:
@@ -38,117 +114,169 @@ class RabbitMQConnectionPool:
             logger.info("程序退出，RabbitMQ连接池资源已清理")
         except Exception as e:
             logger.error(f"程序退出时清理RabbitMQ连接失败: {e}")
-    
-    def get_connection_and_channel(self):
-        """获取连接和channel，如果不存在则创建"""
-        with self._setup_lock:
-            if self.connection is None or self.connection.is_closed:
-                self._create_connection()
-            
-            if self.channel is None or self.channel.is_closed:
-                self._create_channel()
-                
-            return self.connection, self.channel
-    
-    def _create_connection(self):
-        """创建新的RabbitMQ连接"""
+
+    def _create(self) -> PooledChannel:
+        """创建新的连接和channel，失败时指数退避重试"""
+        for attempt in range(self.max_retries):
+            try:
+                connection = pika.BlockingConnection(
+                    pika.ConnectionParameters(host=self.host, heartbeat=self.heartbeat)
+                )
+                channel = connection.channel()
+                logger.info(f"创建新的RabbitMQ连接到 {self.host} (池大小 {self._size}/{self.max_size})")
+                return PooledChannel(connection, channel)
+            except Exception as e:
+                # broker可能重启过，非持久化的拓扑需要重新声明
+                self._declared.clear()
+                if attempt == self.max_retries - 1:
+                    logger.error(f"创建 RabbitMQ 连接失败: {e}")
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"创建 RabbitMQ 连接失败，{delay:.2f}秒后重试: {e}")
+                time.sleep(delay)
+
+    def _checkout(self, pooled: PooledChannel) -> bool:
+        """检查借出的空闲连接是否可用，在锁外调用，不可用的连接被关闭"""
+        if self.max_idle and pooled.idle_for() > self.max_idle:
+            logger.info(f"RabbitMQ连接空闲 {pooled.idle_for():.0f}s，可能已因缺少心跳被断开，重新建立")
+        elif pooled.healthy():
+            return True
+        pooled.close()
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+        return False
+
+    def acquire(self) -> PooledChannel:
+        """借出一个连接，池满时等待其它线程归还"""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            pooled = None
+            with self._available:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("RabbitMQ连接池已关闭")
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._available.wait(remaining):
+                        raise TimeoutError(f"等待RabbitMQ连接超时 ({self.acquire_timeout}s)")
+            # 健康检查和建立连接都有网络IO，在锁外进行，避免阻塞其它线程借出和归还
+            if pooled is None:
+                break
+            if self._checkout(pooled):
+                return pooled
         try:
-            self.connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=self.host)
-            )
-            logger.info(f"创建新的RabbitMQ连接到 {self.host}")
-        except Exception as e:
-            logger.error(f"创建 RabbitMQ 连接失败: {e}")
+            return self._create()
+        except Exception:
+            with self._available:
+                self._size -= 1
+                self._available.notify()
             raise
-    
-    def _create_channel(self):
-        """创建新的channel"""
+
+    def release(self, pooled: PooledChannel, broken: bool = False):
+        """归还连接，出错的连接直接关闭丢弃"""
+        pooled.last_used = time.monotonic()
+        with self._available:
+            if broken or self._closed or pooled.connection.is_closed or pooled.channel.is_closed:
+                pooled.close()
+                self._size -= 1
+            else:
+                self._idle.append(pooled)
+            self._available.notify()
+
+    @contextmanager
+    def channel(self):
+        """借出一个channel，用完自动归还"""
+        pooled = self.acquire()
         try:
-            self.channel = self.connection.channel()
-            # 设置基本的交换机和队列配置
-            self._setup_exchange_and_queue()
-            logger.info("创建新的RabbitMQ channel")
-        except Exception as e:
-            logger.error(f"创建 RabbitMQ channel 失败: {e}")
+            yield pooled.channel
+        except Exception:
+            self.release(pooled, broken=True)
             raise
-    
-    def _setup_exchange_and_queue(self):
-        """设置交换机和队列（只在创建新channel时执行一次）"""
-        # 声明交换机
-        self.channel.exchange_declare(
-            exchange='memory.direct', 
-            exchange_type='direct', 
-            durable=True
-        )
-        
-        # 声明队列
-        self.channel.queue_declare(queue='memory.queue', durable=True)
-        
-        # 绑定队列到交换机
-        self.channel.queue_bind(
-            exchange='memory.direct',
-            queue='memory.queue',
-            routing_key='memory.info'
-        )
-        logger.info("交换机和队列设置完成")
-    
+        else:
+            self.release(pooled)
+
+    def declare(self, channel, exchange: str, queue: str, routing_key: str):
+        """声明交换机和队列并绑定，同一拓扑在池的生命周期内只声明一次"""
+        key = (exchange, queue, routing_key)
+        if key in self._declared:
+            return
+        with self._declare_lock:
+            if key in self._declared:
+                return
+            # 声明交换机
+            channel.exchange_declare(exchange=exchange, exchange_type='direct', durable=True)
+            # 声明队列
+            channel.queue_declare(queue=queue, durable=True)
+            # 绑定队列到交换机
+            channel.queue_bind(exchange=exchange, queue=queue, routing_key=routing_key)
+            self._declared.add(key)
+            logger.info("交换机和队列设置完成")
+
+    def stats(self) -> dict:
+        with self._available:
+            return {"size": self._size, "idle": len(self._idle), "max_size": self.max_size}
+
     def close(self):
         """关闭连接池中的所有连接"""
-        with self._setup_lock:
-            if self.channel and not self.channel.is_closed:
-                try:
-                    self.channel.close()
-                    logger.info("RabbitMQ channel 已关闭")
-                except Exception as e:
-                    logger.warning(f"关闭RabbitMQ channel时出现异常: {e}")
-            
-            if self.connection and not self.connection.is_closed:
-                try:
-                    self.connection.close()
-                    logger.info("RabbitMQ 连接已关闭")
-                except Exception as e:
-                    logger.warning(f"关闭RabbitMQ连接时出现异常: {e}")
-    
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._available.notify_all()
+        for pooled in idle:
+            pooled.close()
+        if idle:
+            logger.info(f"已关闭 {len(idle)} 个RabbitMQ连接")
+
     @classmethod
     def reset_instance(cls):
-        """重置单例实例（主要用于测试或特殊情况）"""
+        """关闭并移除所有实例（主要用于测试或特殊情况）"""
         with cls._lock:
-            if cls._instance:
-                cls._instance.close()
-                cls._instance = None
-                logger.info("RabbitMQ连接池单例已重置")
+            instances, cls._instances = list(cls._instances.values()), {}
+        for instance in instances:
+            atexit.unregister(instance._cleanup_on_exit)
+            instance.close()
+        if instances:
+            logger.info("RabbitMQ连接池实例已重置")
 
 
 class MemoryQueueClient:
     """内存队列客户端，使用连接池实现连接复用"""
-    
-    def __init__(self, routing_key='memory.info'):
+
+    def __init__(self, routing_key='memory.info', retries: int = 2):
         self.routing_key = routing_key
+        self.retries = retries
         self.pool = RabbitMQConnectionPool()  # 连接池实例
         logger.info(f"MemoryQueueClient 初始化，使用路由键: {routing_key}")
-    
+
     def send(self, data: dict):
         """发送消息到指定队列"""
-        try:
-            # 从连接池获取连接和channel
-            connection, channel = self.pool.get_connection_and_channel()
-            
-            message = json.dumps(data)
-            channel.basic_publish(
-                exchange='memory.direct',
-                routing_key=self.routing_key,
-                body=message,
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
-            
-            logger.info(
-                f"消息已发送到队列 'memory.queue' "
-                f"(交换机: memory.direct, 路由键: {self.routing_key})"
-            )
-            
-        except Exception as e:
-            logger.error(f"发送消息失败: {e}")
-            # 如果发送失败，尝试重置连接
-            self.pool.connection = None
-            self.pool.channel = None
-            raise
\ No newline at end of file
+        message = json.dumps(data)
+        for attempt in range(self.retries + 1):
+            try:
+                # 从连接池借出channel，出错的连接会被丢弃，重试时重新建立
+                with self.pool.channel() as channel:
+                    self.pool.declare(channel, 'memory.direct', 'memory.queue', self.routing_key)
+                    channel.basic_publish(
+                        exchange='memory.direct',
+                        routing_key=self.routing_key,
+                        body=message,
+                        properties=pika.BasicProperties(delivery_mode=2)
+                    )
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"发送消息失败: {e}")
+                    raise
+                logger.warning(f"发送消息失败，重试第 {attempt + 1} 次: {e}")
+
+        logger.info(
+            f"消息已发送到队列 'memory.queue' "
+            f"(交换机: memory.direct, 路由键: {self.routing_key})"
+        )
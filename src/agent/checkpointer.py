@@ -0,0 +1,352 @@
+"""持久化的LangGraph checkpointer
+
+checkpoint保存在本地SQLite文件中（WAL模式），进程重启后同一个thread_id可以继续多轮对话：
+- 每个线程只保留最近keep个checkpoint，更早的checkpoint和它们的pending writes在写入时一并删除
+- 最近活跃线程的最新checkpoint以序列化形式缓存在内存中，按LRU淘汰空闲线程，
+  续聊时不需要读磁盘，进程内存也不会随着线程数增长
+- 设置max_threads时线程数超过上限后删除最久没有活动的线程
+- delete_idle_threads可以清理长时间没有活动的线程
+
+path为":memory:"时checkpoint只保存在进程内，同样按上面的规则裁剪，作为不需要持久化时的有界默认值。
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator, Sequence
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from loguru import logger
+
+
+class SQLiteCheckpointer(BaseCheckpointSaver[str]):
+    """SQLite checkpointer，带按线程的checkpoint裁剪和内存LRU缓存，线程安全"""
+
+    def __init__(self, path: str, keep: int = 4, cache_size: int = 256, max_threads: int = 0, serde=None):
+        """
+        keep: 每个线程（每个checkpoint_ns）保留的checkpoint数量
+        cache_size: 内存中缓存最新checkpoint的线程数
+        max_threads: 最多保存的线程数，0表示不限制
+        """
+        super().__init__(serde=serde)
+        self.path = path
+        self.keep = max(1, keep)
+        self.cache_size = cache_size
+        self.max_threads = max_threads
+        self._lock = threading.Lock()
+        # (thread_id, checkpoint_ns) -> 最新checkpoint的数据库行
+        self._latest: OrderedDict[tuple[str, str], tuple] = OrderedDict()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                type TEXT,
+                checkpoint BLOB,
+                metadata_type TEXT,
+                metadata BLOB,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE INDEX IF NOT EXISTS checkpoints_updated ON checkpoints(updated_at);
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT,
+                value BLOB,
+                task_path TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            """
+        )
+
+    # ---- 读取 ----
+
+    def _writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list:
+        rows = self._db.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        rows.sort(key=lambda row: writes_sort_key(row[5], row[0], row[1]))
+        return [(task_id, channel, self.serde.loads_typed((type_, value))) for task_id, _, channel, type_, value, _ in rows]
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=self._writes(thread_id, checkpoint_ns, checkpoint_id),
+        )
+
+    def _remember(self, key: tuple[str, str], row: tuple | None):
+        if row is None:
+            self._latest.pop(key, None)
+            return
+        self._latest[key] = row
+        self._latest.move_to_end(key)
+        while len(self._latest) > self.cache_size:
+            self._latest.popitem(last=False)
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            if checkpoint_id:
+                row = self._db.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                key = (thread_id, checkpoint_ns)
+                row = self._latest.get(key)
+                if row is not None:
+                    self._latest.move_to_end(key)
+                else:
+                    row = self._db.execute(
+                        f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                        "ORDER BY checkpoint_id DESC LIMIT 1",
+                        (thread_id, checkpoint_ns),
+                    ).fetchone()
+                    if row is not None:
+                        self._remember(key, row)
+            if row is None:
+                return None
+            return self._tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_id)
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+            f"FROM checkpoints {'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY checkpoint_id DESC"
+        )
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        for row in rows:
+            if limit is not None and limit <= 0:
+                break
+            with self._lock:
+                item = self._tuple(row[0], row[1], row[2:])
+            if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield item
+
+    # ---- 写入 ----
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, blob = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_blob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        row = (checkpoint["id"], config["configurable"].get("checkpoint_id"), type_, blob, metadata_type, metadata_blob)
+        with self._lock:
+            new_thread = self.max_threads > 0 and not self._has_thread(thread_id)
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                    "type, checkpoint, metadata_type, metadata, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, *row, time.time()),
+                )
+                self._prune(thread_id, checkpoint_ns)
+                if new_thread:
+                    self._evict_threads()
+            self._remember((thread_id, checkpoint_ns), row)
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        """只保留最近keep个checkpoint，checkpoint_id（uuid6）按时间有序"""
+        oldest = self._db.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.keep - 1),
+        ).fetchone()
+        if oldest is None:
+            return
+        for table in ("checkpoints", "writes"):
+            self._db.execute(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                (thread_id, checkpoint_ns, oldest[0]),
+            )
+
+    def _has_thread(self, thread_id: str) -> bool:
+        if any(key[0] == thread_id for key in self._latest):
+            return True
+        return self._db.execute("SELECT 1 FROM checkpoints WHERE thread_id = ? LIMIT 1", (thread_id,)).fetchone() is not None
+
+    def _evict_threads(self):
+        """线程数超过max_threads时删除最久没有新checkpoint的线程，只在出现新线程时检查"""
+        (count,) = self._db.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()
+        if count <= self.max_threads:
+            return
+        threads = self._db.execute(
+            "SELECT thread_id FROM checkpoints GROUP BY thread_id ORDER BY MAX(updated_at) LIMIT ?",
+            (count - self.max_threads,),
+        ).fetchall()
+        for (thread_id,) in threads:
+            self._delete(thread_id)
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(value)
+            rows.append((WRITES_IDX_MAP.get(channel, idx), channel, type_, blob))
+        with self._lock:
+            with self._db:
+                for idx, channel, type_, blob in rows:
+                    # 普通写入已存在时保留原值，特殊通道（idx为负）覆盖，与InMemorySaver一致
+                    self._db.execute(
+                        f"INSERT OR {'IGNORE' if idx >= 0 else 'REPLACE'} INTO writes "
+                        "(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type_, blob, task_path),
+                    )
+
+    def _delete(self, thread_id: str):
+        self._db.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        self._db.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+        for key in [key for key in self._latest if key[0] == thread_id]:
+            del self._latest[key]
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            with self._db:
+                self._delete(thread_id)
+
+    def delete_idle_threads(self, max_idle: float) -> int:
+        """删除超过max_idle秒没有新checkpoint的线程，返回删除的线程数"""
+        cutoff = time.time() - max_idle
+        with self._lock:
+            threads = [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(updated_at) < ?", (cutoff,)
+                ).fetchall()
+            ]
+        for thread_id in threads:
+            self.delete_thread(thread_id)
+        if threads:
+            logger.info(f"已清理 {len(threads)} 个空闲会话的checkpoint")
+        return len(threads)
+
+    def get_next_version(self, current: str | None, channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # ---- 异步接口：SQLite调用放到线程中，避免阻塞事件循环 ----
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def close(self):
+        with self._lock:
+            self._latest.clear()
+            self._db.close()
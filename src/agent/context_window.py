@@ -0,0 +1,253 @@
+"""按token预算构造对话上下文
+
+历史消息从新到旧放入上下文，超出预算的旧消息由滚动摘要代替。摘要在后台线程中增量计算：
+每次只把上一次摘要之后新被挤出窗口的消息合并进去，同一会话后续轮次直接复用缓存的摘要。
+摘要还没算好时，被挤出的消息暂时不出现在上下文中，不会阻塞当前请求。
+
+单条过长的历史消息（例如Zotero搜索结果）先按token截断，后台压缩完成后换成压缩版本。
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+from loguru import logger
+
+from agent.llm_scheduler import BACKGROUND, priority
+
+HISTORY_SUMMARY_PROMPT = """
+请把下面的对话历史合并进已有摘要，输出新的摘要：
+- 保留用户的研究主题、关心的问题和偏好
+- 保留已经找到的论文标题、作者和结论
+- 不要编造对话中没有的信息
+- 限制在300字以内
+
+已有摘要
+{summary}
+
+新增对话
+{history}
+"""
+
+SUMMARY_PREFIX = "此前对话的摘要：\n"
+TRUNCATED_SUFFIX = "\n……（内容过长已截断）"
+
+_PIECE_RE = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+
+def heuristic_count(text: str) -> int:
+    """不依赖词表的token估算：中文和标点一个字符算一个token，英文单词每4个字符算一个token"""
+    count = 0
+    for piece in _PIECE_RE.findall(text):
+        count += 1 if len(piece) == 1 else (len(piece) + 3) // 4
+    return count
+
+
+def load_tokenizer(name: str = "cl100k_base"):
+    """返回token计数函数 str -> int
+
+    优先使用tiktoken的本地BPE编码；tiktoken未安装或编码文件无法下载（离线环境）时退回到启发式估算。
+    name为"heuristic"时直接使用启发式估算。
+    """
+    if name != "heuristic":
+        try:
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(name)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.warning(f"加载tokenizer {name} 失败，使用启发式估算: {e}")
+    return heuristic_count
+
+
+def message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(
+        part if isinstance(part, str) else part.get("text", "")
+        for part in message.content
+        if isinstance(part, str) or part.get("type") == "text"
+    )
+
+
+def _message_key(message: BaseMessage) -> str:
+    if message.id:
+        return message.id
+    return hashlib.sha1(f"{message.type}\x00{message_text(message)}".encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _Summary:
+    covered: int  # 摘要覆盖了会话的前covered条消息
+    last_key: str  # 第covered条消息的key，用来发现历史被改写的情况
+    text: str
+
+
+class ContextWindow:
+    """按token预算裁剪历史消息，线程安全"""
+
+    def __init__(
+        self,
+        summarize,
+        compress=None,
+        count_tokens=heuristic_count,
+        budget: int = 6000,
+        message_budget: int = 1500,
+        max_conversations: int = 1024,
+        max_cached_messages: int = 10000,
+        executor: ThreadPoolExecutor | None = None,
+    ):
+        """
+        summarize: (已有摘要, 新被挤出的消息列表) -> 新摘要
+        compress: 可选，长消息文本 -> 压缩后的文本
+        budget: 整个上下文（摘要+历史+当前问题）的token预算
+        message_budget: 单条历史消息的token上限
+        """
+        self.summarize = summarize
+        self.compress = compress
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.message_budget = message_budget
+        self.max_conversations = max_conversations
+        self.max_cached_messages = max_cached_messages
+        self._lock = threading.Lock()
+        self._counts: OrderedDict[str, int] = OrderedDict()
+        self._summaries: OrderedDict[str, _Summary] = OrderedDict()
+        self._compressed: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._pending: set = set()
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+
+    @staticmethod
+    def _remember(cache: OrderedDict, key, value, limit: int):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    def count(self, message: BaseMessage) -> int:
+        """消息的token数，按消息id缓存，跨轮次不重复计算"""
+        key = _message_key(message)
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+        tokens = self.count_tokens(message_text(message))
+        with self._lock:
+            self._remember(self._counts, key, tokens, self.max_cached_messages)
+        return tokens
+
+    def _fit(self, message: BaseMessage) -> tuple[BaseMessage, int]:
+        """超过单条上限的历史消息换成压缩版本，还没有压缩版本时先截断，返回消息和它的token数"""
+        tokens = self.count(message)
+        if tokens <= self.message_budget:
+            return message, tokens
+        key = _message_key(message)
+        with self._lock:
+            cached = self._compressed.get(key)
+        if cached is not None:
+            compressed, tokens = cached
+        else:
+            if self.compress is not None:
+                self._submit(("compress", key), self._compress, key, message_text(message))
+            text = message_text(message)
+            compressed = text[: max(1, len(text) * self.message_budget // tokens)] + TRUNCATED_SUFFIX
+            tokens = self.count_tokens(compressed)
+        return message.model_copy(update={"content": compressed}), tokens
+
+    def build(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        """返回预算内的上下文消息，最后一条（当前问题）总是保留原文"""
+        if not messages:
+            return []
+        conversation = _message_key(messages[0])
+        with self._lock:
+            summary = self._summaries.get(conversation)
+            if summary is not None:
+                self._summaries.move_to_end(conversation)
+        if summary is not None and not (
+            summary.covered < len(messages) and _message_key(messages[summary.covered - 1]) == summary.last_key
+        ):
+            summary = None
+        start = summary.covered if summary is not None else 0
+        summary_message = SystemMessage(content=SUMMARY_PREFIX + summary.text) if summary is not None else None
+
+        used = self.count(messages[-1]) + (self.count(summary_message) if summary_message else 0)
+        kept = [messages[-1]]
+        cut = len(messages) - 1
+        for i in range(len(messages) - 2, start - 1, -1):
+            message, tokens = self._fit(messages[i])
+            if used + tokens > self.budget:
+                break
+            kept.append(message)
+            used += tokens
+            cut = i
+        kept.reverse()
+
+        if cut > start:
+            # messages[start:cut]被挤出了窗口，后台合并进摘要
+            self._submit(("summary", conversation), self._summarize, conversation, summary, messages[:cut])
+        if summary_message is not None:
+            kept.insert(0, summary_message)
+        return kept
+
+    def _submit(self, job, fn, *args):
+        with self._lock:
+            if job in self._pending:
+                return
+            self._pending.add(job)
+        self._executor.submit(self._run, job, fn, *args)
+
+    def _run(self, job, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.warning(f"上下文摘要计算失败: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(job)
+
+    def _summarize(self, conversation: str, previous: _Summary | None, prefix: list[BaseMessage]):
+        start = previous.covered if previous is not None else 0
+        text = self.summarize(previous.text if previous is not None else "", prefix[start:])
+        with self._lock:
+            self._remember(
+                self._summaries,
+                conversation,
+                _Summary(covered=len(prefix), last_key=_message_key(prefix[-1]), text=text),
+                self.max_conversations,
+            )
+        logger.info(f"上下文摘要已更新，覆盖前 {len(prefix)} 条消息")
+
+    def _compress(self, key: str, text: str):
+        compressed = self.compress(text)
+        tokens = self.count_tokens(compressed)
+        with self._lock:
+            self._remember(self._compressed, key, (compressed, tokens), self.max_cached_messages)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def llm_summarizer(llm):
+    """用对话模型实现ContextWindow的summarize函数"""
+
+    def summarize(previous: str, messages: list[BaseMessage]) -> str:
+        prompt = HISTORY_SUMMARY_PROMPT.format(summary=previous or "无", history=get_buffer_string(messages))
+        with priority(BACKGROUND):
+            return llm.invoke([HumanMessage(content=prompt)]).content
+
+    return summarize
+
+
+def llm_compressor(llm):
+    """用对话模型压缩过长的单条消息，沿用搜索结果总结的提示词"""
+    from agent.memory_manager import SEARCH_SUMMARY_PROMPT
+
+    def compress(text: str) -> str:
+        with priority(BACKGROUND):
+            return llm.invoke([HumanMessage(content=SEARCH_SUMMARY_PROMPT.format(search_result=text))]).content
+
+    return compress
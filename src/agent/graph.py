@@ -1,6 +1,18 @@
-"""LangGraph single-node graph template.
+"""Director_Agent：由supervisor分发的多节点问答图
 
-Returns a predefined response. Replace logic and configuration as needed.
+supervisor_node先用本地规则/分类器（agent.router），置信度不足时再用大模型判断消息类别，
+然后交给search_node（通过zotero-mcp工具运行ReAct搜索，结果带缓存）、rag_node（本地文献库检索）、chat_node（闲聊）
+或other_node处理，节点完成后回到supervisor，直到判断结束。每个节点都有同步和异步实现。
+会话状态按thread_id保存在checkpointer中（默认进程内存，CHECKPOINTER=sqlite时持久化），
+同一thread_id的提问串行执行；不传thread_id的匿名提问结束后清除checkpoint。
+
+入口：
+    ask/aask        提问并返回最终回答，ask可以通过on_event回调接收流式事件
+    ask_many        在线程池中并发回答多个问题
+    agent/aagent    逐个处理节点更新，agent打印到标准输出，aagent异步产出
+    astream         异步产出节点内部的token、工具调用事件，最后产出final事件
+
+模块级的graph属性供langgraph.json使用，首次访问时才创建Agent。
 """
 
 from __future__ import annotations
@@ -10,98 +22,491 @@ import time
 import uuid
 import threading
 import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 
 from langgraph.runtime import Runtime
-from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, message_chunk_to_message
+from langchain_core.runnables import RunnableBinding, RunnableLambda
 # 用LangGraph studio不需要自定义内存存储
-from langgraph.checkpoint.memory import InMemorySaver
 
 
 from agent.langsmith_client import LangsmithClient
 # from agent.memory_manager import Memory_Manager
-from agent.mcp_agent import MCPClient
-from agent.celery.tasks import send_memory_message
+from agent.router import PreClassifier
+from agent.model_router import Backend, ModelRouter
+from agent.search_cache import SearchResultCache
+from agent.single_flight import SingleFlight, request_key
+from agent.supervisor import bind_supervisor, parse_label, supervisor_prompt
+from agent.celery.publisher import AsyncMemoryPublisher
+from agent.checkpointer import SQLiteCheckpointer
+from agent.context_window import ContextWindow, llm_compressor, llm_summarizer, load_tokenizer
+from agent.lazy import lazy
+from agent.tracing import BackgroundExporter, JsonlSink, LangSmithSink, TracingCallback
+from agent.metrics import MetricsCallback, serve as serve_metrics
+from agent.speculation import Speculations
+from agent.streaming import CallbackSink, QueueSink, current_sink, reset_sink, set_sink
 import agent.state as state
 
+if TYPE_CHECKING:
+    from agent.zotero_index import ZoteroIndex
+
+RAG_PROMPT = """你是一个文献助手。请根据下面从用户Zotero文献库中检索到的内容回答问题，用中文回复。
+引用内容时标注编号和论文标题；检索内容不足以回答时直接说明，不要编造文献。
+
+检索内容
+{context}
+"""
+
+
 class Agent:
     def __init__(self):
         # 初始化节点和模型
         self.nodes = ["supervisor","search", "rag", "chat", "other"]
-        # 初始化大语言模型
-        self.llm = ChatOpenAI(
-            model="qwen3-next-80b-a3b-thinking",
-            openai_api_key=os.getenv("QWEN_API_KEY"),
-            openai_api_base="https://dashscope.aliyuncs.com/compatible-mode/v1",
+        # supervisor可输出的分类标签，以及输出不合法时的兜底标签
+        self.labels = ["search", "rag", "chat", "other"]
+        self.fallback_label = "other"
+        # 前置分类器，能直接判断的消息不再调用supervisor模型
+        self.pre_classifier = PreClassifier.from_log(
+            os.getenv("SUPERVISOR_LOG_PATH", "resource/supervisor/decisions.jsonl"),
+            threshold=float(os.getenv("PRE_CLASSIFIER_THRESHOLD", "0.9")),
+            max_log_bytes=int(os.getenv("SUPERVISOR_LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        )
+        # 模型、上下文窗口、MCP客户端和本地检索引擎都是惰性属性（见下方@lazy方法），第一次使用时才创建
+        # supervisor解码模式：free / constrained / json，见agent.supervisor
+        self.supervisor_mode = os.getenv("SUPERVISOR_MODE", "free")
+        # 搜索结果缓存，设置SEARCH_CACHE_EMBEDDING_MODEL后可以匹配换种说法的相同问题
+        self.search_cache = SearchResultCache(
+            path=os.getenv("SEARCH_CACHE_PATH", "resource/cache/search_cache.sqlite3"),
+            max_entries=int(os.getenv("SEARCH_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("SEARCH_CACHE_TTL", "3600")),
+            embed=self._cache_embedder(),
+        )
+        self.rag_top_k = int(os.getenv("RAG_TOP_K", "5"))
+        # SPECULATIVE_SEARCH=true时，异步路径中supervisor分类的同时提前开始搜索，见agent.speculation
+        self.speculative_search = os.getenv("SPECULATIVE_SEARCH", "false").lower() in ("1", "true", "yes")
+        self.speculations = Speculations()
+        # 同时到达的相同模型请求只发出一次，LLM_SINGLE_FLIGHT=false时关闭，见agent.single_flight
+        self.llm_flights = SingleFlight(
+            "llm", enabled=os.getenv("LLM_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
         )
-        # 初始化监督模型
-        self.supervisor_llm = ChatOpenAI(
-            openai_api_base="http://localhost:11434/v1",
-            openai_api_key="ollama",
-            model="qwen3_lora_sft_supervisor_dpo",
+        # 记忆消息发布器，MEMORY_PUBLISH_MODE=direct时跳过Celery直接发布到memory.direct
+        self.memory_publisher = AsyncMemoryPublisher(
+            mode=os.getenv("MEMORY_PUBLISH_MODE", "celery"),
+            overflow=os.getenv("MEMORY_PUBLISH_OVERFLOW", "spill"),
         )
-        # 取带工具的agent
-        self.mcp_client = MCPClient(llm=self.llm)
         # 记忆管理器
         # self.memory_manager = Memory_Manager(llm=self.llm)
-        # Langsmith客户端
+        # Langsmith客户端，没有配置API key时为None
         self.langsmith_client = LangsmithClient.langsmith_client()
-        
+        # 采样追踪，TRACING=off/file/langsmith
+        self.tracer = self._tracer()
+        # 图只编译一次，所有问题共享同一个编译好的图和checkpointer
+        self.checkpointer = self._checkpointer()
+        # 节点和模型调用的耗时、token数，设置METRICS_PORT后通过 /metrics 导出
+        self.metrics = MetricsCallback()
+        metrics_port = os.getenv("METRICS_PORT")
+        if metrics_port:
+            serve_metrics(int(metrics_port))
+        self.graph = self.build_graph()
+        # 同一个thread_id的请求需要串行执行，不同thread_id之间可以并发
+        # 同步和异步入口共用同一把锁，见_athread_lock
+        self._thread_locks = weakref.WeakValueDictionary()
+        self._thread_locks_guard = threading.Lock()
+        # 在后台线程中预先创建惰性属性，不阻塞构造；预热完成前到达的请求会等待同一个初始化结果
+        self._warm_up_thread = None
+        if os.getenv("AGENT_WARM_UP", "true").lower() in ("1", "true", "yes"):
+            self._warm_up_thread = threading.Thread(target=self.warm_up, name="agent-warm-up", daemon=True)
+            self._warm_up_thread.start()
+
+
+    @lazy
+    def llm(self):
+        """主模型"""
+        from agent.llm_clients import chat_model
+
+        return chat_model("qwen", "qwen3-next-80b-a3b-thinking")
+
+
+    @lazy
+    def context_window(self) -> ContextWindow:
+        """按token预算构造上下文，挤出窗口的历史和过长的搜索结果在后台摘要/压缩"""
+        return ContextWindow(
+            summarize=llm_summarizer(self.llm),
+            compress=llm_compressor(self.llm),
+            count_tokens=load_tokenizer(os.getenv("CONTEXT_TOKENIZER", "cl100k_base")),
+            budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000")),
+            message_budget=int(os.getenv("CONTEXT_MESSAGE_TOKENS", "1500")),
+        )
+
+
+    @lazy
+    def supervisor_llm(self):
+        """监督模型"""
+        from agent.llm_clients import chat_model
+
+        return chat_model("ollama", "qwen3_lora_sft_supervisor_dpo")
+
+
+    @lazy
+    def supervisor_model(self):
+        return bind_supervisor(self.supervisor_llm, self.supervisor_mode, self.labels)
+
+
+    @lazy
+    def supervisor_router(self) -> ModelRouter:
+        """supervisor的模型路由：首选本地Ollama，设置SUPERVISOR_FALLBACK_MODEL后慢或不可用时对冲/降级到备用模型
+
+        备用模型没有经过分类微调，自由解码时输出不一定是合法标签，所以总是使用受约束的解码（free模式下用json）
+        """
+        fallback_mode = "json" if self.supervisor_mode == "free" else self.supervisor_mode
+        return self._router(
+            "supervisor",
+            "ollama",
+            self.supervisor_model,
+            os.getenv("SUPERVISOR_FALLBACK_MODEL", ""),
+            # 输出同样由parse_label解析
+            bind=lambda llm: bind_supervisor(llm, fallback_mode, self.labels),
+            hedge_delay=1.0,
+            deadline=30.0,
+        )
+
+
+    @lazy
+    def chat_router(self) -> ModelRouter:
+        """chat/rag回答的模型路由，设置CHAT_FALLBACK_MODEL后启用备用模型"""
+        return self._router("chat", "qwen", self.llm, os.getenv("CHAT_FALLBACK_MODEL", ""), hedge_delay=5.0)
+
+
+    def _router(self, name: str, endpoint: str, model, fallback: str, bind=None, **kwargs) -> ModelRouter:
+        """fallback格式为 端点:模型，例如 qwen:qwen-turbo、ollama:qwen3:8b，为空时只有首选模型"""
+        from agent.llm_clients import chat_model
+
+        primary = model.bound if isinstance(model, RunnableBinding) else model
+        backends = [Backend(f"{endpoint}:{primary.model_name}", endpoint, model)]
+        if fallback:
+            fallback_endpoint, fallback_model = fallback.split(":", 1)
+            llm = chat_model(fallback_endpoint, fallback_model)
+            backends.append(Backend(fallback, fallback_endpoint, bind(llm) if bind else llm))
+        return ModelRouter.from_env(name, backends, **kwargs)
+
+
+    @lazy
+    def mcp_client(self):
+        """带工具的agent，创建时会启动zotero-mcp并列出工具"""
+        from agent.mcp_agent import MCPClient
+
+        return MCPClient(llm=self.llm)
+
+
+    @lazy
+    def retriever(self) -> ZoteroIndex | None:
+        """本地Zotero检索引擎，索引由 python -m agent.zotero_index 离线构建"""
+        from agent.zotero_index import ZoteroIndex
+
+        index_dir = os.getenv("ZOTERO_INDEX_DIR", "resource/zotero_index")
+        if not ZoteroIndex.exists(index_dir):
+            logger.warning(f"未找到本地Zotero索引 {index_dir}，rag节点将使用MCP搜索")
+            return None
+        return ZoteroIndex.open(index_dir)
+
+
+    def warm_up(self):
+        """依次创建所有惰性属性，失败时只记录日志，第一次使用时会再尝试"""
+        for name in ("llm", "supervisor_router", "chat_router", "context_window", "retriever", "mcp_client"):
+            try:
+                getattr(self, name)
+            except Exception as e:
+                logger.warning(f"预热 {name} 失败: {e}")
+
+
+    def close(self):
+        """释放已创建的后台资源，未创建的惰性属性不会因为关闭而被创建"""
+        if self._warm_up_thread is not None:
+            self._warm_up_thread.join()
+        if lazy.loaded(self, "mcp_client"):
+            self.mcp_client.close()
+        if lazy.loaded(self, "context_window"):
+            self.context_window.close()
+        if lazy.loaded(self, "retriever") and self.retriever is not None:
+            self.retriever.close()
+        self.memory_publisher.close()
+        self.pre_classifier.close()
+        self.search_cache.close()
+        if self.tracer:
+            self.tracer.exporter.close()
+        self.checkpointer.close()
+
+
+    def _checkpointer(self):
+        """会话checkpoint，每个线程只保留最近几个checkpoint，线程数也有上限
+
+        默认保存在进程内存中；CHECKPOINTER=sqlite时持久化到本地文件，进程重启后用同一个thread_id可以继续对话
+        """
+        persistent = os.getenv("CHECKPOINTER", "memory") == "sqlite"
+        checkpointer = SQLiteCheckpointer(
+            path=os.getenv("CHECKPOINT_PATH", "resource/checkpoints/checkpoints.sqlite3") if persistent else ":memory:",
+            keep=int(os.getenv("CHECKPOINT_KEEP", "4")),
+            cache_size=int(os.getenv("CHECKPOINT_CACHE_SIZE", "256")),
+            max_threads=int(os.getenv("CHECKPOINT_MAX_THREADS", "10000")),
+        )
+        # 启动时清理长时间没有活动的会话
+        max_idle = float(os.getenv("CHECKPOINT_THREAD_TTL", "0"))
+        if persistent and max_idle > 0:
+            checkpointer.delete_idle_threads(max_idle)
+        return checkpointer
+
+
+    def _tracer(self) -> TracingCallback | None:
+        """按采样规则追踪图的调用，导出在后台线程中进行，不阻塞节点
+
+        TRACE_SAMPLE_RATE比例的调用记录完整输入输出；其余调用只有出错或耗时超过TRACE_SLOW_SECONDS时才导出耗时和错误
+        """
+        mode = os.getenv("TRACING", "langsmith" if self.langsmith_client else "off")
+        if mode == "off":
+            return None
+        if mode == "file":
+            sink = JsonlSink(os.getenv("TRACE_FILE", "resource/traces/traces.jsonl"))
+        elif mode == "langsmith" and self.langsmith_client:
+            sink = LangSmithSink(self.langsmith_client, os.getenv("LANGSMITH_PROJECT", "Director_Agent"))
+        else:
+            logger.warning(f"无法使用追踪模式 {mode}（未配置LANGSMITH_API_KEY或模式无效），已关闭追踪")
+            return None
+        return TracingCallback(
+            BackgroundExporter(sink, maxsize=int(os.getenv("TRACE_QUEUE_SIZE", "1000"))),
+            sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.1")),
+            slow_threshold=float(os.getenv("TRACE_SLOW_SECONDS", "20")),
+            max_field_chars=int(os.getenv("TRACE_MAX_FIELD_CHARS", "2000")),
+        )
+
+
+    def _cache_embedder(self):
+        """搜索缓存使用的问题向量函数，未配置embedding模型时只做精确匹配"""
+        model = os.getenv("SEARCH_CACHE_EMBEDDING_MODEL")
+        if not model:
+            return None
+        from agent.llm_clients import embeddings
+
+        return embeddings("ollama", model, check_embedding_ctx_length=False).embed_query
+
+
+    def _supervisor_messages(self, state: state.State) -> list:
+        """构建supervisor分类的输入消息"""
+        # # 拉取prompt
+        # prompts = self.langsmith_client.pull_prompt("supervisor", include_model=False)
+        # prompt_super = prompts.format(question=state["message"][-1].content)
+        return [SystemMessage(content=supervisor_prompt(self.supervisor_mode)), HumanMessage(content=state["message"][-1].content)]
+
+
+    def _pre_classify(self, state: state.State) -> dict | None:
+        """本地前置分类，置信度足够时直接返回分类结果，否则返回None交给大模型"""
+        label, confidence, source = self.pre_classifier.classify(state["message"][-1].content)
+        if label is None:
+            return None
+        logger.info(f"前置分类器命中: {label} (来源: {source}, 置信度: {confidence:.2f})")
+        return {"type": label}
+
+
+    def _parse_supervisor(self, state: state.State, response) -> dict:
+        """对大模型的回答进行检验兜底，如果不在标签中，返回fallback_label"""
+        label = parse_label(response.content, self.labels)
+        if label is None:
+            logger.warning(f"Invalid response from LLM: {response.content!r}. Must be one of {self.labels}, fallback to {self.fallback_label}.")
+            return {"type": self.fallback_label}
+        # 记录大模型的决策，用于训练前置分类器
+        self.pre_classifier.record(state["message"][-1].content, label)
+        return {"type": label}
+
 
     def supervisor_node(self, state: state.State) -> str:
         logger.info(">>> Supervisor Node")
         
-        # 如果已经有type，结束
-        if "type" in state:
+        # 如果已经有type，结束（新问题输入时type会被重置为空）
+        if state.get("type"):
             return {"type": END}
-        else:
-            # # 拉取prompt
-            # prompts = self.langsmith_client.pull_prompt("supervisor", include_model=False)
-            # prompt_super = prompts.format(question=state["message"][-1].content)
-            # # 调用模型
-            # response = self.llm.invoke([HumanMessage(content=prompt_super)])
-            # # response = HumanMessage(content="other")  # 测试直接返回
-            # # 对大模型的回答进行检验兜底，如果不在nodes中，返回other
-            response = self.supervisor_llm.invoke([SystemMessage(content="消息分类为 search、rag、chat、other 中的一类，只输出标签。"), HumanMessage(content=state["message"][-1].content)])
-            response = response.content.split("\n")[-1]
-            if response not in self.nodes:
-                raise ValueError(f"Invalid response from LLM: {response}. Must be one of {self.nodes}.")
+        update = self._pre_classify(state)
+        if update is not None:
+            return update
+        messages = self._supervisor_messages(state)
+        response = self.llm_flights.do(
+            request_key(self.supervisor_model, messages), lambda: self.supervisor_router.invoke(messages)
+        )
+        return self._parse_supervisor(state, response)
 
-        return {"type": response}
 
+    async def asupervisor_node(self, state: state.State) -> str:
+        logger.info(">>> Supervisor Node")
 
-    def search_node(self, state: state.State) -> dict:
-        logger.info(">>> Search Node")
+        if state.get("type"):
+            return {"type": END}
+        update = self._pre_classify(state)
+        if update is not None:
+            return update
+        # 大部分请求会被分到search，分类期间先开始搜索，分类结果不是search时再取消
+        key = state["message"][-1].id
+        if self.speculative_search and key:
+            search_messages = await self._acontext_messages(state)
+            self.speculations.start(key, lambda sink: self._asearch(search_messages, sink))
+        try:
+            messages = self._supervisor_messages(state)
+            model = await lazy.aget(self, "supervisor_model")
+            router = await lazy.aget(self, "supervisor_router")
+            response = await self.llm_flights.ado(request_key(model, messages), lambda: router.ainvoke(messages))
+            update = self._parse_supervisor(state, response)
+        except BaseException:
+            self.speculations.cancel(key)
+            raise
+        if update["type"] != "search":
+            self.speculations.cancel(key)
+        return update
 
-        # 获取搜索结果，传递完整的消息历史以保持上下文
-        if len(state["message"]) > 6: # 只保留最近6条消息，避免过长
-            search_messages = state["message"][-6:]
-        else:
-            search_messages = state["message"]
-        # 获取搜索结果
-        search_result = self.mcp_client.invoke_with_context(search_messages)
 
+    def _context_messages(self, state: state.State) -> list:
+        """获取对话上下文，按token预算保留最近的历史，更早的历史用滚动摘要代替"""
+        return self.context_window.build(state["message"])
+
+
+    async def _acontext_messages(self, state: state.State) -> list:
+        context_window = await lazy.aget(self, "context_window")
+        return context_window.build(state["message"])
+
+
+    def _search_update(self, search_result: str) -> dict:
         # 如果没有获取到结果，使用默认消息
         if not search_result:
             search_result = "搜索完成，但未找到相关结果。"
 
-        # if len(search_result) > 500:  # 短结果直接返回
-        #     send_memory_message.delay({"type": "summarize", "text": search_result, "ts": int(time.time())})
-
         return {"message": [AIMessage(content=search_result)], "type": "search"}
 
 
+    def _cache_search_result(self, search_messages: list, search_result: str):
+        """只缓存成功的搜索结果"""
+        if search_result and not search_result.startswith("查询失败"):
+            self.search_cache.put(search_messages, search_result)
+
+
+    def search_node(self, state: state.State) -> dict:
+        logger.info(">>> Search Node")
+        search_messages = self._context_messages(state)
+        sink = current_sink()
+        cached = self.search_cache.get(search_messages)
+        if cached is not None:
+            logger.info("命中搜索结果缓存")
+            if sink is not None:
+                sink.emit_sync({"type": "token", "node": "search", "content": cached})
+            return self._search_update(cached)
+        search_result = self.mcp_client.invoke_with_context(search_messages, sink)
+        self._cache_search_result(search_messages, search_result)
+        return self._search_update(search_result)
+
+
+    async def _asearch(self, search_messages: list, sink) -> str:
+        """异步搜索，先查缓存，未命中时运行ReAct"""
+        # 缓存查找可能涉及SQLite和embedding调用，放到线程中避免阻塞事件循环
+        cached = await asyncio.to_thread(self.search_cache.get, search_messages)
+        if cached is not None:
+            logger.info("命中搜索结果缓存")
+            if sink is not None:
+                await sink.emit({"type": "token", "node": "search", "content": cached})
+            return cached
+        # 直接在当前事件循环中运行ReAct，工具调用会派发到MCP会话池
+        mcp_client = await lazy.aget(self, "mcp_client")
+        search_result = await mcp_client.main_with_context(search_messages, sink)
+        await asyncio.to_thread(self._cache_search_result, search_messages, search_result)
+        return search_result
+
+
+    async def asearch_node(self, state: state.State) -> dict:
+        logger.info(">>> Search Node")
+        sink = current_sink()
+        # supervisor分类时已经开始的推测搜索
+        speculation = self.speculations.take(state["message"][-1].id)
+        if speculation is not None:
+            logger.info("接管推测执行的搜索")
+            return self._search_update(await speculation.result(sink))
+        return self._search_update(await self._asearch(await self._acontext_messages(state), sink))
+
+
+    def _respond(self, messages: list, node: str):
+        """调用对话模型生成回答，有调用方订阅时逐token转发"""
+        sink = current_sink()
+        key = request_key(self.llm, messages)
+        if sink is None:
+            return self.llm_flights.do(key, lambda: self.chat_router.invoke(messages))
+        response = None
+        for chunk in self.llm_flights.stream(key, lambda: self.chat_router.stream(messages)):
+            if chunk.content:
+                sink.emit_sync({"type": "token", "node": node, "content": chunk.content})
+            response = chunk if response is None else response + chunk
+        return message_chunk_to_message(response)
+
+
+    async def _arespond(self, messages: list, node: str):
+        sink = current_sink()
+        key = request_key(await lazy.aget(self, "llm"), messages)
+        router = await lazy.aget(self, "chat_router")
+        if sink is None:
+            return await self.llm_flights.ado(key, lambda: router.ainvoke(messages))
+        response = None
+        async for chunk in self.llm_flights.astream(key, lambda: router.astream(messages)):
+            if chunk.content:
+                await sink.emit({"type": "token", "node": node, "content": chunk.content})
+            response = chunk if response is None else response + chunk
+        return message_chunk_to_message(response)
+
+
+    def _rag_messages(self, state: state.State, hits: list[dict]) -> list:
+        """把检索到的片段拼进系统提示词"""
+        context = "\n\n".join(
+            f"[{i}] {hit['title']}（{hit['authors']}，{hit['year']}）\n{hit['snippet']}"
+            for i, hit in enumerate(hits, 1)
+        )
+        return [SystemMessage(content=RAG_PROMPT.format(context=context))] + self._context_messages(state)
+
+
     def rag_node(self, state: state.State) -> str:
         logger.info(">>> RAG Node")
-        return {"message": [HumanMessage(content="RAG响应")], "type": "rag"}
+        hits = self.retriever.search(state["message"][-1].content, k=self.rag_top_k) if self.retriever else []
+        if not hits:
+            # 本地索引不可用或没有命中时退回MCP搜索
+            logger.info("本地Zotero索引没有结果，转为MCP搜索")
+            return self.search_node(state)
+        response = self._respond(self._rag_messages(state, hits), "rag")
+        return {"message": response, "type": "rag"}
+
+
+    async def arag_node(self, state: state.State) -> str:
+        logger.info(">>> RAG Node")
+        hits = []
+        retriever = await lazy.aget(self, "retriever")
+        if retriever:
+            # 查询向量计算和矩阵乘法都是CPU操作，放到线程中
+            hits = await asyncio.to_thread(retriever.search, state["message"][-1].content, self.rag_top_k)
+        if not hits:
+            logger.info("本地Zotero索引没有结果，转为MCP搜索")
+            return await self.asearch_node(state)
+        # _rag_messages会用到上下文窗口，先在线程中创建
+        await lazy.aget(self, "context_window")
+        response = await self._arespond(self._rag_messages(state, hits), "rag")
+        return {"message": response, "type": "rag"}
 
 
     def chat_node(self, state: state.State) -> str:
         logger.info(">>> Chat Node")
         
-        response = self.llm.invoke(state["message"][-1].content)
+        response = self._respond(self._context_messages(state), "chat")
+
+        return {"message": response, "type": "chat"}
+
+
+    async def achat_node(self, state: state.State) -> str:
+        logger.info(">>> Chat Node")
+
+        response = await self._arespond(await self._acontext_messages(state), "chat")
 
         return {"message": response, "type": "chat"}
 
@@ -111,6 +516,10 @@ class Agent:
         return {"message": [HumanMessage(content="无法回答")], "type": "other"}
 
 
+    async def aother_node(self, state: state.State) -> str:
+        return self.other_node(state)
+
+
     def routing_func(self, state: state.State) -> str:
         if state["type"] == "search":
             return "search_node"
@@ -124,7 +533,110 @@ class Agent:
             return END
 
 
-    def agent(self, question: str):
+    def build_graph(self):
+        """构建并编译Director_Agent图，只在初始化时调用一次
+
+        每个节点同时提供同步和异步实现，invoke/stream走同步节点，ainvoke/astream走异步节点
+        """
+        return (StateGraph(state.State, context_schema=state.Context)
+            .add_node("supervisor_node", RunnableLambda(self.supervisor_node, afunc=self.asupervisor_node))
+            .add_node("search_node", RunnableLambda(self.search_node, afunc=self.asearch_node))
+            .add_node("rag_node", RunnableLambda(self.rag_node, afunc=self.arag_node))
+            .add_node("chat_node", RunnableLambda(self.chat_node, afunc=self.achat_node))
+            .add_node("other_node", RunnableLambda(self.other_node, afunc=self.aother_node))
+            .set_entry_point("supervisor_node")
+            .add_conditional_edges("supervisor_node", self.routing_func)
+            .add_edge("search_node", "supervisor_node")
+            .add_edge("rag_node", "supervisor_node")
+            .add_edge("chat_node", "supervisor_node")
+            .add_edge("other_node", "supervisor_node")
+        ).compile(name="Director_Agent", checkpointer=self.checkpointer).with_config(callbacks=[self.metrics, *([self.tracer] if self.tracer else [])])
+
+
+    def _thread_lock(self, thread_id: str) -> threading.Lock:
+        """获取thread_id对应的锁，同一会话的多次提问不能交错写入checkpoint"""
+        with self._thread_locks_guard:
+            lock = self._thread_locks.get(thread_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._thread_locks[thread_id] = lock
+            return lock
+
+
+    def _prepare(self, question: str, thread_id: str | None):
+        """发送长记忆任务并构建图的输入和配置"""
+        # 长记忆消息只放入本地缓冲区，由后台线程发送，不阻塞回答
+        self.memory_publisher.publish({"type": "extract", "text": question, "ts": int(time.time())})
+
+        config = {"configurable": {"thread_id": thread_id or str(uuid.uuid4())}}
+        # type置空，保证同一thread_id的后续提问会重新经过supervisor分类
+        inputs = {"message": [HumanMessage(content=question)], "type": ""}
+        return inputs, config
+
+
+    def ask(self, question: str, thread_id: str | None = None, on_event=None) -> str:
+        """提问并返回最终回答，线程安全，可在多个线程中并发调用
+
+        传入on_event回调时，节点内部的token和工具调用事件会实时回调，格式见agent.streaming
+        """
+        inputs, config = self._prepare(question, thread_id)
+        token = set_sink(CallbackSink(on_event) if on_event else None)
+        try:
+            with self._thread_lock(config["configurable"]["thread_id"]):
+                response = self.graph.invoke(inputs, config=config)
+        finally:
+            reset_sink(token)
+            self._forget_anonymous(thread_id, config)
+        return response["message"][-1].content
+
+
+    def _forget_anonymous(self, thread_id: str | None, config: dict):
+        """没有传入thread_id的提问只用一次，结束后删除它的checkpoint，否则每个匿名提问都会永久留在checkpointer中"""
+        if thread_id is None:
+            self.checkpointer.delete_thread(config["configurable"]["thread_id"])
+
+
+    async def _aforget_anonymous(self, thread_id: str | None, config: dict):
+        if thread_id is None:
+            await self.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+
+
+    @asynccontextmanager
+    async def _athread_lock(self, thread_id: str):
+        """在协程中持有thread_id对应的锁，与ask/agent使用同一把threading.Lock，等待时不阻塞事件循环
+
+        不能用to_thread(lock.acquire)等待：同一会话的等待者会占满默认线程池，
+        持有锁的请求拿不到线程做checkpoint读写，整个进程死锁。这里用非阻塞尝试加退避轮询
+        """
+        lock = self._thread_lock(thread_id)
+        delay = 0.001
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            lock.release()
+
+
+    async def aask(self, question: str, thread_id: str | None = None) -> str:
+        """异步提问，所有节点都在当前事件循环中运行，可以大量并发"""
+        inputs, config = self._prepare(question, thread_id)
+        try:
+            async with self._athread_lock(config["configurable"]["thread_id"]):
+                response = await self.graph.ainvoke(inputs, config=config)
+        finally:
+            await self._aforget_anonymous(thread_id, config)
+        return response["message"][-1].content
+
+
+    def ask_many(self, questions: list[str], max_workers: int = 8) -> list[str]:
+        """并发回答多个问题，结果顺序与输入一致"""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.ask, questions))
+
+
+    def agent(self, question: str, thread_id: str | None = None):
         
         # # 启动异步任务处理长记忆，不阻塞graph执行
         # memory_thread = threading.Thread(
@@ -134,35 +646,68 @@ class Agent:
         # )
         # memory_thread.start()
         
-        # 使用Celery异步处理长记忆
-        send_memory_message.delay({"type": "extract", "text": question, "ts": int(time.time())})
-        
-        graph = (StateGraph(state.State, context_schema=state.Context)
-            .add_node("supervisor_node", self.supervisor_node)
-            .add_node("search_node", self.search_node)
-            .add_node("rag_node", self.rag_node)
-            .add_node("chat_node", self.chat_node)
-            .add_node("other_node", self.other_node)
-            .set_entry_point("supervisor_node")
-            .add_conditional_edges("supervisor_node", self.routing_func)
-            .add_edge("search_node", "supervisor_node")
-            .add_edge("rag_node", "supervisor_node")
-            .add_edge("chat_node", "supervisor_node")
-            .add_edge("other_node", "supervisor_node")
-        ).compile(name="Director_Agent", checkpointer=InMemorySaver())
+        inputs, config = self._prepare(question, thread_id)
 
-        config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+        try:
+            with self._thread_lock(config["configurable"]["thread_id"]):
+                for chunk in self.graph.stream(
+                    inputs,
+                    config=config,
+                    stream_mode="updates"
+                ):
+                    print(chunk)
+        finally:
+            self._forget_anonymous(thread_id, config)
 
-        for chunk in graph.invoke(
-            {"message": [HumanMessage(content=question)]},
-            config=config,
-            stream_mode="updates"
-        ):
-            print(chunk)
 
-        # response = graph.invoke(
-        #     {"message": [HumanMessage(content=question)]},
-        #     config=config,
-        # )
+    async def aagent(self, question: str, thread_id: str | None = None):
+        """异步流式入口，逐个产出节点的更新"""
+        inputs, config = self._prepare(question, thread_id)
+        try:
+            async with self._athread_lock(config["configurable"]["thread_id"]):
+                async for chunk in self.graph.astream(
+                    inputs,
+                    config=config,
+                    stream_mode="updates"
+                ):
+                    yield chunk
+        finally:
+            await self._aforget_anonymous(thread_id, config)
+
+
+    async def astream(self, question: str, thread_id: str | None = None, maxsize: int = 256):
+        """异步流式回答，实时产出节点内部的token和工具调用事件，最后产出final事件
+
+        事件经过有界队列传递，调用方消费慢时节点会在发送处等待（背压）
+        """
+        sink = QueueSink(maxsize=maxsize)
+        # 先设置sink再创建任务，任务会复制当前上下文
+        token = set_sink(sink)
+        try:
+            task = asyncio.create_task(self.aask(question, thread_id))
+        finally:
+            reset_sink(token)
+        task.add_done_callback(lambda _: asyncio.ensure_future(sink.close()))
+        try:
+            async for event in sink:
+                yield event
+            yield {"type": "final", "content": await task}
+        finally:
+            # 调用方提前退出时取消图的执行
+            if not task.done():
+                task.cancel()
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
 
-        # return response["message"][-1].content
\ No newline at end of file
+def __getattr__(name: str):
+    """langgraph.json 中的 ./src/agent/graph.py:graph，首次访问时才创建Agent"""
+    global _graph
+    if name != "graph":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _graph_lock:
+        if _graph is None:
+            _graph = Agent().graph
+    return _graph
@@ -4,15 +4,15 @@ import os
 
 class LangsmithClient:
 
-    def langsmith_client() -> Client:
+    def langsmith_client() -> Client | None:
         # 加载环境变量
         found = find_dotenv('.env.example', raise_error_if_not_found=False)
         if found:
             load_dotenv(found, override=False)
         langsmith_api_key = os.getenv('LANGSMITH_API_KEY')
-        # 设置环境变量
-        os.environ["LANGSMITH_PROJECT"] = "Director_Agent"
-        os.environ["LANGSMITH_TRACING"] = "true"
-        os.environ["LANGSMITH_ENDPOINT"] = "https://api.smith.langchain.com"
-        os.environ["LANGSMITH_API_KEY"] = langsmith_api_key
-        return Client(api_key=os.getenv("LANGSMITH_API_KEY"))
+        if not langsmith_api_key:
+            return None
+        # 只设置默认值，不再强制开启LangChain自带的全量追踪，采样追踪见agent.tracing
+        os.environ.setdefault("LANGSMITH_PROJECT", "Director_Agent")
+        os.environ.setdefault("LANGSMITH_ENDPOINT", "https://api.smith.langchain.com")
+        return Client(api_key=langsmith_api_key, api_url=os.environ["LANGSMITH_ENDPOINT"])
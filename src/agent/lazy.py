@@ -0,0 +1,57 @@
+"""惰性初始化
+
+lazy把方法变成线程安全的惰性属性：第一次访问时才调用方法创建对象，结果缓存在实例上，
+之后的访问直接读实例属性，不再加锁。并发的首次访问只会创建一次，其余线程等待同一个结果。
+创建可能很慢（加载模型、连接MCP服务），协程中用 await lazy.aget(instance, name) 读取，不阻塞事件循环。
+"""
+
+import asyncio
+import threading
+import time
+
+from loguru import logger
+
+
+class lazy:
+    """线程安全的惰性属性，每个属性的创建耗时记录在 lazy.timings(instance) 中"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.__doc__ = factory.__doc__
+        self._lock = threading.Lock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self._lock:
+            # 等锁期间其它线程可能已经创建好了
+            if self.name in instance.__dict__:
+                return instance.__dict__[self.name]
+            start = time.perf_counter()
+            value = self.factory(instance)
+            elapsed = time.perf_counter() - start
+            instance.__dict__[self.name] = value
+            instance.__dict__.setdefault("_lazy_timings", {})[self.name] = elapsed
+        logger.info(f"{type(instance).__name__}.{self.name} 初始化完成，耗时 {elapsed:.3f}s")
+        return value
+
+    @staticmethod
+    def loaded(instance, name: str) -> bool:
+        """属性是否已经创建"""
+        return name in instance.__dict__
+
+    @staticmethod
+    async def aget(instance, name: str):
+        """在协程中读取惰性属性：已创建时直接返回，否则在线程中创建（或等待其它线程创建完成）"""
+        if name in instance.__dict__:
+            return instance.__dict__[name]
+        return await asyncio.to_thread(getattr, instance, name)
+
+    @staticmethod
+    def timings(instance) -> dict[str, float]:
+        """已创建的惰性属性及其创建耗时（秒）"""
+        return dict(instance.__dict__.get("_lazy_timings", {}))
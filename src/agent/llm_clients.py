@@ -0,0 +1,282 @@
+"""模型客户端工厂
+
+同一个服务端点的所有ChatOpenAI/OpenAIEmbeddings共享一对httpx客户端（同步和异步各一个），
+长连接复用，不会为每个客户端重新建立TLS连接。异步连接和其中的锁绑定在创建它们的事件循环上，
+所以异步客户端在每个事件循环中各用一个连接池（MCP后台循环、调用方的循环、asyncio.run各不相同）。相同端点、模型和参数的ChatOpenAI只创建一次。
+请求在进入连接池前经过端点的调度器（agent.llm_scheduler），按优先级排队，
+并发数和请求速率不超过配置，后台的记忆提取不会挤占交互请求。
+
+端点及其环境变量（NAME为QWEN或OLLAMA）：
+    {NAME}_API_BASE          服务地址
+    {NAME}_MAX_CONNECTIONS   最大连接数
+    {NAME}_MAX_KEEPALIVE     最多保持的空闲长连接数
+    {NAME}_KEEPALIVE_EXPIRY  空闲长连接的保持时间（秒）
+    {NAME}_CONNECT_TIMEOUT   建立连接超时（秒）
+    {NAME}_READ_TIMEOUT      读超时（秒），连接池排队也使用这个超时
+    {NAME}_MAX_RETRIES       失败重试次数，由openai SDK按带抖动的指数退避重试
+    {NAME}_HTTP2             是否启用HTTP/2，需要安装h2
+    {NAME}_CONCURRENCY       同时进行的请求数上限
+    {NAME}_BACKGROUND_CONCURRENCY  后台请求（记忆提取、摘要）最多占用的并发数
+    {NAME}_RPM               每分钟请求数上限，0表示不限
+    {NAME}_BURST             限速时允许的突发请求数，默认为一秒的配额
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from dataclasses import dataclass
+
+import httpx
+from loguru import logger
+
+from agent.llm_scheduler import AsyncSchedulingTransport, Scheduler, SchedulingTransport
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    name: str
+    default_base: str
+    # 没有设置{NAME}_API_KEY时使用的key
+    default_key: str | None
+    max_connections: int
+    max_keepalive: int
+    keepalive_expiry: float
+    connect_timeout: float
+    read_timeout: float
+    max_retries: int
+    http2: bool
+    concurrency: int
+    background_concurrency: int
+    rpm: float
+
+    def env(self, key: str, default):
+        value = os.getenv(f"{self.name}_{key}")
+        if value is None:
+            return default
+        if isinstance(default, bool):
+            return value.lower() in ("1", "true", "yes")
+        return type(default)(value)
+
+    @property
+    def base_url(self) -> str:
+        return self.env("API_BASE", self.default_base)
+
+    @property
+    def api_key(self) -> str | None:
+        return os.getenv(f"{self.name}_API_KEY", self.default_key)
+
+
+ENDPOINTS = {
+    # DashScope：远端TLS，多保留长连接并延长保持时间，避免重新握手
+    "qwen": Endpoint(
+        name="QWEN",
+        default_base="https://dashscope.aliyuncs.com/compatible-mode/v1",
+        default_key=None,
+        max_connections=64,
+        max_keepalive=32,
+        keepalive_expiry=120.0,
+        connect_timeout=10.0,
+        read_timeout=120.0,
+        max_retries=3,
+        http2=True,
+        concurrency=32,
+        background_concurrency=8,
+        rpm=0.0,
+    ),
+    # 本地Ollama：并行能力有限，连接数少，请求在连接池中排队
+    "ollama": Endpoint(
+        name="OLLAMA",
+        default_base="http://localhost:11434/v1",
+        default_key="ollama",
+        max_connections=8,
+        max_keepalive=8,
+        keepalive_expiry=300.0,
+        connect_timeout=5.0,
+        read_timeout=300.0,
+        max_retries=2,
+        http2=False,
+        # Ollama默认只并行处理4个请求（OLLAMA_NUM_PARALLEL），多余的请求在调度器中按优先级排队
+        concurrency=4,
+        # Agent进程中留出3个名额给supervisor等交互请求；mq_consumer进程没有交互请求，启动时放开这个上限
+        background_concurrency=1,
+        rpm=0.0,
+    ),
+}
+
+_lock = threading.Lock()
+# (端点, 地址) -> (同步客户端, 异步客户端)
+_http_clients: dict[tuple[str, str], tuple[httpx.Client, httpx.AsyncClient]] = {}
+_schedulers: dict[str, Scheduler] = {}
+_models: dict[tuple, object] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def timeout(endpoint: str) -> httpx.Timeout:
+    config = ENDPOINTS[endpoint]
+    read = config.env("READ_TIMEOUT", config.read_timeout)
+    return httpx.Timeout(read, connect=config.env("CONNECT_TIMEOUT", config.connect_timeout), pool=read)
+
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """按当前事件循环分发到各自的传输层，事件循环关闭后它的连接池随之丢弃"""
+
+    def __init__(self, create):
+        self._create = create
+        self._lock = threading.Lock()
+        self._transports: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def transport(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for closed in [other for other in self._transports if other.is_closed()]:
+                del self._transports[closed]
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = self._create()
+            return transport
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._transports)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.transport().handle_async_request(request)
+
+    async def aclose(self):
+        """关闭当前事件循环的连接池，其它循环的连接池只能在各自的循环中关闭"""
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+def scheduler(endpoint: str) -> Scheduler:
+    """端点的请求调度器，同一端点的同步和异步客户端共用"""
+    config = ENDPOINTS[endpoint]
+    with _lock:
+        instance = _schedulers.get(endpoint)
+        if instance is None:
+            burst = config.env("BURST", 0)
+            instance = _schedulers[endpoint] = Scheduler(
+                endpoint,
+                concurrency=config.env("CONCURRENCY", config.concurrency),
+                rpm=config.env("RPM", config.rpm),
+                burst=burst or None,
+                background_concurrency=config.env("BACKGROUND_CONCURRENCY", config.background_concurrency),
+            )
+        return instance
+
+
+def http_clients(endpoint: str) -> tuple[httpx.Client, httpx.AsyncClient]:
+    """端点共享的同步/异步httpx客户端"""
+    config = ENDPOINTS[endpoint]
+    key = (endpoint, config.base_url)
+    limiter = scheduler(endpoint)
+    with _lock:
+        clients = _http_clients.get(key)
+        if clients is not None:
+            return clients
+        limits = httpx.Limits(
+            max_connections=config.env("MAX_CONNECTIONS", config.max_connections),
+            max_keepalive_connections=config.env("MAX_KEEPALIVE", config.max_keepalive),
+            keepalive_expiry=config.env("KEEPALIVE_EXPIRY", config.keepalive_expiry),
+        )
+        http2 = config.env("HTTP2", config.http2)
+        if http2 and not _http2_available():
+            logger.info(f"{endpoint} 未安装h2，使用HTTP/1.1")
+            http2 = False
+        # 排队超时和连接池超时一致
+        wait = timeout(endpoint).pool
+        clients = (
+            httpx.Client(
+                transport=SchedulingTransport(httpx.HTTPTransport(limits=limits, http2=http2), limiter, wait),
+                timeout=timeout(endpoint),
+            ),
+            httpx.AsyncClient(
+                transport=LoopLocalTransport(
+                    lambda: AsyncSchedulingTransport(httpx.AsyncHTTPTransport(limits=limits, http2=http2), limiter, wait)
+                ),
+                timeout=timeout(endpoint),
+            ),
+        )
+        _http_clients[key] = clients
+        logger.info(
+            f"{endpoint} 连接池: 最多 {limits.max_connections} 个连接, 并发 {limiter.concurrency}, HTTP/2={http2}"
+        )
+        return clients
+
+
+def _cached(kind: str, endpoint: str, model: str, kwargs: dict, create):
+    config = ENDPOINTS[endpoint]
+    key = (kind, endpoint, config.base_url, config.api_key, model, tuple(sorted(kwargs.items())))
+    with _lock:
+        instance = _models.get(key)
+    if instance is None:
+        instance = create()
+        with _lock:
+            instance = _models.setdefault(key, instance)
+    return instance
+
+
+def chat_model(endpoint: str, model: str, **kwargs):
+    """指定端点上的ChatOpenAI，相同参数返回同一个实例"""
+    from langchain_openai import ChatOpenAI
+
+    config = ENDPOINTS[endpoint]
+
+    def create():
+        client, async_client = http_clients(endpoint)
+        return ChatOpenAI(
+            model=model,
+            openai_api_key=config.api_key,
+            openai_api_base=config.base_url,
+            http_client=client,
+            http_async_client=async_client,
+            timeout=timeout(endpoint),
+            max_retries=config.env("MAX_RETRIES", config.max_retries),
+            **kwargs,
+        )
+
+    return _cached("chat", endpoint, model, kwargs, create)
+
+
+def embeddings(endpoint: str, model: str, **kwargs):
+    """指定端点上的OpenAIEmbeddings，相同参数返回同一个实例"""
+    from langchain_openai import OpenAIEmbeddings
+
+    config = ENDPOINTS[endpoint]
+
+    def create():
+        client, async_client = http_clients(endpoint)
+        return OpenAIEmbeddings(
+            model=model,
+            openai_api_key=config.api_key,
+            openai_api_base=config.base_url,
+            http_client=client,
+            http_async_client=async_client,
+            timeout=timeout(endpoint),
+            max_retries=config.env("MAX_RETRIES", config.max_retries),
+            **kwargs,
+        )
+
+    return _cached("embeddings", endpoint, model, kwargs, create)
+
+
+def close():
+    """关闭所有连接池，之后再创建的模型客户端会使用新的连接池"""
+    with _lock:
+        clients = list(_http_clients.values())
+        _http_clients.clear()
+        _models.clear()
+        _schedulers.clear()
+    for client, _ in clients:
+        client.close()
+    # 异步连接池绑定在各自的事件循环上，不能在这里关闭，随客户端一起交给垃圾回收
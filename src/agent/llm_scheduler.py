@@ -0,0 +1,285 @@
+"""模型请求调度
+
+每个服务端点一个Scheduler，放在共享连接池的httpx传输层前面（见agent.llm_clients），
+同一进程中所有模型请求都经过它：
+
+- 并发上限：同时进行的请求数不超过concurrency，请求的响应流关闭后才释放名额
+- 令牌桶限速：每分钟最多rpm个请求，允许burst个突发
+- 优先级：排队的请求按优先级放行，交互请求（supervisor、chat、search）总是先于后台请求（记忆提取、摘要）
+- 后台并发上限：后台请求最多占用background_concurrency个名额，其余名额留给交互请求。
+  记忆提取在mq_consumer进程中运行，与Agent进程不共享队列，这个上限决定了它最多压给Ollama多少并发
+
+请求的优先级来自当前上下文，用 with priority(BACKGROUND): ... 设置，默认为INTERACTIVE。
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+import httpx
+
+from agent.metrics import REGISTRY
+
+INTERACTIVE = 0
+# 推测执行的搜索，结果可能被丢弃，排在确定要用的请求之后
+SPECULATIVE = 5
+BACKGROUND = 10
+PRIORITY_NAMES = {INTERACTIVE: "interactive", SPECULATIVE: "speculative", BACKGROUND: "background"}
+
+_priority: ContextVar[int] = ContextVar("llm_priority", default=INTERACTIVE)
+
+QUEUE_DEPTH = REGISTRY.gauge("agent_llm_queue_depth", "排队等待的模型请求数", ("backend", "priority"))
+QUEUE_WAIT = REGISTRY.histogram("agent_llm_queue_wait_seconds", "模型请求的排队时间", ("backend", "priority"))
+IN_FLIGHT = REGISTRY.gauge("agent_llm_in_flight", "进行中的模型请求数", ("backend",))
+
+
+@contextmanager
+def priority(level: int):
+    """在上下文中设置模型请求的优先级，数值越小越优先"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def set_priority(level: int):
+    """设置当前上下文的优先级，用于在copy_context()得到的上下文中运行，返回可用于reset的token"""
+    return _priority.set(level)
+
+
+class _Waiter:
+    """排队中的一个请求，同步请求用threading.Event通知，异步请求用所在事件循环的Future通知"""
+
+    def __init__(self, level: int, loop: asyncio.AbstractEventLoop | None = None):
+        self.level = level
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Scheduler:
+    """带优先级的并发上限和令牌桶限速，可同时被多个线程和多个事件循环使用"""
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        rpm: float = 0,
+        burst: int | None = None,
+        background_concurrency: int | None = None,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.background_concurrency = background_concurrency or concurrency
+        # 令牌桶：每秒补充rate个令牌，最多burst个；rpm为0时不限速
+        self.rate = rpm / 60.0
+        self.burst = burst or max(1, int(self.rate)) if self.rate else 0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+        self._queue: list = []
+        self._seq = itertools.count()
+        self.active = 0
+        self.active_background = 0
+
+    def _refill(self, now: float):
+        if not self.rate:
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _dispatch(self):
+        """按优先级放行排队的请求，必须持有锁"""
+        now = time.monotonic()
+        self._refill(now)
+        while self._queue and self.active < self.concurrency:
+            waiter = self._queue[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            # 队首是后台请求说明没有更优先的请求在排队
+            if waiter.level >= BACKGROUND and self.active_background >= self.background_concurrency:
+                return
+            if self.rate and self._tokens < 1:
+                # 等下一个令牌补充后再放行
+                if self._timer is None:
+                    self._timer = threading.Timer((1 - self._tokens) / self.rate, self._on_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            heapq.heappop(self._queue)
+            if self.rate:
+                self._tokens -= 1
+            self.active += 1
+            if waiter.level >= BACKGROUND:
+                self.active_background += 1
+            self._observe(waiter, now)
+            waiter.grant()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _observe(self, waiter: _Waiter, now: float):
+        name = PRIORITY_NAMES.get(waiter.level, str(waiter.level))
+        QUEUE_DEPTH.dec(backend=self.name, priority=name)
+        QUEUE_WAIT.observe(now - waiter.enqueued, backend=self.name, priority=name)
+        IN_FLIGHT.inc(backend=self.name)
+
+    def _enqueue(self, waiter: _Waiter):
+        QUEUE_DEPTH.inc(backend=self.name, priority=PRIORITY_NAMES.get(waiter.level, str(waiter.level)))
+        with self._lock:
+            heapq.heappush(self._queue, (waiter.level, next(self._seq), waiter))
+            self._dispatch()
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """取消排队，返回是否已经拿到名额（拿到了就需要release）"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+        QUEUE_DEPTH.dec(backend=self.name, priority=PRIORITY_NAMES.get(waiter.level, str(waiter.level)))
+        return False
+
+    def acquire(self, level: int | None = None, timeout: float | None = None) -> int:
+        """同步获取名额，返回请求的优先级（release时传回），超时抛出httpx.PoolTimeout"""
+        waiter = _Waiter(current_priority() if level is None else level)
+        self._enqueue(waiter)
+        if not waiter.event.wait(timeout) and self._cancel(waiter) is False:
+            raise httpx.PoolTimeout(f"{self.name} 排队超过 {timeout}s")
+        return waiter.level
+
+    async def aacquire(self, level: int | None = None, timeout: float | None = None) -> int:
+        """异步获取名额，等待期间被取消时自动退出队列"""
+        waiter = _Waiter(current_priority() if level is None else level, asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            if self._cancel(waiter):
+                self.release(waiter.level)
+            if isinstance(e, asyncio.TimeoutError):
+                raise httpx.PoolTimeout(f"{self.name} 排队超过 {timeout}s") from e
+            raise
+        return waiter.level
+
+    def release(self, level: int = INTERACTIVE):
+        IN_FLIGHT.dec(backend=self.name)
+        with self._lock:
+            self.active -= 1
+            if level >= BACKGROUND:
+                self.active_background -= 1
+            self._dispatch()
+
+    def queued(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, waiter in self._queue if not waiter.cancelled)
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """响应流关闭时释放调度名额（流式输出要等读完才算请求结束）"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            release, self._release = self._release, None
+            if release:
+                release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release:
+                release()
+
+
+class SchedulingTransport(httpx.BaseTransport):
+    """在底层传输前排队的同步传输"""
+
+    def __init__(self, transport: httpx.BaseTransport, scheduler: Scheduler, timeout: float | None = None):
+        self.transport = transport
+        self.scheduler = scheduler
+        self.timeout = timeout
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        level = self.scheduler.acquire(timeout=self.timeout)
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            self.scheduler.release(level)
+            raise
+        response.stream = _ReleasingStream(response.stream, partial(self.scheduler.release, level))
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncSchedulingTransport(httpx.AsyncBaseTransport):
+    """在底层传输前排队的异步传输"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, scheduler: Scheduler, timeout: float | None = None):
+        self.transport = transport
+        self.scheduler = scheduler
+        self.timeout = timeout
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        level = await self.scheduler.aacquire(timeout=self.timeout)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self.scheduler.release(level)
+            raise
+        response.stream = _AsyncReleasingStream(response.stream, partial(self.scheduler.release, level))
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -1,32 +1,43 @@
-from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.prebuilt import create_react_agent
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from loguru import logger
 import asyncio
+import os
+import shlex
+
+from agent.mcp_pool import MCPSessionPool
+from agent.tool_cache import ToolCallCache
+from agent.streaming import EventSink
+
+def zotero_connection() -> dict:
+    """zotero-mcp 的stdio连接配置，命令和参数可以用环境变量替换（例如基准测试中的假服务）"""
+    return {
+        "command": os.getenv("ZOTERO_MCP_COMMAND", "C:\\Users\\71949\\.local\\bin\\zotero-mcp.EXE"),
+        "transport": "stdio",
+        "args": shlex.split(os.getenv("ZOTERO_MCP_ARGS", "serve --transport stdio")),
+        "env": {
+            "ZOTERO_LOCAL": "true"
+        }
+    }
 
 class MCPClient:
-    def __init__(self, llm=None):
+    def __init__(self, llm=None, pool_size: int = 4):
+        if llm is None:
+            from agent.llm_clients import chat_model
+
+            llm = chat_model("qwen", "qwen3-next-80b-a3b-thinking")
         self.llm = llm
-        self.mcp_client = None
+        self.mcp_pool = None
         self.agent_with_tools = None
+        self.tool_cache = ToolCallCache(default_ttl=float(os.getenv("TOOL_CACHE_TTL", "300")))
         
-        """异步初始化MCP客户端和agent"""  
+        """初始化MCP会话池和agent"""  
         try:
-            self.mcp_client = MultiServerMCPClient(
-                {
-                    "zotero": {
-                        "command": "C:\\Users\\71949\\.local\\bin\\zotero-mcp.EXE",
-                        "transport": "stdio",
-                        "args": ["serve", "--transport", "stdio"],
-                        "env": {
-                            "ZOTERO_LOCAL": "true"
-                        }
-                    }
-                }
-            )
+            # 会话池在后台事件循环中常驻，工具调用复用已握手的zotero-mcp子进程
+            self.mcp_pool = MCPSessionPool(zotero_connection(), max_size=pool_size)
             
             logger.info("正在连接MCP客户端...")
-            tools = asyncio.run(self.mcp_client.get_tools())
+            tools = self.mcp_pool.get_tools()
             logger.info(f"成功获取到 {len(tools)} 个工具")
             
             # 过滤掉有问题的工具名称
@@ -39,6 +50,8 @@ class MCPClient:
                     continue
                 filtered_tools.append(tool)
             
+            # 相同参数的重复工具调用直接命中进程内缓存，不再访问Zotero
+            filtered_tools = self.tool_cache.wrap(filtered_tools)
             logger.info(f"使用 {len(filtered_tools)} 个工具创建agent...")
             
             self.agent_with_tools = create_react_agent(
@@ -49,6 +62,9 @@ class MCPClient:
             
         except Exception as e:
             logger.error(f"MCP客户端初始化失败: {e}")
+            if self.mcp_pool is not None:
+                self.mcp_pool.close()
+                self.mcp_pool = None
             # 创建无工具的备用agent
             self.agent_with_tools = create_react_agent(
                 model=self.llm,
@@ -56,29 +72,56 @@ class MCPClient:
             )
             logger.info("使用无工具的备用agent")
         
-    async def main_with_context(self, messages: list):
-        """执行查询，传入最近的消息历史"""
-        logger.info("开始搜索论文...")
-        result = ""
-        
+    async def astream_with_context(self, messages: list):
+        """流式执行查询，逐个产出token、工具调用和工具结果事件"""
         # 构建完整的消息列表
         full_messages = [
             SystemMessage(content="你是一个zotero搜索助手。请根据以下消息历史进行搜索，不要做出跟用户需求无关的内容和推荐，并且用中文回复。")
         ] + messages
+
+        async for mode, chunk in self.agent_with_tools.astream(
+            {"messages": full_messages},
+            stream_mode=["messages", "updates"]
+        ):
+            if mode == "messages":
+                message = chunk[0]
+                if isinstance(message, ToolMessage):
+                    yield {"type": "tool_result", "node": "search", "name": message.name, "content": message.content}
+                elif message.content:
+                    yield {"type": "token", "node": "search", "content": message.content}
+                continue
+            # updates中是完整的消息，从中取出完整的工具调用
+            for update in chunk.values():
+                for message in (update or {}).get("messages", []):
+                    for tool_call in getattr(message, "tool_calls", None) or []:
+                        yield {"type": "tool_call", "node": "search", "name": tool_call["name"], "args": tool_call["args"]}
+
+    async def main_with_context(self, messages: list, sink: EventSink | None = None):
+        """执行查询，传入最近的消息历史；传入sink时把事件实时转发给调用方"""
+        logger.info("开始搜索论文...")
+        result = ""
         
         try:
-            async for chunk in self.agent_with_tools.astream(
-                {"messages": full_messages},
-                stream_mode="messages"
-            ):
-                result += chunk[0].content
-                print(chunk[0].content, end='', flush=True)
+            async for event in self.astream_with_context(messages):
+                if event["type"] in ("token", "tool_result"):
+                    result += event["content"]
+                if sink is not None:
+                    await sink.emit(event)
+                elif event["type"] == "token":
+                    print(event["content"], end='', flush=True)
         except Exception as e:
             logger.error(f"查询过程中出现错误: {e}")
             result = f"查询失败: {e}"
             
         return result
         
-    def invoke_with_context(self, messages: list):
-        """带上下文的同步接口"""
-        return asyncio.run(self.main_with_context(messages))
\ No newline at end of file
+    def invoke_with_context(self, messages: list, sink: EventSink | None = None):
+        """带上下文的同步接口，派发到会话池的后台事件循环执行，不再每次新建事件循环"""
+        if self.mcp_pool is None:
+            return asyncio.run(self.main_with_context(messages, sink))
+        return self.mcp_pool.background.run(self.main_with_context(messages, sink))
+
+    def close(self):
+        """关闭MCP会话池"""
+        if self.mcp_pool is not None:
+            self.mcp_pool.close()
\ No newline at end of file
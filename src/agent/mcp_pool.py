@@ -0,0 +1,332 @@
+"""MCP stdio会话池
+
+在一个常驻的后台事件循环中维持若干个已完成握手的MCP会话，
+工具调用直接复用这些会话，避免每次调用都重新拉起zotero-mcp子进程。
+"""
+
+import asyncio
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from langchain_core.tools import BaseTool, StructuredTool, ToolException
+from langchain_mcp_adapters.sessions import create_session
+from loguru import logger
+
+from agent.metrics import TOOL_DURATION
+from agent.tool_cache import MUTATING_TOOL_PATTERN
+
+
+class BackgroundLoop:
+    """后台常驻事件循环，运行在独立的守护线程中"""
+
+    def __init__(self, name: str = "mcp-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """把协程提交到后台循环，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float | None = None):
+        """同步执行协程并等待结果，不能在后台循环线程内部调用"""
+        return self.submit(coro).result(timeout)
+
+    async def arun(self, coro):
+        """从任意事件循环中把协程派发到后台循环执行"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def stop(self):
+        """停止后台循环"""
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class PooledSession:
+    """池中的一个MCP会话，由一个常驻任务持有stdio子进程和会话的生命周期"""
+
+    def __init__(self, connection: dict, index: int):
+        self.connection = connection
+        self.index = index
+        self.session = None
+        self.last_used = time.monotonic()
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._error: BaseException | None = None
+
+    async def start(self, timeout: float):
+        """启动子进程并完成MCP握手"""
+        self._task = asyncio.create_task(self._hold(), name=f"mcp-session-{self.index}")
+        waiter = asyncio.create_task(self._ready.wait())
+        await asyncio.wait({waiter, self._task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not self._ready.is_set():
+            waiter.cancel()
+            await self.close()
+            raise RuntimeError(f"MCP会话 #{self.index} 启动失败: {self._error or '握手超时'}")
+
+    async def _hold(self):
+        # stdio_client基于anyio，进入和退出必须在同一个任务中完成
+        try:
+            async with create_session(self.connection) as session:
+                await session.initialize()
+                self.session = session
+                self._ready.set()
+                await self._closing.wait()
+        except Exception as e:
+            self._error = e
+            logger.warning(f"MCP会话 #{self.index} 已退出: {e}")
+        finally:
+            self.session = None
+
+    @property
+    def alive(self) -> bool:
+        return (
+            self.session is not None
+            and not self._closing.is_set()
+            and self._task is not None
+            and not self._task.done()
+        )
+
+    async def ping(self, timeout: float) -> bool:
+        """健康检查"""
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout)
+            return True
+        except Exception as e:
+            # 子进程崩溃后会话对象不会自行退出，标记关闭让持有任务回收它
+            logger.warning(f"MCP会话 #{self.index} 健康检查失败: {e}")
+            self._closing.set()
+            return False
+
+    async def close(self):
+        """关闭会话并回收子进程"""
+        self._closing.set()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._task, timeout=5)
+        except Exception:
+            self._task.cancel()
+
+
+def _convert_call_tool_result(result) -> str:
+    """把MCP工具调用结果转换为文本"""
+    texts = [content.text for content in result.content if getattr(content, "type", None) == "text"]
+    text = "\n".join(texts)
+    if result.isError:
+        raise ToolException(text or "工具调用失败")
+    return text
+
+
+class MCPSessionPool:
+    """有界的MCP会话池，会话在后台事件循环中常驻并复用"""
+
+    def __init__(
+        self,
+        connection: dict,
+        max_size: int = 4,
+        min_size: int = 1,
+        health_check_interval: float = 30.0,
+        start_timeout: float = 30.0,
+        call_timeout: float = 120.0,
+        background_loop: BackgroundLoop | None = None,
+        mutating_pattern: str = MUTATING_TOOL_PATTERN,
+    ):
+        """mutating_pattern: 名称匹配的工具有副作用，会话崩溃时不重试，避免执行两次"""
+        self.connection = connection
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.health_check_interval = health_check_interval
+        self.start_timeout = start_timeout
+        self.call_timeout = call_timeout
+        self.background = background_loop or BackgroundLoop()
+        self._mutating = re.compile(mutating_pattern, re.IGNORECASE)
+        self._size = 0
+        self._counter = 0
+        self._closed = False
+        # 以下对象都只在后台循环中访问
+        self._idle: asyncio.Queue | None = None
+        self._size_changed: asyncio.Condition | None = None
+        self._monitor: asyncio.Task | None = None
+        self.background.run(self._setup())
+
+    async def _setup(self):
+        self._idle = asyncio.Queue()
+        self._size_changed = asyncio.Condition()
+        self._monitor = asyncio.create_task(self._health_loop(), name="mcp-pool-monitor")
+
+    async def _new_session(self) -> PooledSession:
+        self._counter += 1
+        session = PooledSession(self.connection, self._counter)
+        try:
+            await session.start(self.start_timeout)
+        except Exception:
+            await self._discard(None)
+            raise
+        logger.info(f"MCP会话 #{session.index} 已就绪 (池大小 {self._size}/{self.max_size})")
+        return session
+
+    async def _discard(self, session: PooledSession | None):
+        """丢弃一个会话并释放池容量"""
+        if session is not None:
+            await session.close()
+        async with self._size_changed:
+            self._size -= 1
+            self._size_changed.notify()
+
+    async def _acquire(self) -> PooledSession:
+        while True:
+            if self._closed:
+                raise RuntimeError("MCP会话池已关闭")
+            # 优先复用空闲会话，长时间未使用的会话先做健康检查
+            while not self._idle.empty():
+                session = self._idle.get_nowait()
+                idle_for = time.monotonic() - session.last_used
+                if session.alive and (idle_for < self.health_check_interval or await session.ping(self.start_timeout)):
+                    return session
+                await self._discard(session)
+            async with self._size_changed:
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                # 池已满，等待有会话归还或被丢弃
+                await self._size_changed.wait()
+        return await self._new_session()
+
+    async def _release(self, session: PooledSession):
+        session.last_used = time.monotonic()
+        if session.alive and not self._closed:
+            self._idle.put_nowait(session)
+            async with self._size_changed:
+                self._size_changed.notify()
+        else:
+            await self._discard(session)
+
+    @asynccontextmanager
+    async def session(self):
+        """借出一个会话，只能在后台循环中使用"""
+        pooled = await self._acquire()
+        try:
+            yield pooled.session
+        finally:
+            await self._release(pooled)
+
+    async def _health_loop(self):
+        """定期检查空闲会话，剔除已崩溃的会话并补足最小预热数量"""
+        while not self._closed:
+            await asyncio.sleep(self.health_check_interval)
+            checked = []
+            while not self._idle.empty():
+                checked.append(self._idle.get_nowait())
+            for session in checked:
+                if await session.ping(self.start_timeout):
+                    self._idle.put_nowait(session)
+                else:
+                    logger.warning(f"MCP会话 #{session.index} 不可用，已从池中移除")
+                    await self._discard(session)
+            try:
+                await self._fill(self.min_size)
+            except Exception as e:
+                logger.error(f"MCP会话重启失败: {e}")
+
+    async def _fill(self, count: int):
+        """预热会话直到池中至少有count个会话"""
+        while self._size < min(count, self.max_size) and not self._closed:
+            async with self._size_changed:
+                self._size += 1
+            session = await self._new_session()
+            await self._release(session)
+
+    async def _call_tool(self, name: str, arguments: dict):
+        start = time.perf_counter()
+        status = "error"
+        try:
+            result = await self._call_tool_once(name, arguments)
+            status = "error" if result.isError else "ok"
+            return result
+        finally:
+            TOOL_DURATION.observe(time.perf_counter() - start, tool=name, status=status)
+
+    async def _call_tool_once(self, name: str, arguments: dict):
+        # 会话在调用过程中崩溃时换一个新会话重试一次，业务错误不重试；
+        # 崩溃前请求可能已经执行，有副作用的工具不重试
+        attempts = 1 if self._mutating.search(name) else 2
+        for attempt in range(attempts):
+            pooled = await self._acquire()
+            try:
+                return await asyncio.wait_for(pooled.session.call_tool(name, arguments), self.call_timeout)
+            except Exception as e:
+                if attempt == attempts - 1 or await pooled.ping(self.start_timeout):
+                    raise
+                logger.warning(f"MCP会话 #{pooled.index} 在调用 {name} 时崩溃，换用新会话重试: {e}")
+            finally:
+                await self._release(pooled)
+
+    async def _list_tools(self):
+        async with self.session() as session:
+            return (await session.list_tools()).tools
+
+    def warm_up(self, count: int | None = None):
+        """同步预热会话，默认预热到min_size"""
+        self.background.run(self._fill(count or self.min_size))
+
+    async def call_tool(self, name: str, arguments: dict):
+        """从任意事件循环调用工具，实际执行在后台循环的池化会话中"""
+        return await self.background.arun(self._call_tool(name, arguments))
+
+    def list_tools(self):
+        """同步列出服务端提供的工具"""
+        return self.background.run(self._list_tools(), timeout=self.start_timeout * 2)
+
+    def get_tools(self) -> list[BaseTool]:
+        """把MCP工具转换为LangChain工具，每次调用都派发到池中执行"""
+        return [self._to_langchain_tool(tool) for tool in self.list_tools()]
+
+    def _to_langchain_tool(self, tool) -> BaseTool:
+        async def _arun(**arguments):
+            try:
+                result = await self.call_tool(tool.name, arguments)
+            except Exception as e:
+                # 交给agent处理工具错误，而不是中断整个ReAct循环
+                raise ToolException(f"工具 {tool.name} 调用失败: {e}") from e
+            return _convert_call_tool_result(result)
+
+        return StructuredTool(
+            name=tool.name,
+            description=tool.description or "",
+            args_schema=tool.inputSchema,
+            coroutine=_arun,
+            handle_tool_error=True,
+        )
+
+    async def _close(self):
+        self._closed = True
+        if self._monitor:
+            self._monitor.cancel()
+        while not self._idle.empty():
+            await self._discard(self._idle.get_nowait())
+
+    def close(self):
+        """关闭所有会话并停止后台循环"""
+        if self._closed:
+            return
+        try:
+            self.background.run(self._close(), timeout=30)
+        finally:
+            self.background.stop()
+            logger.info("MCP会话池已关闭")
@@ -1,21 +1,42 @@
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from loguru import logger
-import time
 import os
 
+from agent.llm_scheduler import BACKGROUND, priority
+from agent.memory_store import MemoryStore
+from agent.single_flight import SingleFlight, request_key
+
+# 搜索结果总结提示词，agent.context_window压缩过长的历史消息时也会用到
+SEARCH_SUMMARY_PROMPT = """
+请将以下论文搜索结果总结为简洁的要点，保留关键信息：
+- 搜索过程的描述
+- 论文标题和作者
+- 关键发现或方法
+- 相关性评分
+- 限制在200字以内
+
+搜索结果
+{search_result}
+"""
+
 class Memory_Manager:
     def __init__(self):
-        self.memory_llm = ChatOpenAI(
-            openai_api_base="http://localhost:11434/v1",
-            openai_api_key="ollama",
-            model="qwen3_lora_sft_memory_q8_0"
-        )
-        self.llm = ChatOpenAI(
-            model="qwen3-next-80b-a3b-thinking",
-            openai_api_key=os.getenv("QWEN_API_KEY"),
-            openai_api_base="https://dashscope.aliyuncs.com/compatible-mode/v1",
+        # langchain_openai导入较慢，推迟到创建实例时，只发送任务的进程导入本模块时不受影响
+        from agent.llm_clients import chat_model, embeddings
+
+        # 与Agent共享连接池，同一进程中相同的模型只创建一个客户端
+        self.memory_llm = chat_model("ollama", "qwen3_lora_sft_memory_q8_0")
+        # 长记忆存储（SQLite + FTS5），设置LONG_MEMORY_EMBEDDING_MODEL后同时做向量检索
+        embedding_model = os.getenv("LONG_MEMORY_EMBEDDING_MODEL")
+        self.memory_store = MemoryStore(
+            os.getenv("LONG_MEMORY_PATH", "resource/long_memory/long_memory.sqlite3"),
+            embed=embeddings(
+                "ollama", embedding_model, check_embedding_ctx_length=False
+            ).embed_documents if embedding_model else None,
         )
+        self.llm = chat_model("qwen", "qwen3-next-80b-a3b-thinking")
+        # 重复投递的相同问题只提取一次
+        self.flights = SingleFlight("memory")
         
     # 进行任务路由
     def task_routing(self, question: str, type: str) -> str:
@@ -26,44 +47,101 @@ class Memory_Manager:
             return self.summarize_search_result(question)
         
         
-    def extract_message(self, question: str) -> str:
-        """从问题中提取长记忆信息"""
-        response = self.memory_llm.invoke([SystemMessage(content="判断下面用户问题是否存在可以作为长记忆的重要信息，如果有则提取关键信息（短句或关键词），否则返回<None>。"), HumanMessage(content=question)])
+    def _extract_messages(self, question: str) -> list:
+        return [SystemMessage(content="判断下面用户问题是否存在可以作为长记忆的重要信息，如果有则提取关键信息（短句或关键词），否则返回<None>。"), HumanMessage(content=question)]
+
+
+    def _parse_extract(self, response) -> str:
         response = response.content.split("\n")[-1]
         if response == "<None>":
             return ""
         else:
             return response
+
+
+    def extract_message(self, question: str) -> str:
+        """从问题中提取长记忆信息"""
+        messages = self._extract_messages(question)
+        with priority(BACKGROUND):
+            response = self.flights.do(
+                request_key(self.memory_llm, messages), lambda: self.memory_llm.invoke(messages)
+            )
+        return self._parse_extract(response)
+
+
+    def process_batch(self, messages: list[dict], max_concurrency: int = 8) -> list[bool | None]:
+        """批量处理记忆消息，返回每条消息的处理结果：True成功，False失败，
+        None表示暂时失败（记忆写入出错），消息可以重新投递后再处理
+
+        extract类消息并发调用模型，提取出的记忆在一个事务中批量写入
+        """
+        results = [False] * len(messages)
+        extract = [i for i, m in enumerate(messages) if m.get("type") == "extract"]
+        if extract:
+            # 同一批中相同的问题只调用一次模型
+            texts = list(dict.fromkeys(messages[i]["text"] for i in extract))
+            # batch的工作线程会复制当前上下文，优先级对每个请求都生效
+            with priority(BACKGROUND):
+                responses = self.memory_llm.batch(
+                    [self._extract_messages(text) for text in texts],
+                    config={"max_concurrency": max_concurrency},
+                    return_exceptions=True,
+                )
+            by_text = dict(zip(texts, responses))
+            records, stored = [], []
+            for i in extract:
+                response = by_text[messages[i]["text"]]
+                if isinstance(response, Exception):
+                    logger.error(f"Error in long memory extraction: {response}")
+                    continue
+                memory_info = self._parse_extract(response)
+                if memory_info:
+                    records.append({"memory": memory_info, "user_id": messages[i].get("user_id", "default")})
+                    stored.append(i)
+                else:
+                    # 没有需要保存的记忆，不受写入结果影响
+                    results[i] = True
+            try:
+                self.memory_store.add_many(records)
+                for i in stored:
+                    results[i] = True
+                logger.info(f"Batch of {len(extract)} messages processed, {len(records)} long memories saved")
+            except Exception as e:
+                # 写入失败与消息本身无关，标记为暂时失败，由消费者重新投递
+                logger.error(f"Error saving long memories: {e}")
+                for i in stored:
+                    results[i] = None
+        for i, message in enumerate(messages):
+            if message.get("type") == "extract":
+                continue
+            try:
+                self.task_routing(message["text"], message.get("type"))
+                results[i] = True
+            except Exception as e:
+                logger.error(f"Error processing {message.get('type')} message: {e}")
+        return results
         
-    def get_long_memory(self, question: str):
-        """获取长记忆并保存到文件"""
+    def get_long_memory(self, question: str, user_id: str = "default"):
+        """获取长记忆并保存到记忆存储"""
         logger.info("Starting long memory extraction...")
         try:
             memory_info = self.extract_message(question)
             if memory_info:
-                # 写入一个jsonl文件,每条数据的格式为{"time": "当前时间", "memory": "内容"}
-                with open("C:\\Users\\71949\\Desktop\\research_agent\\resource\\long_memory\\long_memory.jsonl", "a", encoding="utf-8") as f:
-                    f.write(f'{{"time": "{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}", "memory": "{memory_info}"}}\n')
+                self.memory_store.add(memory_info, user_id=user_id)
                 logger.info(f"Long memory extracted and saved")
         except Exception as e:
             logger.error(f"Error in get_long_memory: {e}")
+
+
+    def retrieve_memories(self, question: str, k: int = 5, user_id: str = "default") -> list[str]:
+        """检索与问题最相关的k条长记忆"""
+        return [item["memory"] for item in self.memory_store.search(question, k=k, user_id=user_id)]
             
 
     def summarize_search_result(self, search_result: str) -> str:
         logger.info("Summarizing search result...")
         """总结搜索结果，精简上下文"""
         
-        summary_prompt = """
-        请将以下论文搜索结果总结为简洁的要点，保留关键信息：
-        - 搜索过程的描述
-        - 论文标题和作者
-        - 关键发现或方法
-        - 相关性评分
-        - 限制在200字以内
-        
-        搜索结果
-        {search_result}
-        """
-        
-        summary = self.llm.invoke([HumanMessage(content=summary_prompt.format(search_result=search_result))])
+        with priority(BACKGROUND):
+            summary = self.llm.invoke([HumanMessage(content=SEARCH_SUMMARY_PROMPT.format(search_result=search_result))])
         return summary.content
\ No newline at end of file
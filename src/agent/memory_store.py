@@ -0,0 +1,215 @@
+"""长记忆存储
+
+使用SQLite保存长记忆，FTS5全文索引负责关键词检索（BM25排序）。
+配置embedding函数后，同时维护一个NumPy向量矩阵做语义检索，两路结果用RRF融合。
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+_CJK = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[a-z0-9]+")
+
+
+def segment(text: str) -> list[str]:
+    """分词：英文按单词，中文按相邻二字切分（单字保留单字）"""
+    tokens = []
+    for chunk in _TOKEN_RE.findall((text or "").lower()):
+        if re.match(rf"[{_CJK}]", chunk):
+            if len(chunk) == 1:
+                tokens.append(chunk)
+            else:
+                tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+        else:
+            tokens.append(chunk)
+    return tokens
+
+
+def _match_query(text: str) -> str | None:
+    tokens = dict.fromkeys(segment(text))
+    if not tokens:
+        return None
+    return " OR ".join(f'"{token}"' for token in tokens)
+
+
+class MemoryStore:
+    """SQLite + FTS5的长记忆存储，可选NumPy向量检索，线程安全"""
+
+    def __init__(self, path: str, embed=None):
+        """embed为批量向量函数：list[str] -> list[list[float]]，不传则只做全文检索"""
+        self.path = path
+        self.embed = embed
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS memories (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                memory TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                embedding BLOB
+            );
+            CREATE INDEX IF NOT EXISTS memories_user ON memories(user_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(tokens);
+            """
+        )
+        self._ids = []
+        self._users = []
+        self._matrix = None
+        if embed is not None:
+            self._load_matrix()
+
+    def _load_matrix(self):
+        import numpy as np
+
+        rows = self._db.execute(
+            "SELECT id, user_id, embedding FROM memories WHERE embedding IS NOT NULL ORDER BY id"
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        self._users = [row[1] for row in rows]
+        self._matrix = (
+            np.vstack([np.frombuffer(row[2], dtype=np.float32) for row in rows]) if rows else None
+        )
+        logger.info(f"长记忆向量矩阵已加载 {len(rows)} 条")
+
+    def _embed(self, texts: list[str]):
+        import numpy as np
+
+        vectors = np.asarray(self.embed(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def add(self, memory: str, user_id: str = "default", created_at: float | None = None) -> int:
+        return self.add_many([{"memory": memory, "user_id": user_id, "created_at": created_at}])[0]
+
+    def add_many(self, records: list[dict]) -> list[int]:
+        """批量写入记忆，一个事务完成，返回新记录的id"""
+        records = [r for r in records if r.get("memory")]
+        if not records:
+            return []
+        vectors = None
+        if self.embed is not None:
+            try:
+                vectors = self._embed([r["memory"] for r in records])
+            except Exception as e:
+                logger.warning(f"长记忆向量计算失败，只写入全文索引: {e}")
+        ids = []
+        with self._lock:
+            with self._db:
+                for i, record in enumerate(records):
+                    cursor = self._db.execute(
+                        "INSERT INTO memories (user_id, memory, created_at, embedding) VALUES (?, ?, ?, ?)",
+                        (
+                            record.get("user_id") or "default",
+                            record["memory"],
+                            record.get("created_at") or time.time(),
+                            vectors[i].tobytes() if vectors is not None else None,
+                        ),
+                    )
+                    ids.append(cursor.lastrowid)
+                self._db.executemany(
+                    "INSERT INTO memories_fts (rowid, tokens) VALUES (?, ?)",
+                    [(row_id, " ".join(segment(r["memory"]))) for row_id, r in zip(ids, records)],
+                )
+            if vectors is not None:
+                import numpy as np
+
+                self._matrix = vectors if self._matrix is None else np.vstack([self._matrix, vectors])
+                self._ids.extend(ids)
+                self._users.extend(r.get("user_id") or "default" for r in records)
+        return ids
+
+    def _search_fts(self, question: str, user_id: str, k: int) -> list[int]:
+        query = _match_query(question)
+        if query is None:
+            return []
+        rows = self._db.execute(
+            "SELECT m.id FROM memories_fts f JOIN memories m ON m.id = f.rowid "
+            "WHERE memories_fts MATCH ? AND m.user_id = ? ORDER BY bm25(memories_fts) LIMIT ?",
+            (query, user_id, k),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _search_vector(self, vector, user_id: str, k: int) -> list[int]:
+        import numpy as np
+
+        if self._matrix is None:
+            return []
+        scores = self._matrix @ vector
+        mask = np.fromiter((u == user_id for u in self._users), dtype=bool, count=len(self._users))
+        scores = np.where(mask, scores, -np.inf)
+        top = np.argsort(-scores)[:k]
+        return [self._ids[i] for i in top if np.isfinite(scores[i])]
+
+    def search(self, question: str, k: int = 5, user_id: str = "default") -> list[dict]:
+        """检索与问题最相关的k条记忆"""
+        vector = None
+        if self.embed is not None:
+            # 向量计算可能是网络调用，放在锁外面
+            try:
+                vector = self._embed([question])[0]
+            except Exception as e:
+                logger.warning(f"长记忆向量检索失败，只使用全文检索: {e}")
+        with self._lock:
+            ranked = [self._search_fts(question, user_id, k * 2)]
+            if vector is not None:
+                ranked.append(self._search_vector(vector, user_id, k * 2))
+            # 倒数排名融合（RRF）
+            scores = {}
+            for ids in ranked:
+                for rank, row_id in enumerate(ids):
+                    scores[row_id] = scores.get(row_id, 0.0) + 1.0 / (60 + rank)
+            top = sorted(scores, key=scores.get, reverse=True)[:k]
+            if not top:
+                return []
+            rows = self._db.execute(
+                f"SELECT id, memory, created_at FROM memories WHERE id IN ({','.join('?' * len(top))})",
+                top,
+            ).fetchall()
+        by_id = {row[0]: row for row in rows}
+        return [
+            {"id": row_id, "memory": by_id[row_id][1], "created_at": by_id[row_id][2], "score": scores[row_id]}
+            for row_id in top
+            if row_id in by_id
+        ]
+
+    def import_jsonl(self, path: str, user_id: str = "default") -> int:
+        """导入旧版long_memory.jsonl文件，返回导入条数"""
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    # 旧文件是手工拼接的JSON，内容里有引号时会解析失败
+                    logger.warning(f"跳过无法解析的记忆: {line.strip()[:50]}")
+                    continue
+                created_at = None
+                if item.get("time"):
+                    try:
+                        created_at = time.mktime(time.strptime(item["time"], "%Y-%m-%d %H:%M:%S"))
+                    except ValueError:
+                        pass
+                records.append({"memory": item.get("memory"), "user_id": user_id, "created_at": created_at})
+        return len(self.add_many(records))
+
+    def count(self, user_id: str | None = None) -> int:
+        with self._lock:
+            if user_id is None:
+                return self._db.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM memories WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
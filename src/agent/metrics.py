@@ -0,0 +1,299 @@
+"""运行指标
+
+进程内的计数器、仪表和直方图，以Prometheus文本格式导出：
+
+- agent_node_duration_seconds    每个图节点的耗时
+- agent_llm_duration_seconds     每次模型调用的总耗时
+- agent_llm_ttft_seconds         流式调用的首token延迟
+- agent_llm_tokens_total         prompt/completion token数
+- agent_tool_duration_seconds    每次MCP工具调用的耗时
+- agent_llm_queue_depth / agent_llm_queue_wait_seconds / agent_llm_in_flight
+                                 模型请求调度的排队情况（见agent.llm_scheduler）
+
+节点和模型的数据由MetricsCallback从LangChain回调中采集，工具调用由MCPSessionPool直接记录。
+设置METRICS_PORT后Agent会启动 /metrics 端点。
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+from loguru import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各分桶计数（最后一个是+Inf）, 总和, 次数]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            return series[2] if series else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, ([*series[0]], series[1], series[2])) for key, series in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip([*self.buckets, "+Inf"], counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    """指标注册表，同名指标只创建一次"""
+
+    def __init__(self):
+        self._metrics: dict[str, Counter | Gauge | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TOOL_DURATION = REGISTRY.histogram("agent_tool_duration_seconds", "MCP工具调用耗时", ("tool", "status"))
+
+
+def _model_name(serialized: dict | None, metadata: dict | None, kwargs: dict) -> str:
+    params = kwargs.get("invocation_params") or {}
+    return (
+        params.get("model")
+        or params.get("model_name")
+        or (metadata or {}).get("ls_model_name")
+        or (serialized or {}).get("name")
+        or "unknown"
+    )
+
+
+def token_usage(response) -> tuple[int, int]:
+    """从LLMResult中取prompt/completion token数，流式调用没有返回用量时为0"""
+    prompt = completion = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt += usage.get("input_tokens", 0)
+                completion += usage.get("output_tokens", 0)
+    if not (prompt or completion):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt = usage.get("prompt_tokens") or 0
+        completion = usage.get("completion_tokens") or 0
+    return prompt, completion
+
+
+class MetricsCallback(BaseCallbackHandler):
+    """从LangChain回调中采集节点和模型调用的耗时与token数"""
+
+    # 在调用线程中同步执行，时间戳不受回调调度延迟影响
+    run_inline = True
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.node_duration = registry.histogram("agent_node_duration_seconds", "图节点耗时", ("node", "status"))
+        self.llm_duration = registry.histogram("agent_llm_duration_seconds", "模型调用总耗时", ("model", "status"))
+        self.llm_ttft = registry.histogram("agent_llm_ttft_seconds", "流式模型调用的首token延迟", ("model",))
+        self.llm_tokens = registry.counter("agent_llm_tokens_total", "模型调用消耗的token数", ("model", "kind"))
+        self._lock = threading.Lock()
+        # run_id -> (节点名, 开始时间)
+        self._nodes: dict = {}
+        # run_id -> [模型名, 开始时间, 是否已收到首token]
+        self._llms: dict = {}
+
+    # 节点
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # 节点内部的子链也带有langgraph_node，只统计节点本身
+        if node and kwargs.get("name") == node:
+            with self._lock:
+                self._nodes[run_id] = (node, time.perf_counter())
+
+    def _end_node(self, run_id, status: str):
+        with self._lock:
+            started = self._nodes.pop(run_id, None)
+        if started:
+            node, start = started
+            self.node_duration.observe(time.perf_counter() - start, node=node, status=status)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_node(run_id, "ok")
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_node(run_id, "error")
+
+    # 模型
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        with self._lock:
+            self._llms[run_id] = [_model_name(serialized, metadata, kwargs), time.perf_counter(), False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, metadata=metadata, **kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            started = self._llms.get(run_id)
+            if started is None or started[2]:
+                return
+            started[2] = True
+        self.llm_ttft.observe(time.perf_counter() - started[1], model=started[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            started = self._llms.pop(run_id, None)
+        if started is None:
+            return
+        model, start, _ = started
+        self.llm_duration.observe(time.perf_counter() - start, model=model, status="ok")
+        prompt, completion = token_usage(response)
+        if prompt:
+            self.llm_tokens.inc(prompt, model=model, kind="prompt")
+        if completion:
+            self.llm_tokens.inc(completion, model=model, kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            started = self._llms.pop(run_id, None)
+        if started:
+            self.llm_duration.observe(time.perf_counter() - started[1], model=started[0], status="error")
+
+
+_server: ThreadingHTTPServer | None = None
+_server_lock = threading.Lock()
+
+
+def serve(port: int, host: str = "0.0.0.0", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """在后台线程中启动 /metrics 端点，重复调用返回已启动的服务"""
+    global _server
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), Handler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            logger.info(f"指标端点已启动 http://{host}:{_server.server_address[1]}/metrics")
+        return _server
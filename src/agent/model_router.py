@@ -0,0 +1,460 @@
+"""模型路由：截止时间、对冲请求、降级和熔断
+
+一个ModelRouter按顺序持有若干后端（例如本地Ollama的supervisor模型和DashScope上的备用模型）：
+
+- 对冲：首选后端超过对冲延迟还没有输出时，向下一个后端再发一次相同的请求，先产生输出的一方胜出，
+  另一方被取消（异步请求会断开连接；同步请求无法中断，结果被丢弃）。
+  对冲延迟取该后端最近成功请求首个输出耗时的p95，样本不足时使用配置的默认值
+- 截止时间：超过deadline仍没有任何输出时放弃所有后端，抛出TimeoutError
+- 降级：后端在产生输出前失败时立即改用下一个后端；已经开始输出的流式请求不再切换
+- 熔断：同一服务端点连续失败failure_threshold次后熔断reset_timeout秒，期间跳过该端点；
+  之后放行一个探测请求，成功则恢复。所有端点都熔断时仍按顺序尝试，不直接拒绝请求
+
+熔断状态按服务端点（ollama、qwen）在进程内共享，端点上的所有模型一起熔断；延迟统计按路由器和后端分别记录。
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextvars import copy_context
+
+from loguru import logger
+
+from agent.metrics import REGISTRY
+
+ROUTES = REGISTRY.counter(
+    "agent_model_route_total", "模型路由中每个后端请求的结果（win/lost/error/timeout）", ("router", "backend", "outcome")
+)
+HEDGES = REGISTRY.counter("agent_model_hedge_total", "超过对冲延迟后发出的备用请求", ("router", "backend"))
+CIRCUIT_OPEN = REGISTRY.gauge("agent_model_circuit_open", "服务端点是否处于熔断状态", ("endpoint",))
+
+
+class Health:
+    """服务端点的熔断状态：closed -> open -> half-open -> closed"""
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.probing else "open"
+
+    def available(self) -> bool:
+        """是否可以放行请求（不占用探测名额）"""
+        with self._lock:
+            return self.opened_at is None or (
+                not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout
+            )
+
+    def allow(self) -> bool:
+        """是否放行请求，熔断到期后只放行一个探测请求"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def release(self):
+        """探测请求被取消，没有得出结果，让出探测名额"""
+        with self._lock:
+            self.probing = False
+
+    def success(self):
+        with self._lock:
+            recovered = self.opened_at is not None
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+        if recovered:
+            logger.info(f"模型端点 {self.endpoint} 已恢复")
+            CIRCUIT_OPEN.set(0, endpoint=self.endpoint)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            probe_failed = self.probing
+            self.probing = False
+            if not probe_failed and (self.opened_at is not None or self.failures < self.failure_threshold):
+                return
+            self.opened_at = time.monotonic()
+        logger.warning(f"模型端点 {self.endpoint} 连续失败 {self.failures} 次，熔断 {self.reset_timeout}s")
+        CIRCUIT_OPEN.set(1, endpoint=self.endpoint)
+
+
+_health_lock = threading.Lock()
+_health: dict[str, Health] = {}
+
+
+def health(endpoint: str) -> Health:
+    """端点的熔断状态，进程内共享"""
+    with _health_lock:
+        instance = _health.get(endpoint)
+        if instance is None:
+            instance = _health[endpoint] = Health(
+                endpoint,
+                failure_threshold=int(os.getenv("CIRCUIT_FAILURES", "5")),
+                reset_timeout=float(os.getenv("CIRCUIT_RESET_SECONDS", "30")),
+            )
+        return instance
+
+
+class LatencyWindow:
+    """最近若干次成功请求的耗时，用于计算对冲延迟"""
+
+    def __init__(self, size: int = 200):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._values.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = 20) -> float | None:
+        with self._lock:
+            if len(self._values) < min_samples:
+                return None
+            values = sorted(self._values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Backend:
+    """路由中的一个后端：名称、所在服务端点和模型（任意Runnable）"""
+
+    def __init__(self, name: str, endpoint: str, model):
+        self.name = name
+        self.model = model
+        self.health = health(endpoint)
+
+
+class _Attempt:
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.started = time.monotonic()
+        self.stop = threading.Event()
+        self.finished = False
+        self.task: asyncio.Task | None = None
+
+    def cancel(self):
+        self.finished = True
+        self.stop.set()
+        if self.task is not None:
+            self.task.cancel()
+
+
+class _Race:
+    """一次路由调用的状态：已发出的请求、胜出的请求、下一次对冲和截止时间
+
+    同步和异步路径只负责发出请求和等待事件，事件的处理都在这里
+    """
+
+    def __init__(self, router: "ModelRouter", mode: str):
+        self.router = router
+        self.mode = mode
+        self.start = time.monotonic()
+        self.attempts: list[_Attempt] = []
+        self.winner: _Attempt | None = None
+        self.error: BaseException | None = None
+        # 所有后端都熔断时忽略熔断状态，按顺序尝试
+        self.forced = False
+
+    def first_backend(self) -> Backend:
+        backend = self.next_backend()
+        if backend is None:
+            logger.warning(f"{self.router.name} 的所有模型端点都处于熔断状态，仍按顺序尝试")
+            self.forced = True
+            backend = self.next_backend()
+        return backend
+
+    def next_backend(self) -> Backend | None:
+        tried = {attempt.backend.name for attempt in self.attempts}
+        for backend in self.router.backends:
+            if backend.name not in tried and (self.forced or backend.health.allow()):
+                return backend
+        return None
+
+    def _has_next(self) -> bool:
+        tried = {attempt.backend.name for attempt in self.attempts}
+        return any(
+            backend.name not in tried and (self.forced or backend.health.available())
+            for backend in self.router.backends
+        )
+
+    def add(self, backend: Backend) -> _Attempt:
+        attempt = _Attempt(backend)
+        self.attempts.append(attempt)
+        return attempt
+
+    def wait(self) -> float | None:
+        """距离下一次对冲或截止时间的秒数，已有胜出者或没有定时事件时为None"""
+        if self.winner is not None:
+            return None
+        now = time.monotonic()
+        waits = []
+        if self.router.hedge and self._has_next():
+            last = self.attempts[-1]
+            waits.append(max(0.0, last.started + self.router.delay(last.backend, self.mode) - now))
+        if self.router.deadline is not None:
+            waits.append(max(0.0, self.start + self.router.deadline - now))
+        return min(waits) if waits else None
+
+    def on_timer(self) -> Backend | None:
+        """定时事件到期：超过截止时间时抛出TimeoutError，否则返回需要对冲的后端"""
+        router = self.router
+        if router.deadline is not None and time.monotonic() - self.start >= router.deadline:
+            for attempt in self.attempts:
+                if not attempt.finished:
+                    attempt.cancel()
+                    attempt.backend.health.failure()
+                    ROUTES.inc(router=router.name, backend=attempt.backend.name, outcome="timeout")
+            raise TimeoutError(f"{router.name} 模型调用超过 {router.deadline}s 没有输出") from self.error
+        backend = self.next_backend()
+        if backend is not None:
+            HEDGES.inc(router=router.name, backend=backend.name)
+        return backend
+
+    def _win(self, attempt: _Attempt):
+        router = self.router
+        self.winner = attempt
+        router._window(attempt.backend, self.mode).observe(time.monotonic() - attempt.started)
+        attempt.backend.health.success()
+        ROUTES.inc(router=router.name, backend=attempt.backend.name, outcome="win")
+        for other in self.attempts:
+            if other is not attempt and not other.finished:
+                other.cancel()
+                other.backend.health.release()
+                ROUTES.inc(router=router.name, backend=other.backend.name, outcome="lost")
+
+    def on_event(self, attempt: _Attempt, kind: str, payload):
+        """处理请求产生的事件，返回 (动作, 值)：
+
+        ("yield", chunk) 把chunk交给调用方；("return", None) 调用结束；
+        ("launch", backend) 需要改用下一个后端；("skip", None) 忽略
+        """
+        if attempt.finished:
+            return "skip", None
+        if kind == "chunk":
+            if self.winner is None:
+                self._win(attempt)
+            return "yield", payload
+        if kind == "done":
+            if self.winner is None:
+                # 没有任何输出就正常结束，也算成功
+                self._win(attempt)
+            return "return", None
+        if attempt is self.winner or not isinstance(payload, Exception):
+            # 已经开始输出，不能再切换后端；KeyboardInterrupt等也不是后端故障，直接抛给调用方
+            raise payload
+        attempt.finished = True
+        attempt.backend.health.failure()
+        ROUTES.inc(router=self.router.name, backend=attempt.backend.name, outcome="error")
+        logger.warning(f"{self.router.name} 模型后端 {attempt.backend.name} 调用失败: {payload!r}")
+        self.error = payload
+        if all(a.finished for a in self.attempts):
+            backend = self.next_backend()
+            if backend is None:
+                raise payload
+            return "launch", backend
+        return "skip", None
+
+    def close(self):
+        """调用方退出时取消还在运行的请求"""
+        for attempt in self.attempts:
+            if not attempt.finished and attempt is not self.winner:
+                attempt.cancel()
+                attempt.backend.health.release()
+        if self.winner is not None:
+            self.winner.cancel()
+
+
+class ModelRouter:
+    """按截止时间、对冲和熔断策略把一次模型调用分发到多个后端
+
+    invoke/ainvoke/stream/astream与LangChain Runnable的同名方法对应
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backends: list[Backend],
+        hedge: bool = True,
+        hedge_delay: float = 2.0,
+        min_hedge_delay: float = 0.2,
+        deadline: float | None = None,
+    ):
+        if not backends:
+            raise ValueError("ModelRouter至少需要一个后端")
+        self.name = name
+        self.backends = backends
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.deadline = deadline
+        # (后端, 调用方式) -> 首个输出的耗时
+        self._latency: dict[tuple[str, str], LatencyWindow] = {}
+        self._latency_lock = threading.Lock()
+
+    @classmethod
+    def from_env(
+        cls, name: str, backends: list[Backend], hedge_delay: float = 2.0, deadline: float = 0.0
+    ) -> "ModelRouter":
+        """从{NAME}_HEDGE、{NAME}_HEDGE_DELAY、{NAME}_DEADLINE读取配置，NAME为路由器名称的大写，deadline为0表示不限"""
+        prefix = name.upper()
+        deadline = float(os.getenv(f"{prefix}_DEADLINE", str(deadline)))
+        return cls(
+            name,
+            backends,
+            hedge=os.getenv(f"{prefix}_HEDGE", "true").lower() in ("1", "true", "yes"),
+            hedge_delay=float(os.getenv(f"{prefix}_HEDGE_DELAY", str(hedge_delay))),
+            deadline=deadline or None,
+        )
+
+    @property
+    def primary(self):
+        return self.backends[0].model
+
+    def _window(self, backend: Backend, mode: str) -> LatencyWindow:
+        with self._latency_lock:
+            return self._latency.setdefault((backend.name, mode), LatencyWindow())
+
+    def delay(self, backend: Backend, mode: str) -> float:
+        """向下一个后端发出对冲请求前等待的时间"""
+        p95 = self._window(backend, mode).quantile(0.95)
+        return self.hedge_delay if p95 is None else max(self.min_hedge_delay, p95)
+
+    # 同步：每个请求在单独的线程中运行，事件通过队列汇总
+
+    def _pump(self, attempt: _Attempt, iterator, events: queue.Queue):
+        chunks = None
+        try:
+            chunks = iter(iterator())
+            for chunk in chunks:
+                events.put((attempt, "chunk", chunk))
+                if attempt.stop.is_set():
+                    return
+            events.put((attempt, "done", None))
+        except BaseException as e:
+            # 包括KeyboardInterrupt等，必须交给调用方，否则调用方会一直等待
+            events.put((attempt, "error", e))
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def _route(self, mode: str, call):
+        """call(model)返回chunk迭代器，依次产出胜出后端的chunk"""
+        race = _Race(self, mode)
+        events: queue.Queue = queue.Queue()
+
+        def launch(backend: Backend):
+            attempt = race.add(backend)
+            threading.Thread(
+                target=copy_context().run,
+                args=(self._pump, attempt, lambda: call(backend.model), events),
+                name=f"model-router-{self.name}",
+                daemon=True,
+            ).start()
+
+        launch(race.first_backend())
+        try:
+            while True:
+                try:
+                    attempt, kind, payload = events.get(timeout=race.wait())
+                except queue.Empty:
+                    backend = race.on_timer()
+                    if backend is not None:
+                        launch(backend)
+                    continue
+                action, value = race.on_event(attempt, kind, payload)
+                if action == "yield":
+                    yield value
+                elif action == "return":
+                    return
+                elif action == "launch":
+                    launch(value)
+        finally:
+            race.close()
+
+    def invoke(self, input, config=None, **kwargs):
+        results = self._route("invoke", lambda model: iter((model.invoke(input, config, **kwargs),)))
+        try:
+            return next(results)
+        finally:
+            results.close()
+
+    def stream(self, input, config=None, **kwargs):
+        yield from self._route("stream", lambda model: model.stream(input, config, **kwargs))
+
+    # 异步：每个请求是一个任务，作废的请求会被取消
+
+    async def _apump(self, attempt: _Attempt, aiterator, events: asyncio.Queue):
+        try:
+            async for chunk in aiterator():
+                events.put_nowait((attempt, "chunk", chunk))
+            events.put_nowait((attempt, "done", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            events.put_nowait((attempt, "error", e))
+
+    async def _aroute(self, mode: str, call):
+        race = _Race(self, mode)
+        events: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        def launch(backend: Backend):
+            attempt = race.add(backend)
+            attempt.task = loop.create_task(
+                self._apump(attempt, lambda: call(backend.model), events),
+                name=f"model-router-{self.name}-{backend.name}",
+            )
+
+        launch(race.first_backend())
+        try:
+            while True:
+                try:
+                    attempt, kind, payload = await asyncio.wait_for(events.get(), race.wait())
+                except asyncio.TimeoutError:
+                    backend = race.on_timer()
+                    if backend is not None:
+                        launch(backend)
+                    continue
+                action, value = race.on_event(attempt, kind, payload)
+                if action == "yield":
+                    yield value
+                elif action == "return":
+                    return
+                elif action == "launch":
+                    launch(value)
+        finally:
+            race.close()
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        async def single(model):
+            yield await model.ainvoke(input, config, **kwargs)
+
+        results = self._aroute("invoke", single)
+        try:
+            return await results.__anext__()
+        finally:
+            await results.aclose()
+
+    async def astream(self, input, config=None, **kwargs):
+        results = self._aroute("stream", lambda model: model.astream(input, config, **kwargs))
+        try:
+            async for chunk in results:
+                yield chunk
+        finally:
+            await results.aclose()
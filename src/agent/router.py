@@ -0,0 +1,205 @@
+"""supervisor前置的本地快速分类器
+
+先用关键词规则，再用基于字符n-gram的朴素贝叶斯分类器判断消息类别，
+只有置信度不足的消息才交给supervisor大模型。n-gram分类器从记录下来的
+supervisor决策日志中训练。决策日志由后台线程写入，超过大小上限时轮转为.1备份。
+"""
+
+import json
+import math
+import os
+import queue
+import re
+import threading
+from collections import Counter, defaultdict
+
+from loguru import logger
+
+LABELS = ("search", "rag", "chat", "other")
+
+# 提到用户自己文献库的问题可能是rag，也可能是search，交给分类器和大模型判断
+_OWN_LIBRARY = r"(?s)^(?!.*(zotero|我的|库|收藏|本地|\b(my|library|collection)\b))"
+
+# 关键词规则，命中即直接返回对应标签，只收录没有歧义的说法
+DEFAULT_RULES = {
+    "search": [
+        _OWN_LIBRARY + r".*(找|搜|查|检索).{0,20}(论文|文章|文献|paper)",
+        _OWN_LIBRARY + r".*\b(find|search|look up)\b.{0,30}\b(paper|article)s?\b",
+    ],
+    "chat": [
+        r"^\s*(你好|您好|hi|hello|hey|嗨|早上好|晚上好)[\s!！。.,，~]*$",
+        r"^\s*(谢谢|多谢|thanks|thank you|好的|ok|再见|bye)[\s!！。.,，~]*$",
+    ],
+}
+
+
+def _ngrams(text: str, n_min: int = 1, n_max: int = 3) -> list[str]:
+    """提取字符n-gram，中文按字切分，英文统一小写"""
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    grams = []
+    for n in range(n_min, n_max + 1):
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+class NGramClassifier:
+    """字符n-gram多项式朴素贝叶斯分类器"""
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.class_counts: Counter = Counter()
+        self.gram_counts: dict[str, Counter] = defaultdict(Counter)
+        self.totals: Counter = Counter()
+        self.vocab: set[str] = set()
+
+    def fit(self, samples):
+        """samples为(text, label)的可迭代对象"""
+        for text, label in samples:
+            grams = _ngrams(text)
+            self.class_counts[label] += 1
+            self.gram_counts[label].update(grams)
+            self.totals[label] += len(grams)
+            self.vocab.update(grams)
+        return self
+
+    @property
+    def size(self) -> int:
+        return sum(self.class_counts.values())
+
+    def predict_proba(self, text: str) -> dict[str, float]:
+        """返回每个标签的后验概率"""
+        if not self.class_counts:
+            return {}
+        grams = [g for g in _ngrams(text) if g in self.vocab]
+        total = self.size
+        vocab_size = len(self.vocab)
+        scores = {}
+        for label, count in self.class_counts.items():
+            score = math.log(count / total)
+            denominator = self.totals[label] + self.alpha * vocab_size
+            counts = self.gram_counts[label]
+            for gram in grams:
+                score += math.log((counts[gram] + self.alpha) / denominator)
+            scores[label] = score
+        top = max(scores.values())
+        exp = {label: math.exp(score - top) for label, score in scores.items()}
+        norm = sum(exp.values())
+        return {label: value / norm for label, value in exp.items()}
+
+    def predict(self, text: str) -> tuple[str | None, float]:
+        proba = self.predict_proba(text)
+        if not proba:
+            return None, 0.0
+        label = max(proba, key=proba.get)
+        return label, proba[label]
+
+
+class PreClassifier:
+    """supervisor的第一级路由：规则 -> n-gram分类器 -> 交给大模型"""
+
+    def __init__(
+        self,
+        rules: dict[str, list[str]] | None = None,
+        classifier: NGramClassifier | None = None,
+        threshold: float = 0.9,
+        min_samples: int = 50,
+        log_path: str | None = None,
+        max_log_bytes: int = 10 * 1024 * 1024,
+    ):
+        """max_log_bytes: 决策日志的大小上限，超过后改名为.1备份（覆盖更早的备份），0表示不限制"""
+        self.rules = {
+            label: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+            for label, patterns in (DEFAULT_RULES if rules is None else rules).items()
+        }
+        self.classifier = classifier or NGramClassifier()
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.log_path = log_path
+        self.max_log_bytes = max_log_bytes
+        # 待写入的决策，队列满时丢弃
+        self._log_queue: queue.Queue = queue.Queue(maxsize=1000)
+        self._log_thread: threading.Thread | None = None
+        self._log_lock = threading.Lock()
+
+    @classmethod
+    def from_log(cls, log_path: str, **kwargs) -> "PreClassifier":
+        """从supervisor决策日志训练分类器，日志每行格式为{"text": ..., "label": ...}"""
+        samples = []
+        # 先读轮转出去的备份，再读当前日志
+        for path in (log_path + ".1", log_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("label") in LABELS and record.get("text"):
+                        samples.append((record["text"], record["label"]))
+        classifier = NGramClassifier().fit(samples)
+        logger.info(f"前置分类器已从 {len(samples)} 条supervisor决策中训练")
+        return cls(classifier=classifier, log_path=log_path, **kwargs)
+
+    def classify(self, text: str) -> tuple[str | None, float, str]:
+        """返回(标签, 置信度, 来源)，标签为None表示需要交给大模型判断"""
+        for label, patterns in self.rules.items():
+            if any(pattern.search(text) for pattern in patterns):
+                return label, 1.0, "rule"
+        if self.classifier.size >= self.min_samples:
+            label, confidence = self.classifier.predict(text)
+            if label is not None and confidence >= self.threshold:
+                return label, confidence, "ngram"
+            return None, confidence, "ngram"
+        return None, 0.0, "none"
+
+    def record(self, text: str, label: str):
+        """记录一次大模型的分类结果，作为后续训练数据
+
+        只放入队列，由后台线程写入文件，可以在事件循环中直接调用
+        """
+        if not self.log_path or label not in LABELS:
+            return
+        with self._log_lock:
+            if self._log_thread is None:
+                self._log_thread = threading.Thread(target=self._write_log, name="supervisor-log", daemon=True)
+                self._log_thread.start()
+        try:
+            self._log_queue.put_nowait({"text": text, "label": label})
+        except queue.Full:
+            logger.warning("supervisor决策日志队列已满，丢弃一条记录")
+
+    def _write_log(self):
+        """后台线程：批量写入队列中的决策，收到None时写完剩余记录后退出"""
+        while True:
+            records = [self._log_queue.get()]
+            while True:
+                try:
+                    records.append(self._log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            records = [record for record in records if record is not None]
+            if records:
+                try:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+                    self._rotate_log()
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+                except OSError as e:
+                    logger.warning(f"记录supervisor决策失败: {e}")
+            if stop:
+                return
+
+    def _rotate_log(self):
+        if self.max_log_bytes and os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= self.max_log_bytes:
+            os.replace(self.log_path, self.log_path + ".1")
+            logger.info(f"supervisor决策日志超过 {self.max_log_bytes} 字节，已轮转")
+
+    def close(self, timeout: float = 5.0):
+        """写完队列中的决策后停止后台线程"""
+        with self._log_lock:
+            thread, self._log_thread = self._log_thread, None
+        if thread is not None:
+            self._log_queue.put(None)
+            thread.join(timeout)
@@ -0,0 +1,193 @@
+"""search_node的结果缓存
+
+缓存键由归一化后的问题和裁剪后的上下文消息窗口哈希组成。
+可选地传入embedding函数，对同一上下文窗口下的近似问题（换种说法问同一件事）做相似度匹配。
+内存中按LRU+TTL淘汰，同时写入SQLite，进程重启后可以恢复。
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+
+def normalize_question(text: str) -> str:
+    """归一化问题：全半角统一、小写、去掉标点和多余空白"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    # 中文字符两侧的空白没有意义，英文单词之间保留一个空格
+    text = re.sub(r"\s*([^\x00-\x7f])\s*", r"\1", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def window_hash(messages: list) -> str:
+    """对上下文消息窗口（不含当前问题）做哈希"""
+    payload = json.dumps(
+        [(getattr(m, "type", ""), getattr(m, "content", str(m))) for m in messages],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    window: str
+    answer: str
+    created_at: float
+    embedding: list[float] | None = field(default=None, repr=False)
+
+
+class SearchResultCache:
+    """带磁盘持久化的搜索结果缓存，线程安全"""
+
+    def __init__(
+        self,
+        path: str | None = None,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        embed=None,
+        similarity_threshold: float = 0.92,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, question TEXT, window TEXT, answer TEXT, "
+            "embedding TEXT, created_at REAL)"
+        )
+        self._db.execute("DELETE FROM search_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT key, question, window, answer, embedding, created_at FROM search_cache "
+            "ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for key, question, window, answer, embedding, created_at in reversed(rows):
+            self._entries[key] = CacheEntry(
+                question, window, answer, created_at, json.loads(embedding) if embedding else None
+            )
+        logger.info(f"搜索缓存已从 {path} 恢复 {len(rows)} 条记录")
+
+    @staticmethod
+    def _key(question: str, window: str) -> str:
+        return hashlib.sha256(f"{window}\n{question}".encode("utf-8")).hexdigest()
+
+    def _split(self, messages: list) -> tuple[str, str]:
+        return normalize_question(messages[-1].content), window_hash(messages[:-1])
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created_at > self.ttl
+
+    def _embed(self, question: str) -> list[float] | None:
+        if self.embed is None:
+            return None
+        try:
+            return list(self.embed(question))
+        except Exception as e:
+            logger.warning(f"计算问题向量失败，跳过相似度匹配: {e}")
+            return None
+
+    def get(self, messages: list) -> str | None:
+        """查找缓存，先精确匹配，再在同一上下文窗口内做相似度匹配"""
+        question, window = self._split(messages)
+        key = self._key(question, window)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.answer
+            candidates = [
+                (k, e) for k, e in self._entries.items()
+                if e.window == window and e.embedding is not None and not self._expired(e, now)
+            ]
+        if candidates:
+            vector = self._embed(question)
+            if vector is not None:
+                best_key, best_score = None, self.similarity_threshold
+                for k, e in candidates:
+                    score = _cosine(vector, e.embedding)
+                    if score >= best_score:
+                        best_key, best_score = k, score
+                if best_key is not None:
+                    with self._lock:
+                        entry = self._entries.get(best_key)
+                        if entry is not None:
+                            self._entries.move_to_end(best_key)
+                            self.hits += 1
+                            logger.info(f"搜索缓存相似命中 (相似度 {best_score:.3f})")
+                            return entry.answer
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, messages: list, answer: str):
+        """写入缓存，超出容量时淘汰最久未使用的记录"""
+        question, window = self._split(messages)
+        key = self._key(question, window)
+        entry = CacheEntry(question, window, answer, time.time(), self._embed(question))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, question, window, answer,
+                         json.dumps(entry.embedding) if entry.embedding else None, entry.created_at),
+                    )
+                    self._db.executemany("DELETE FROM search_cache WHERE key = ?", [(k,) for k in evicted])
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"写入搜索缓存失败: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,277 @@
+"""相同请求合并（single-flight）
+
+同一时刻有多个完全相同的模型或工具请求时（同一个问题被多人同时发送、客户端重试），
+只向上游发出一次请求，其余调用等待并共享这次请求的结果；流式请求的每个调用方都会
+从头收到完整的chunk序列，后加入的调用方先回放已经收到的chunk再跟随后续输出。
+
+只合并进行中的请求，请求结束后不保留结果（需要缓存时见agent.search_cache、agent.tool_cache）。
+上游请求出错时所有等待的调用方收到同一个异常。
+
+上游请求在单独的线程（同步）或任务（异步）中运行，继承第一个调用方的上下文（回调、优先级），
+某个调用方提前退出不影响其他调用方；所有调用方都退出后上游请求被取消。
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+from contextvars import copy_context
+
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableBinding
+
+from agent.metrics import REGISTRY
+
+SINGLE_FLIGHT = REGISTRY.counter(
+    "agent_single_flight_total", "请求合并：leader发出上游请求，follower共享结果", ("name", "role")
+)
+
+def _model_params(model) -> dict:
+    """模型的身份和生成参数，绑定的参数（bind/bind_tools）也计入"""
+    if isinstance(model, RunnableBinding):
+        return {"bound": _model_params(model.bound), "kwargs": model.kwargs}
+    params = {
+        **getattr(model, "_identifying_params", {}),
+        **getattr(model, "_default_params", {}),
+    }
+    if not params:
+        # 无法识别参数的对象只和自己合并
+        return {"id": id(model)}
+    return {"type": type(model).__name__, "base": getattr(model, "openai_api_base", None), **params}
+
+
+def _message(message) -> dict:
+    """规范化消息，忽略每次请求都不同的id和元数据"""
+    if not isinstance(message, BaseMessage):
+        return {"value": message}
+    return {
+        "type": message.type,
+        "content": message.content,
+        "name": message.name,
+        "tool_calls": getattr(message, "tool_calls", None) or None,
+        "tool_call_id": getattr(message, "tool_call_id", None),
+    }
+
+
+def request_key(model, messages, **params) -> str:
+    """(模型, 规范化的消息, 参数) 的哈希"""
+    if isinstance(messages, (str, BaseMessage)):
+        messages = [messages]
+    payload = {"model": _model_params(model), "messages": [_message(m) for m in messages], "params": params}
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """一次进行中的上游请求，chunks中保存已经收到的输出"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.readers = 0
+        # 所有调用方都已退出，上游请求应当停止
+        self.stopped = False
+
+
+class _SyncFlight(_Flight):
+    def __init__(self):
+        super().__init__()
+        self.cond = threading.Condition()
+
+
+class _AsyncFlight(_Flight):
+    def __init__(self):
+        super().__init__()
+        self.changed = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """按键合并进行中的请求
+
+    do/ado合并普通调用，stream/astream合并流式调用；四种调用各自独立，
+    同一个键的invoke和stream不会互相合并
+    """
+
+    def __init__(self, name: str = "default", enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._flights: dict[tuple, _Flight] = {}
+
+    def _join(self, key: tuple, create) -> tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = create()
+            flight.readers += 1
+        SINGLE_FLIGHT.inc(name=self.name, role="leader" if leader else "follower")
+        return flight, leader
+
+    def _forget(self, key: tuple, flight: _Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _leave(self, key: tuple, flight: _Flight) -> bool:
+        """调用方退出，返回是否是最后一个（需要停止上游请求）"""
+        with self._lock:
+            flight.readers -= 1
+            if flight.readers > 0 or flight.done:
+                return False
+            flight.stopped = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return True
+
+    # 同步
+
+    def _pump(self, key: tuple, flight: _SyncFlight, iterator):
+        chunks = None
+        try:
+            chunks = iter(iterator())
+            for chunk in chunks:
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+                if flight.stopped:
+                    break
+        except BaseException as e:
+            flight.error = e
+        finally:
+            # 提前停止时关闭上游的流
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            self._forget(key, flight)
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _read(self, key: tuple, flight: _SyncFlight):
+        i = 0
+        try:
+            while True:
+                with flight.cond:
+                    flight.cond.wait_for(lambda: i < len(flight.chunks) or flight.done)
+                    chunks = flight.chunks[i:]
+                    done = flight.done
+                for chunk in chunks:
+                    yield chunk
+                i += len(chunks)
+                if done and i == len(flight.chunks):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            self._leave(key, flight)
+
+    def stream(self, key: str, fn):
+        """合并流式调用，fn()返回chunk迭代器"""
+        if not self.enabled:
+            yield from fn()
+            return
+        flight_key = ("stream", key)
+        flight, leader = self._join(flight_key, _SyncFlight)
+        if leader:
+            context = copy_context()
+            threading.Thread(
+                target=context.run, args=(self._pump, flight_key, flight, fn), name=f"single-flight-{self.name}", daemon=True
+            ).start()
+        yield from self._read(flight_key, flight)
+
+    def do(self, key: str, fn):
+        """合并普通调用，返回fn()的结果"""
+        if not self.enabled:
+            return fn()
+        flight_key = ("do", key)
+        flight, leader = self._join(flight_key, _SyncFlight)
+        if leader:
+            # 普通调用不会中途退出，leader直接在自己的线程中请求
+            self._pump(flight_key, flight, lambda: iter((fn(),)))
+        reader = self._read(flight_key, flight)
+        try:
+            return next(reader)
+        finally:
+            reader.close()
+
+    # 异步，只在同一个事件循环中合并
+
+    async def _apump(self, flight: _AsyncFlight, aiterator):
+        try:
+            async for chunk in aiterator():
+                flight.chunks.append(chunk)
+                flight.notify()
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.notify()
+
+    async def _aread(self, key: tuple, flight: _AsyncFlight):
+        i = 0
+        try:
+            while True:
+                changed = flight.changed
+                if i < len(flight.chunks):
+                    yield flight.chunks[i]
+                    i += 1
+                    continue
+                if flight.done:
+                    break
+                await changed.wait()
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            if self._leave(key, flight):
+                flight.task.cancel()
+
+    async def _astart(self, kind: str, key: str, aiterator):
+        flight_key = (kind, key, asyncio.get_running_loop())
+        flight, leader = self._join(flight_key, _AsyncFlight)
+        if leader:
+            flight.task = asyncio.get_running_loop().create_task(self._apump(flight, aiterator))
+            flight.task.add_done_callback(lambda _: self._forget(flight_key, flight))
+        return flight_key, flight
+
+    async def astream(self, key: str, fn):
+        """合并异步流式调用，fn()返回异步chunk迭代器"""
+        if not self.enabled:
+            async for chunk in fn():
+                yield chunk
+            return
+        flight_key, flight = await self._astart("astream", key, fn)
+        reader = self._aread(flight_key, flight)
+        try:
+            async for chunk in reader:
+                yield chunk
+        finally:
+            await reader.aclose()
+
+    async def ado(self, key: str, fn):
+        """合并异步调用，fn()返回awaitable"""
+        if not self.enabled:
+            return await fn()
+
+        async def single():
+            yield await fn()
+
+        flight_key, flight = await self._astart("ado", key, single)
+        reader = self._aread(flight_key, flight)
+        try:
+            async for result in reader:
+                return result
+        finally:
+            await reader.aclose()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._flights)
@@ -0,0 +1,112 @@
+"""推测执行
+
+supervisor分类的同时提前开始搜索：分类结果是search时，search节点直接接管已经在运行的搜索任务，
+分类结果是其它路由时取消搜索任务。搜索产生的流式事件先缓存在BufferedSink中，被采用后才转发给调用方。
+
+推测任务以最新消息的id为键保存，只在异步执行路径（ainvoke/astream）中使用。
+"""
+
+import asyncio
+import threading
+import time
+from contextvars import copy_context
+
+from langchain_core.runnables.config import var_child_runnable_config
+from loguru import logger
+
+from agent.llm_scheduler import SPECULATIVE, set_priority
+from agent.metrics import REGISTRY
+from agent.streaming import BufferedSink, EventSink
+
+SPECULATIONS = REGISTRY.counter("agent_speculation_total", "推测执行的结果（hit/miss/expired）", ("outcome",))
+SPECULATION_WASTED = REGISTRY.histogram("agent_speculation_wasted_seconds", "未被采用的推测任务已运行的时间")
+SPECULATION_HEAD_START = REGISTRY.histogram("agent_speculation_head_start_seconds", "推测任务被采用时已经领先的时间")
+
+
+class Speculation:
+    """一个进行中的推测任务"""
+
+    def __init__(self, task: asyncio.Task, sink: BufferedSink):
+        self.task = task
+        self.sink = sink
+        self.started = time.monotonic()
+        # 任务结束的时间，用于计算被浪费的工作量
+        self.finished: float | None = None
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task):
+        self.finished = time.monotonic()
+        # 取一次异常，避免未被接管的任务出错时产生"exception was never retrieved"警告
+        if not task.cancelled():
+            task.exception()
+
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    async def result(self, sink: EventSink | None):
+        """采用推测结果：先转发缓存的事件，再等待任务完成"""
+        SPECULATIONS.inc(outcome="hit")
+        SPECULATION_HEAD_START.observe(self.elapsed())
+        await self.sink.attach(sink)
+        return await self.task
+
+    def cancel(self, outcome: str = "miss"):
+        SPECULATIONS.inc(outcome=outcome)
+        SPECULATION_WASTED.observe(self.elapsed())
+        self.task.cancel()
+
+
+class Speculations:
+    """按键保存进行中的推测任务，超过ttl没有被接管或取消的任务会被清理"""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._running: dict[str, Speculation] = {}
+
+    def start(self, key: str, run) -> Speculation:
+        """在当前事件循环中启动 run(sink)
+
+        任务只继承当前的回调（指标和追踪），不继承LangGraph节点的运行配置，
+        避免在supervisor节点结束后继续以它的身份写入checkpoint或流式输出。
+        任务中的模型请求以SPECULATIVE优先级排队，不挤占确定要用的请求
+        """
+        self._expire()
+        parent = var_child_runnable_config.get() or {}
+        context = copy_context()
+        context.run(var_child_runnable_config.set, {"callbacks": parent.get("callbacks")})
+        context.run(set_priority, SPECULATIVE)
+        sink = BufferedSink()
+        task = asyncio.get_running_loop().create_task(run(sink), name=f"speculation-{key}", context=context)
+        speculation = Speculation(task, sink)
+        with self._lock:
+            previous = self._running.pop(key, None)
+            self._running[key] = speculation
+        if previous is not None:
+            previous.cancel()
+        return speculation
+
+    def take(self, key: str | None) -> Speculation | None:
+        """接管推测任务，没有对应任务时返回None"""
+        if key is None:
+            return None
+        with self._lock:
+            return self._running.pop(key, None)
+
+    def cancel(self, key: str | None):
+        speculation = self.take(key)
+        if speculation is not None:
+            speculation.cancel()
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, s in self._running.items() if now - s.started > self.ttl]
+            speculations = [self._running.pop(key) for key in expired]
+        for speculation in speculations:
+            logger.warning("推测任务超时未被接管，已取消")
+            speculation.cancel("expired")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._running)
@@ -1,8 +1,33 @@
+import os
+
 from langchain_core.messages import AnyMessage
 from langgraph.graph.message import add_messages
 from typing_extensions import TypedDict, Annotated, Any, Dict
 from dataclasses import dataclass
 
+# 每个会话状态中最多保存的消息数，0表示不限制
+MAX_MESSAGES = int(os.getenv("STATE_MAX_MESSAGES", "100"))
+
+
+def add_bounded_messages(left: list[AnyMessage], right) -> list[AnyMessage]:
+    """Merge messages like add_messages, then drop old turns beyond MAX_MESSAGES.
+
+    When the limit is exceeded only the most recent half is kept (starting at a
+    human message), so checkpoints stop growing with the number of turns and the
+    conversation prefix seen by ContextWindow changes only once in a while.
+    ContextWindow only sends a token budget worth of recent history (plus a
+    rolling summary) to the model, so the dropped turns are rarely used anyway.
+    """
+    messages = add_messages(left, right)
+    if MAX_MESSAGES <= 0 or len(messages) <= MAX_MESSAGES:
+        return messages
+    start = len(messages) - max(1, MAX_MESSAGES // 2)
+    # 不把一轮对话拆开
+    while start < len(messages) - 1 and messages[start].type != "human":
+        start += 1
+    return messages[start:]
+
+
 class Context(TypedDict):
     """Context parameters for the agent.
 
@@ -20,5 +45,5 @@ class State(TypedDict):
     Defines the initial structure of incoming data.
     See: https://langchain-ai.github.io/langgraph/concepts/low_level/#state
     """
-    message: Annotated[list[AnyMessage], add_messages]
+    message: Annotated[list[AnyMessage], add_bounded_messages]
     type: str
@@ -0,0 +1,128 @@
+"""图内部事件的流式输出
+
+节点内部产生的LLM token、工具调用和工具结果通过当前上下文中的EventSink发送给调用方。
+EventSink保存在ContextVar里，LangGraph创建节点任务时会复制上下文，
+所以节点不需要额外参数就能拿到调用方的sink。
+
+事件格式：
+    {"type": "token", "node": "search" | "chat", "content": "..."}
+    {"type": "tool_call", "node": "search", "name": "...", "args": {...}}
+    {"type": "tool_result", "node": "search", "name": "...", "content": "..."}
+    {"type": "final", "content": "..."}   # 只由Agent.astream在结束时产出
+"""
+
+import asyncio
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+
+_current_sink: ContextVar["EventSink | None"] = ContextVar("agent_event_sink", default=None)
+
+
+class EventSink(ABC):
+    """事件接收端的基类，子类需要同时实现异步和同步两种发送方式"""
+
+    @abstractmethod
+    async def emit(self, event: dict):
+        """在节点的事件循环中发送事件"""
+
+    @abstractmethod
+    def emit_sync(self, event: dict):
+        """在同步节点所在的线程中发送事件"""
+
+
+class CallbackSink(EventSink):
+    """把事件交给同步回调，回调阻塞时生产者也会等待"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    async def emit(self, event: dict):
+        self.callback(event)
+
+    def emit_sync(self, event: dict):
+        self.callback(event)
+
+
+class QueueSink(EventSink):
+    """有界队列，消费者读得慢时生产者在put上等待，形成背压"""
+
+    _DONE = object()
+
+    def __init__(self, maxsize: int = 256):
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    async def emit(self, event: dict):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            await self.queue.put(event)
+        else:
+            # 来自其它事件循环（例如MCP会话池的后台循环）
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.queue.put(event), self.loop))
+
+    def emit_sync(self, event: dict):
+        """在其它线程中同步发送事件，不能在消费者所在的事件循环线程中调用"""
+        asyncio.run_coroutine_threadsafe(self.queue.put(event), self.loop).result()
+
+    async def close(self):
+        await self.queue.put(self._DONE)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        event = await self.queue.get()
+        if event is self._DONE:
+            raise StopAsyncIteration
+        return event
+
+
+class BufferedSink(EventSink):
+    """先缓存事件，attach之后按顺序转发缓存的事件，之后的事件直接转发
+
+    用于推测执行：结果是否被采用确定之前，事件不能发给调用方。只能在同一个事件循环中使用。
+    """
+
+    def __init__(self):
+        self.events: list[dict] = []
+        self.target: EventSink | None = None
+        self.attached = False
+
+    async def emit(self, event: dict):
+        if not self.attached:
+            self.events.append(event)
+        elif self.target is not None:
+            await self.target.emit(event)
+
+    def emit_sync(self, event: dict):
+        if not self.attached:
+            self.events.append(event)
+        elif self.target is not None:
+            self.target.emit_sync(event)
+
+    async def attach(self, target: EventSink | None):
+        """转发缓存的事件给target，target为None时丢弃"""
+        self.target = target
+        # 转发过程中生产者可能继续写入缓存，直到缓存清空才切换为直接转发
+        while self.events:
+            event = self.events.pop(0)
+            if target is not None:
+                await target.emit(event)
+        self.attached = True
+
+
+def current_sink() -> EventSink | None:
+    """当前上下文中的事件接收端，没有调用方订阅时返回None"""
+    return _current_sink.get()
+
+
+def set_sink(sink: EventSink | None):
+    """设置当前上下文的事件接收端，返回用于恢复的token"""
+    return _current_sink.set(sink)
+
+
+def reset_sink(token):
+    _current_sink.reset(token)
@@ -0,0 +1,73 @@
+"""supervisor分类模型的解码模式
+
+free: 原始模式，模型自由生成（可能包含思考过程），取最后一行作为标签
+constrained: 关闭思考、限制生成token数并设置停止符，只生成标签本身
+json: 在constrained的基础上用JSON Schema把输出限制为标签枚举（需要后端支持response_format）
+"""
+
+import json
+import re
+
+SUPERVISOR_MODES = ("free", "constrained", "json")
+
+SUPERVISOR_PROMPT = "消息分类为 search、rag、chat、other 中的一类，只输出标签。"
+
+# Qwen3系列的软开关，关闭思考过程
+NO_THINK = "/no_think"
+
+_THINK_RE = re.compile(r"<think>.*?(</think>|$)", re.DOTALL)
+
+
+def supervisor_prompt(mode: str) -> str:
+    """不同模式下的system prompt"""
+    if mode == "free":
+        return SUPERVISOR_PROMPT
+    return f"{SUPERVISOR_PROMPT}{NO_THINK}"
+
+
+def bind_supervisor(llm, mode: str, labels: list[str], max_tokens: int = 12):
+    """按解码模式给supervisor模型绑定生成参数"""
+    if mode not in SUPERVISOR_MODES:
+        raise ValueError(f"Invalid supervisor mode: {mode}. Must be one of {SUPERVISOR_MODES}.")
+    if mode == "free":
+        return llm
+    # 思考块为空时模型仍会输出<think></think>，所以token上限留一点余量
+    kwargs = {"max_tokens": max_tokens, "temperature": 0, "stop": [".", "。", ",", "，"]}
+    if mode == "json":
+        kwargs["max_tokens"] = max_tokens + 8
+        kwargs["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "supervisor_label",
+                "schema": {
+                    "type": "object",
+                    "properties": {"label": {"type": "string", "enum": list(labels)}},
+                    "required": ["label"],
+                },
+            },
+        }
+        # JSON内部的逗号不能作为停止符
+        kwargs.pop("stop")
+    return llm.bind(**kwargs)
+
+
+def parse_label(text: str, labels: list[str]) -> str | None:
+    """从模型输出中解析标签，兼容思考块、JSON、多余的标点和大小写"""
+    text = _THINK_RE.sub("", text or "").strip()
+    if not text:
+        return None
+    if text.startswith("{"):
+        try:
+            label = str(json.loads(text).get("label", "")).strip().lower()
+            if label in labels:
+                return label
+        except (json.JSONDecodeError, AttributeError):
+            pass
+    # 优先使用最后一行的完整标签，和free模式原来的行为保持一致
+    for line in reversed(text.splitlines()):
+        word = line.strip().strip("\"'`*.,。，:：").lower()
+        if word in labels:
+            return word
+    # 最后在全文中查找最后出现的标签单词
+    found = re.findall(r"\b(" + "|".join(map(re.escape, labels)) + r")\b", text.lower())
+    return found[-1] if found else None
@@ -0,0 +1,159 @@
+"""MCP工具调用的记忆化缓存
+
+对ReAct agent中重复出现的相同工具调用（同样的检索词、同样的条目key）直接返回缓存结果。
+参数会先规范化再作为缓存键，每个工具可以单独设置TTL，会修改数据的工具默认不缓存。
+缓存未命中时，同时进行的相同调用合并为一次（见agent.single_flight）。
+"""
+
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+from langchain_core.tools import BaseTool, StructuredTool
+from loguru import logger
+
+from agent.single_flight import SingleFlight
+
+# 名称中以这些动词为独立词（用_、-、.分隔）的工具视为会修改Zotero数据，不做缓存；
+# get_dataset、get_settings、search_by_address这类只是包含相同字母的查询工具不受影响
+MUTATING_TOOL_PATTERN = r"(^|[_.-])(create|add|update|delete|remove|write|set|import|sync|move|rename)([_.-]|$)"
+
+# 条目级别的查询结果变化很少，缓存时间更长
+DEFAULT_TOOL_TTLS = {
+    "zotero_get_item_metadata": 3600.0,
+    "zotero_get_item_fulltext": 3600.0,
+    "zotero_get_item_children": 3600.0,
+}
+
+
+def _canonical(value):
+    """规范化参数：字符串去掉首尾空白并统一全半角，字典按键排序"""
+    if isinstance(value, str):
+        return unicodedata.normalize("NFKC", value).strip()
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in sorted(value.items()) if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def canonical_key(tool_name: str, arguments: dict) -> str:
+    return tool_name + ":" + json.dumps(_canonical(arguments), ensure_ascii=False, sort_keys=True)
+
+
+class ToolCallCache:
+    """线程安全的工具调用结果缓存，按LRU淘汰"""
+
+    def __init__(
+        self,
+        default_ttl: float = 300.0,
+        tool_ttls: dict[str, float] | None = None,
+        no_cache: set[str] | None = None,
+        max_entries: int = 2048,
+        mutating_pattern: str = MUTATING_TOOL_PATTERN,
+    ):
+        self.default_ttl = default_ttl
+        self.tool_ttls = {**DEFAULT_TOOL_TTLS, **(tool_ttls or {})}
+        self.no_cache = set(no_cache or ())
+        self.max_entries = max_entries
+        self._mutating = re.compile(mutating_pattern, re.IGNORECASE)
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.flights = SingleFlight("tool")
+
+    def cacheable(self, tool_name: str) -> bool:
+        if tool_name in self.no_cache or self.tool_ttls.get(tool_name, self.default_ttl) <= 0:
+            return False
+        return not self._mutating.search(tool_name)
+
+    def get(self, key: str, tool_name: str):
+        """返回(是否命中, 结果)"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] > now:
+                self._entries.move_to_end(key)
+                self.hits[tool_name] += 1
+                return True, item[1]
+            if item is not None:
+                del self._entries[key]
+            self.misses[tool_name] += 1
+            return False, None
+
+    def put(self, key: str, tool_name: str, result):
+        ttl = self.tool_ttls.get(tool_name, self.default_ttl)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tool_name: str | None = None):
+        """清空缓存，指定tool_name时只清空该工具的结果"""
+        with self._lock:
+            if tool_name is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k.startswith(tool_name + ":")]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+            }
+
+    def wrap(self, tools: list[BaseTool]) -> list[BaseTool]:
+        """给工具套上缓存层，不可缓存的工具原样返回"""
+        wrapped = []
+        for tool in tools:
+            if self.cacheable(tool.name):
+                wrapped.append(self._wrap_tool(tool))
+            else:
+                logger.info(f"工具 {tool.name} 不做缓存")
+                wrapped.append(tool)
+        return wrapped
+
+    def _wrap_tool(self, tool: BaseTool) -> BaseTool:
+        name = tool.name
+        # 直接调用原始实现，工具报错时会抛出异常，避免把错误信息缓存下来
+        coroutine = getattr(tool, "coroutine", None)
+        func = getattr(tool, "func", None)
+
+        async def _arun(**arguments):
+            key = canonical_key(name, arguments)
+            hit, result = self.get(key, name)
+            if hit:
+                return result
+            if coroutine is not None:
+                result = await self.flights.ado(key, lambda: coroutine(**arguments))
+            else:
+                result = await self.flights.ado(key, lambda: tool.ainvoke(arguments))
+            self.put(key, name, result)
+            return result
+
+        def _run(**arguments):
+            key = canonical_key(name, arguments)
+            hit, result = self.get(key, name)
+            if hit:
+                return result
+            result = self.flights.do(key, lambda: func(**arguments) if func is not None else tool.invoke(arguments))
+            self.put(key, name, result)
+            return result
+
+        return StructuredTool(
+            name=name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            func=_run if func is not None else None,
+            coroutine=_arun,
+            response_format=getattr(tool, "response_format", "content"),
+            handle_tool_error=True,
+        )
@@ -0,0 +1,350 @@
+"""采样追踪
+
+TracingCallback从LangChain回调中收集一次图调用的全部span，调用结束后决定是否导出：
+
+- 头部采样：调用开始时按sample_rate抽中的调用，记录截断后的输入输出
+- 尾部采样：未抽中的调用只记录名称、耗时和错误，出错或耗时超过slow_threshold时仍然导出
+
+导出在后台线程中进行，队列有界，队列满时直接丢弃，不会阻塞节点。
+导出目标可以是OTLP JSON格式的本地文件（JsonlSink），也可以是LangSmith（LangSmithSink）。
+"""
+
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from langchain_core.callbacks import BaseCallbackHandler
+from loguru import logger
+
+from agent.metrics import token_usage
+
+
+@dataclass
+class Span:
+    run_id: uuid.UUID
+    parent_id: uuid.UUID | None
+    name: str
+    run_type: str
+    start: float
+    end: float | None = None
+    inputs: dict | None = None
+    outputs: dict | None = None
+    error: str | None = None
+    attributes: dict = field(default_factory=dict)
+
+
+@dataclass
+class Trace:
+    root_id: uuid.UUID
+    sampled: bool
+    spans: list[Span] = field(default_factory=list)
+    # 超过span上限后不再记录的span数
+    dropped_spans: int = 0
+    # 未记录span但仍在进行中的run，子run要靠它们找到所属的trace，结束时一并清理
+    dropped_runs: set = field(default_factory=set)
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+    @property
+    def duration(self) -> float:
+        return (self.root.end or self.root.start) - self.root.start
+
+    @property
+    def failed(self) -> bool:
+        return any(span.error for span in self.spans)
+
+
+def _preview(value, max_chars: int):
+    """把输入输出转换为可序列化的dict，长文本截断"""
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        value = {"value": value}
+    text = json.dumps(value, ensure_ascii=False, default=str)
+    if len(text) <= max_chars:
+        return json.loads(text)
+    return {"preview": text[:max_chars], "truncated": len(text) - max_chars}
+
+
+class TracingCallback(BaseCallbackHandler):
+    """按头部和尾部采样规则收集调用链路"""
+
+    run_inline = True
+
+    def __init__(
+        self,
+        exporter: "BackgroundExporter",
+        sample_rate: float = 0.1,
+        slow_threshold: float = 20.0,
+        max_field_chars: int = 2000,
+        max_spans: int = 500,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_field_chars = max_field_chars
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        # run_id -> 所属的Trace
+        self._runs: dict[uuid.UUID, Trace] = {}
+        # run_id -> Span，超过上限的span不记录
+        self._spans: dict[uuid.UUID, Span] = {}
+
+    def _start(self, run_id, parent_run_id, name: str, run_type: str, inputs):
+        with self._lock:
+            trace = self._runs.get(parent_run_id) if parent_run_id else None
+            if trace is None:
+                trace = Trace(root_id=run_id, sampled=random.random() < self.sample_rate)
+                parent_run_id = None
+            self._runs[run_id] = trace
+            if len(trace.spans) >= self.max_spans:
+                trace.dropped_spans += 1
+                trace.dropped_runs.add(run_id)
+                return
+            span = Span(
+                run_id=run_id,
+                parent_id=parent_run_id,
+                name=name,
+                run_type=run_type,
+                start=time.time(),
+                # 未抽中的调用不序列化输入，避免大段搜索结果拖慢每次请求
+                inputs=_preview(inputs, self.max_field_chars) if trace.sampled else None,
+            )
+            trace.spans.append(span)
+            self._spans[run_id] = span
+
+    def _end(self, run_id, outputs=None, error: BaseException | None = None, **attributes):
+        with self._lock:
+            trace = self._runs.get(run_id)
+            span = self._spans.pop(run_id, None)
+            if span is not None:
+                span.end = time.time()
+                span.error = repr(error) if error is not None else None
+                span.attributes.update(attributes)
+                if trace.sampled:
+                    span.outputs = _preview(outputs, self.max_field_chars)
+            if trace is None:
+                return
+            if trace.root_id != run_id:
+                if span is None:
+                    # 没有记录span的run结束后不会再有子run，不再需要映射
+                    trace.dropped_runs.discard(run_id)
+                    self._runs.pop(run_id, None)
+                return
+            for span in trace.spans:
+                self._runs.pop(span.run_id, None)
+                self._spans.pop(span.run_id, None)
+            # 没有收到结束回调的run
+            for dropped in trace.dropped_runs:
+                self._runs.pop(dropped, None)
+            trace.dropped_runs.clear()
+            self._runs.pop(run_id, None)
+        if trace.sampled or trace.failed or trace.duration >= self.slow_threshold:
+            self.exporter.export(trace)
+
+    @staticmethod
+    def _name(serialized, kwargs, default: str) -> str:
+        return kwargs.get("name") or (serialized or {}).get("name") or default
+
+    # 链和图节点
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "chain"), "chain", inputs)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id, outputs)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # 模型
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "llm"), "llm", {"messages": messages})
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "llm"), "llm", {"prompts": prompts})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt, completion = token_usage(response)
+        outputs = {"generations": [[g.text for g in generations] for generations in response.generations]}
+        self._end(run_id, outputs, prompt_tokens=prompt, completion_tokens=completion)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # 工具
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, inputs=None, **kwargs):
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "tool"), "tool", inputs or {"input": input_str})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, {"output": output})
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # 检索
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "retriever"), "retriever", {"query": query})
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, {"documents": documents})
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+
+class BackgroundExporter:
+    """有界队列 + 后台线程批量导出，队列满时丢弃新的trace"""
+
+    def __init__(self, sink, maxsize: int = 1000, batch_size: int = 50, flush_interval: float = 1.0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.exported = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"追踪导出队列已满，已丢弃 {self.dropped} 条trace")
+
+    def _run(self):
+        closing = False
+        while not closing:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            if not batch:
+                continue
+            try:
+                self.sink.write(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                logger.warning(f"追踪导出失败，丢弃 {len(batch)} 条trace: {e}")
+
+    def close(self, timeout: float = 10.0):
+        """导出队列中剩余的trace后停止后台线程"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+        close = getattr(self.sink, "close", None)
+        if close:
+            close()
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=str)
+    return {"stringValue": value}
+
+
+class JsonlSink:
+    """每个trace写一行OTLP JSON（ExportTraceServiceRequest），可用collector的otlpjsonfile接收器导入"""
+
+    def __init__(self, path: str, service_name: str = "research-agent"):
+        self.path = path
+        self.service_name = service_name
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _span(self, trace: Trace, span: Span) -> dict:
+        attributes = {"run_type": span.run_type, "sampled": trace.sampled, **span.attributes}
+        if span.inputs is not None:
+            attributes["input"] = span.inputs
+        if span.outputs is not None:
+            attributes["output"] = span.outputs
+        if span is trace.root and trace.dropped_spans:
+            attributes["dropped_spans"] = trace.dropped_spans
+        otlp = {
+            "traceId": trace.root_id.hex,
+            "spanId": span.run_id.hex[:16],
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(span.start * 1e9)),
+            "endTimeUnixNano": str(int((span.end or span.start) * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp["parentSpanId"] = span.parent_id.hex[:16]
+        return otlp
+
+    def write(self, traces: list[Trace]):
+        for trace in traces:
+            request = {
+                "resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                    "scopeSpans": [{
+                        "scope": {"name": "agent.tracing"},
+                        "spans": [self._span(trace, span) for span in trace.spans],
+                    }],
+                }]
+            }
+            self._file.write(json.dumps(request, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class LangSmithSink:
+    """通过LangSmith的批量接口上传trace"""
+
+    def __init__(self, client, project: str):
+        self.client = client
+        self.project = project
+
+    def _runs(self, trace: Trace) -> list[dict]:
+        dotted = {}
+        runs = []
+        for span in trace.spans:
+            start = datetime.fromtimestamp(span.start, timezone.utc)
+            order = f"{start:%Y%m%dT%H%M%S%fZ}{span.run_id}"
+            # 父span没有被记录时挂到根span下
+            parent_id = span.parent_id if span.parent_id in dotted else (None if span is trace.root else trace.root_id)
+            dotted[span.run_id] = f"{dotted[parent_id]}.{order}" if parent_id else order
+            runs.append({
+                "id": span.run_id,
+                "trace_id": trace.root_id,
+                "parent_run_id": parent_id,
+                "dotted_order": dotted[span.run_id],
+                "name": span.name,
+                "run_type": span.run_type,
+                "start_time": start,
+                "end_time": datetime.fromtimestamp(span.end or span.start, timezone.utc),
+                "inputs": span.inputs or {},
+                "outputs": span.outputs or {},
+                "error": span.error,
+                "extra": {"metadata": {"sampled": trace.sampled, **span.attributes}},
+                "session_name": self.project,
+            })
+        return runs
+
+    def write(self, traces: list[Trace]):
+        self.client.batch_ingest_runs(create=[run for trace in traces for run in self._runs(trace)])
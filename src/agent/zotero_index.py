@@ -0,0 +1,549 @@
+"""本地Zotero检索引擎
+
+离线索引器直接读取Zotero数据目录（zotero.sqlite和storage/），导出条目的标题、作者、摘要、笔记和PDF全文
+（Zotero为PDF生成的.zotero-ft-cache），切分成片段后：
+- 写入SQLite FTS5倒排索引，查询时按BM25排序（中文按二字切分，见agent.memory_store.segment）
+- 配置了向量模型时，用torch在CPU上批量计算向量，追加到内存映射的NumPy矩阵文件中
+查询时两路结果用RRF融合，再按条目聚合，供rag_node使用。
+
+重新索引时只处理指纹（修改时间、笔记和附件的修改时间、全文缓存文件的大小和时间）变化的条目。
+被删除或修改的条目对应的向量行标记为失效，失效行过多时重写矩阵文件。
+
+构建索引：
+    python -m agent.zotero_index --zotero-dir ~/Zotero --index-dir resource/zotero_index --model BAAI/bge-small-zh-v1.5
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+from loguru import logger
+
+from agent.memory_store import segment
+
+ITEMS_SQL = """
+SELECT i.itemID, i.key, i.dateModified FROM items i
+JOIN itemTypes t ON t.itemTypeID = i.itemTypeID
+WHERE t.typeName NOT IN ('attachment', 'note', 'annotation')
+AND i.itemID NOT IN (SELECT itemID FROM deletedItems)
+"""
+FIELDS_SQL = """
+SELECT d.itemID, f.fieldName, v.value FROM itemData d
+JOIN fields f ON f.fieldID = d.fieldID
+JOIN itemDataValues v ON v.valueID = d.valueID
+WHERE f.fieldName IN ('title', 'abstractNote', 'date')
+"""
+CREATORS_SQL = """
+SELECT ic.itemID, c.firstName, c.lastName FROM itemCreators ic
+JOIN creators c ON c.creatorID = ic.creatorID
+ORDER BY ic.itemID, ic.orderIndex
+"""
+NOTES_SQL = """
+SELECT n.parentItemID, n.note, i.dateModified FROM itemNotes n
+JOIN items i ON i.itemID = n.itemID
+WHERE n.parentItemID IS NOT NULL AND n.itemID NOT IN (SELECT itemID FROM deletedItems)
+"""
+ATTACHMENTS_SQL = """
+SELECT a.parentItemID, i.key, i.dateModified FROM itemAttachments a
+JOIN items i ON i.itemID = a.itemID
+WHERE a.parentItemID IS NOT NULL AND a.contentType = 'application/pdf'
+AND a.itemID NOT IN (SELECT itemID FROM deletedItems)
+"""
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+@dataclass
+class ZoteroItem:
+    key: str
+    title: str = ""
+    authors: str = ""
+    year: str = ""
+    abstract: str = ""
+    notes: list[str] = field(default_factory=list)
+    fulltext_paths: list[str] = field(default_factory=list)
+    fingerprint: str = ""
+
+
+class ZoteroLibrary:
+    """只读访问Zotero数据目录"""
+
+    def __init__(self, data_dir: str):
+        self.data_dir = os.path.expanduser(data_dir)
+        self.db_path = os.path.join(self.data_dir, "zotero.sqlite")
+        self.storage_dir = os.path.join(self.data_dir, "storage")
+
+    def items(self) -> list[ZoteroItem]:
+        """导出所有条目的元数据和指纹，PDF全文只记录路径，需要时再读"""
+        # Zotero运行时独占锁定数据库，复制一份快照再读
+        fd, snapshot = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        try:
+            shutil.copyfile(self.db_path, snapshot)
+            db = sqlite3.connect(snapshot)
+            try:
+                return self._read(db)
+            finally:
+                db.close()
+        finally:
+            os.remove(snapshot)
+
+    def _read(self, db: sqlite3.Connection) -> list[ZoteroItem]:
+        items, stamps = {}, {}
+        for item_id, key, modified in db.execute(ITEMS_SQL):
+            items[item_id] = ZoteroItem(key=key)
+            stamps[item_id] = [modified]
+        for item_id, name, value in db.execute(FIELDS_SQL):
+            if item_id not in items:
+                continue
+            if name == "title":
+                items[item_id].title = value
+            elif name == "abstractNote":
+                items[item_id].abstract = value
+            elif name == "date":
+                items[item_id].year = str(value)[:4]
+        authors = {}
+        for item_id, first, last in db.execute(CREATORS_SQL):
+            authors.setdefault(item_id, []).append(" ".join(part for part in (first, last) if part))
+        for item_id, names in authors.items():
+            if item_id in items:
+                items[item_id].authors = ", ".join(names)
+        for parent_id, note, modified in db.execute(NOTES_SQL):
+            if parent_id in items:
+                items[parent_id].notes.append(html.unescape(_TAG_RE.sub(" ", note or "")))
+                stamps[parent_id].append(modified)
+        for parent_id, key, modified in db.execute(ATTACHMENTS_SQL):
+            if parent_id not in items:
+                continue
+            path = os.path.join(self.storage_dir, key, ".zotero-ft-cache")
+            stamps[parent_id].append(modified)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                items[parent_id].fulltext_paths.append(path)
+                stamps[parent_id].append(f"{key}:{stat.st_size}:{stat.st_mtime_ns}")
+        for item_id, item in items.items():
+            item.fingerprint = hashlib.sha1("\x00".join(sorted(map(str, stamps[item_id]))).encode("utf-8")).hexdigest()
+        return list(items.values())
+
+
+def chunk_text(text: str, size: int = 800, overlap: int = 100) -> list[str]:
+    """按字符切分长文本，尽量在换行或句号处断开"""
+    text = re.sub(r"[ \t]+", " ", text or "").strip()
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            # 在窗口后20%的范围内找自然断点
+            cut = max(text.rfind(sep, start + size * 4 // 5, end) for sep in ("\n", "。", ". "))
+            if cut > start:
+                end = cut + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def item_chunks(item: ZoteroItem, size: int = 800, overlap: int = 100, max_chunks: int = 200) -> list[tuple[str, str]]:
+    """条目切分成 (类型, 文本) 片段：元数据+摘要、笔记、PDF全文"""
+    head = "\n".join(part for part in (item.title, item.authors, item.year) if part)
+    chunks = [("meta", f"{head}\n{chunk}") for chunk in chunk_text(item.abstract, size, overlap)] or [("meta", head)]
+    for note in item.notes:
+        chunks.extend(("note", chunk) for chunk in chunk_text(note, size, overlap))
+    for path in item.fulltext_paths:
+        try:
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                fulltext = f.read()
+        except OSError as e:
+            logger.warning(f"读取全文缓存失败 {path}: {e}")
+            continue
+        chunks.extend(("pdf", chunk) for chunk in chunk_text(fulltext, size, overlap))
+    return [(kind, text) for kind, text in chunks if text.strip()][:max_chunks]
+
+
+class TorchEmbedder:
+    """transformers加载模型、torch在CPU上批量推理的向量函数（mean pooling + L2归一化）"""
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = 32,
+        max_length: int = 512,
+        device: str = "cpu",
+        query_instruction: str = "",
+    ):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.device = device
+        self.query_instruction = query_instruction
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).to(device).eval()
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        torch = self.torch
+        # 按长度排序后分批，减少padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            batch = self.tokenizer(
+                [texts[i] for i in batch_ids],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="pt",
+            ).to(self.device)
+            with torch.inference_mode():
+                hidden = self.model(**batch).last_hidden_state
+                mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                pooled = torch.nn.functional.normalize(pooled, dim=-1)
+            for i, vector in zip(batch_ids, pooled.float().cpu().numpy()):
+                vectors[i] = vector
+        return np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self([self.query_instruction + text])[0]
+
+
+class ZoteroIndex:
+    """Zotero条目的混合检索索引：SQLite FTS5（BM25）+ 内存映射的向量矩阵，线程安全"""
+
+    DB_NAME = "index.sqlite3"
+
+    def __init__(self, index_dir: str, embed=None, compact_ratio: float = 0.3):
+        """embed为批量向量函数 list[str] -> ndarray，name属性为模型名；不传则只做BM25检索"""
+        self.index_dir = index_dir
+        self.embed = embed
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(index_dir, self.DB_NAME), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                title TEXT,
+                authors TEXT,
+                year TEXT
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                item_key TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                text TEXT NOT NULL,
+                vector_row INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS chunks_item ON chunks(item_key);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(tokens);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        self._matrix = None
+        self._row_chunk = np.zeros(0, dtype=np.int64)
+        self._load_vectors()
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    @classmethod
+    def exists(cls, index_dir: str) -> bool:
+        return os.path.exists(os.path.join(index_dir, cls.DB_NAME))
+
+    @classmethod
+    def open(cls, index_dir: str, **embedder_kwargs) -> "ZoteroIndex":
+        """打开已构建的索引，自动加载建索引时使用的向量模型；torch不可用时只做BM25检索"""
+        index = cls(index_dir)
+        model = index._meta("model")
+        if model:
+            try:
+                index.embed = TorchEmbedder(model, **embedder_kwargs)
+            except Exception as e:
+                logger.warning(f"加载向量模型 {model} 失败，Zotero检索只使用BM25: {e}")
+        return index
+
+    # ---- 元数据和向量文件 ----
+
+    def _meta(self, key: str) -> str | None:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _vector_path(self) -> str | None:
+        name = self._meta("vector_file")
+        return os.path.join(self.index_dir, name) if name else None
+
+    def _vector_rows(self) -> int:
+        path, dim = self._vector_path(), int(self._meta("dim") or 0)
+        if not path or not dim or not os.path.exists(path):
+            return 0
+        # 写到一半中断的行不计入，下次追加时覆盖
+        return os.path.getsize(path) // (dim * 4)
+
+    def _load_vectors(self):
+        rows = self._vector_rows()
+        if rows == 0:
+            self._matrix, self._row_chunk = None, np.zeros(0, dtype=np.int64)
+            return
+        dim = int(self._meta("dim"))
+        self._matrix = np.memmap(self._vector_path(), dtype=np.float32, mode="r", shape=(rows, dim))
+        row_chunk = np.full(rows, -1, dtype=np.int64)
+        for chunk_id, row in self._db.execute("SELECT id, vector_row FROM chunks WHERE vector_row IS NOT NULL"):
+            if row < rows:
+                row_chunk[row] = chunk_id
+        self._row_chunk = row_chunk
+
+    def _append_vectors(self, vectors: np.ndarray) -> int:
+        """追加向量到矩阵文件，返回第一行的行号"""
+        if self._meta("vector_file") is None:
+            with self._db:
+                self._set_meta("vector_file", "vectors-0.f32")
+                self._set_meta("dim", vectors.shape[1])
+        elif int(self._meta("dim")) != vectors.shape[1]:
+            raise ValueError(f"Embedding dimension changed: {self._meta('dim')} -> {vectors.shape[1]}")
+        start = self._vector_rows()
+        with open(self._vector_path(), "r+b" if os.path.exists(self._vector_path()) else "wb") as f:
+            f.seek(start * vectors.shape[1] * 4)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.truncate()
+        return start
+
+    def _reset_vectors(self):
+        """更换向量模型时丢弃旧矩阵，所有条目重新计算"""
+        old = self._vector_path()
+        with self._db:
+            self._db.execute("UPDATE chunks SET vector_row = NULL")
+            self._db.execute("DELETE FROM meta WHERE key IN ('vector_file', 'dim')")
+            self._db.execute("UPDATE items SET fingerprint = ''")
+        self._matrix = None
+        self._remove_stale_vectors()
+
+    def _compact(self):
+        """失效行过多时重写矩阵文件，新文件名写入meta后再删除旧文件，中途中断也不会错位"""
+        rows = self._db.execute(
+            "SELECT id, vector_row FROM chunks WHERE vector_row IS NOT NULL ORDER BY vector_row"
+        ).fetchall()
+        old_path, dim = self._vector_path(), int(self._meta("dim"))
+        source = np.memmap(old_path, dtype=np.float32, mode="r", shape=(self._vector_rows(), dim))
+        version = int(os.path.basename(old_path).split("-")[1].split(".")[0]) + 1
+        new_name = f"vectors-{version}.f32"
+        with open(os.path.join(self.index_dir, new_name), "wb") as f:
+            for start in range(0, len(rows), 4096):
+                f.write(np.ascontiguousarray(source[[row for _, row in rows[start:start + 4096]]]).tobytes())
+        del source
+        with self._db:
+            self._db.executemany("UPDATE chunks SET vector_row = ? WHERE id = ?", [(i, chunk_id) for i, (chunk_id, _) in enumerate(rows)])
+            self._set_meta("vector_file", new_name)
+        self._matrix = None
+        self._remove_stale_vectors()
+        logger.info(f"向量矩阵已压缩为 {len(rows)} 行")
+
+    def _remove_stale_vectors(self):
+        """删除旧版本的矩阵文件，其它进程还映射着旧文件时（Windows上无法删除）留到下次再删"""
+        current = self._meta("vector_file")
+        for name in os.listdir(self.index_dir):
+            if re.fullmatch(r"vectors-\d+\.f32", name) and name != current:
+                try:
+                    os.remove(os.path.join(self.index_dir, name))
+                except OSError as e:
+                    logger.warning(f"删除旧向量文件 {name} 失败: {e}")
+
+    # ---- 索引 ----
+
+    def update(self, library: ZoteroLibrary, batch_items: int = 32, chunk_size: int = 800, overlap: int = 100) -> dict:
+        """增量更新索引，只重新处理新增和指纹变化的条目，返回各类条目的数量"""
+        with self._lock:
+            model = getattr(self.embed, "name", None) if self.embed is not None else None
+            if model != self._meta("model"):
+                if self._meta("model") is not None or self._vector_rows():
+                    logger.info(f"向量模型变化 ({self._meta('model')} -> {model})，重新计算全部条目")
+                    self._reset_vectors()
+                with self._db:
+                    if model is None:
+                        self._db.execute("DELETE FROM meta WHERE key = 'model'")
+                    else:
+                        self._set_meta("model", model)
+
+            items = library.items()
+            indexed = dict(self._db.execute("SELECT key, fingerprint FROM items"))
+            current = {item.key for item in items}
+            changed = [item for item in items if indexed.get(item.key) != item.fingerprint]
+            removed = [key for key in indexed if key not in current]
+            self._delete_items(removed)
+
+            start_time = time.perf_counter()
+            for start in range(0, len(changed), batch_items):
+                self._index_batch(changed[start:start + batch_items], chunk_size, overlap)
+                logger.info(f"已索引 {min(start + batch_items, len(changed))}/{len(changed)} 个条目")
+
+            total = self._vector_rows()
+            live = self._db.execute("SELECT COUNT(*) FROM chunks WHERE vector_row IS NOT NULL").fetchone()[0]
+            if total and (total - live) / total > self.compact_ratio:
+                self._compact()
+            self._load_vectors()
+            stats = {
+                "items": len(items),
+                "changed": len(changed),
+                "removed": len(removed),
+                "seconds": round(time.perf_counter() - start_time, 2),
+            }
+            logger.info(f"Zotero索引更新完成: {stats}")
+            return stats
+
+    def _delete_items(self, keys: list[str]):
+        if not keys:
+            return
+        with self._db:
+            for key in keys:
+                self._db.execute(
+                    "DELETE FROM chunks_fts WHERE rowid IN (SELECT id FROM chunks WHERE item_key = ?)", (key,)
+                )
+                self._db.execute("DELETE FROM chunks WHERE item_key = ?", (key,))
+                self._db.execute("DELETE FROM items WHERE key = ?", (key,))
+
+    def _index_batch(self, items: list[ZoteroItem], chunk_size: int, overlap: int):
+        """一批条目一个事务：先追加向量再写数据库，中断后只会留下未引用的向量行"""
+        records = [(item, item_chunks(item, chunk_size, overlap)) for item in items]
+        texts = [text for _, chunks in records for _, text in chunks]
+        first_row = None
+        if self.embed is not None and texts:
+            first_row = self._append_vectors(np.asarray(self.embed(texts), dtype=np.float32))
+        self._delete_items([item.key for item in items])
+        offset = 0
+        with self._db:
+            for item, chunks in records:
+                for kind, text in chunks:
+                    row = first_row + offset if first_row is not None else None
+                    cursor = self._db.execute(
+                        "INSERT INTO chunks (item_key, kind, text, vector_row) VALUES (?, ?, ?, ?)",
+                        (item.key, kind, text, row),
+                    )
+                    self._db.execute(
+                        "INSERT INTO chunks_fts (rowid, tokens) VALUES (?, ?)",
+                        (cursor.lastrowid, " ".join(segment(text))),
+                    )
+                    offset += 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO items (key, fingerprint, title, authors, year) VALUES (?, ?, ?, ?, ?)",
+                    (item.key, item.fingerprint, item.title, item.authors, item.year),
+                )
+
+    # ---- 查询 ----
+
+    def _search_fts(self, query: str, n: int) -> list[int]:
+        tokens = dict.fromkeys(segment(query))
+        if not tokens:
+            return []
+        match = " OR ".join(f'"{token}"' for token in tokens)
+        rows = self._db.execute(
+            "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?", (match, n)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _search_vector(self, vector: np.ndarray, n: int) -> list[int]:
+        if self._matrix is None:
+            return []
+        scores = np.asarray(self._matrix @ vector)
+        scores[self._row_chunk < 0] = -np.inf
+        n = min(n, len(scores))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return [int(self._row_chunk[i]) for i in top if np.isfinite(scores[i])]
+
+    def search(self, query: str, k: int = 5) -> list[dict]:
+        """混合检索，返回最相关的k个条目，每个条目附带最相关的片段"""
+        vector = None
+        if self.embed is not None and self._matrix is not None:
+            try:
+                vector = self.embed.embed_query(query) if hasattr(self.embed, "embed_query") else self.embed([query])[0]
+            except Exception as e:
+                logger.warning(f"Zotero向量检索失败，只使用BM25: {e}")
+        with self._lock:
+            # 离线索引器在其它进程中更新了索引时重新映射向量矩阵
+            data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._load_vectors()
+            ranked = [self._search_fts(query, k * 10)]
+            if vector is not None:
+                ranked.append(self._search_vector(np.asarray(vector, dtype=np.float32), k * 10))
+            # 倒数排名融合（RRF）
+            scores = {}
+            for ids in ranked:
+                for rank, chunk_id in enumerate(ids):
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (60 + rank)
+            if not scores:
+                return []
+            rows = self._db.execute(
+                "SELECT c.id, c.item_key, c.kind, c.text, i.title, i.authors, i.year FROM chunks c "
+                f"JOIN items i ON i.key = c.item_key WHERE c.id IN ({','.join('?' * len(scores))})",
+                list(scores),
+            ).fetchall()
+        # 按条目聚合，取条目中得分最高的片段
+        best = {}
+        for chunk_id, key, kind, text, title, authors, year in rows:
+            score = scores[chunk_id]
+            if key not in best or score > best[key]["score"]:
+                best[key] = {"key": key, "title": title, "authors": authors, "year": year, "kind": kind, "snippet": text, "score": score}
+        return sorted(best.values(), key=lambda hit: hit["score"], reverse=True)[:k]
+
+    def count(self) -> dict:
+        with self._lock:
+            return {
+                "items": self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0],
+                "chunks": self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0],
+                "vector_rows": self._vector_rows(),
+            }
+
+    def close(self):
+        with self._lock:
+            self._matrix = None
+            self._db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建/增量更新本地Zotero检索索引")
+    parser.add_argument("--zotero-dir", default=os.getenv("ZOTERO_DATA_DIR", "~/Zotero"), help="Zotero数据目录，包含zotero.sqlite和storage/")
+    parser.add_argument("--index-dir", default=os.getenv("ZOTERO_INDEX_DIR", "resource/zotero_index"))
+    parser.add_argument("--model", default=os.getenv("ZOTERO_EMBEDDING_MODEL"), help="transformers向量模型，不设置则只建BM25索引")
+    parser.add_argument("--batch-size", type=int, default=32, help="向量计算的批大小")
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU线程数，0为默认")
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--overlap", type=int, default=100)
+    args = parser.parse_args()
+
+    embed = None
+    if args.model:
+        embed = TorchEmbedder(args.model, batch_size=args.batch_size)
+        if args.threads:
+            embed.torch.set_num_threads(args.threads)
+    index = ZoteroIndex(args.index_dir, embed=embed)
+    try:
+        stats = index.update(ZoteroLibrary(args.zotero_dir), chunk_size=args.chunk_size, overlap=args.overlap)
+        print(json.dumps({**stats, **index.count()}, ensure_ascii=False))
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
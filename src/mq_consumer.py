@@ -1,36 +1,68 @@
+import os
 import pika
 import json
+import time
+import argparse
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 from agent.memory_manager import Memory_Manager  # 假设你的 Memory_Manager 类在 memory_manager.py
 
-def memory_queue_consumer():
+# 监听的交换机、队列和路由键
+EXCHANGE = 'memory.direct'
+QUEUE = 'memory.queue'
+ROUTING_KEY = 'memory.info'
+
+
+def declare_topology(channel):
+    # 声明交换机（确保交换机存在）
+    channel.exchange_declare(exchange=EXCHANGE, exchange_type='direct', durable=True)
+    # 声明队列（确保队列存在）
+    channel.queue_declare(queue=QUEUE, durable=True)
+    # 绑定队列到交换机：通过路由键memory.info将队列memory.queue绑定到交换机memory.direct
+    channel.queue_bind(exchange=EXCHANGE, queue=QUEUE, routing_key=ROUTING_KEY)
+
+
+def uncap_background_lane():
+    """consumer进程中只有后台的记忆提取请求，没有需要让路的交互请求，
+    后台请求可以用满端点的并发上限（默认的后台上限是为Agent进程设置的）。
+    显式设置了{NAME}_BACKGROUND_CONCURRENCY时保持不变，必须在创建模型客户端之前调用
+    """
+    from agent.llm_clients import ENDPOINTS
+
+    for config in ENDPOINTS.values():
+        os.environ.setdefault(f"{config.name}_BACKGROUND_CONCURRENCY", str(config.env("CONCURRENCY", config.concurrency)))
+
+
+def parse_message(body: bytes) -> dict:
+    """解析消息体，兼容Celery任务消息格式 [[data], {}, {...}] 和直接发布的 data 字典"""
+    message = json.loads(body)
+    if isinstance(message, list):
+        message = message[0][0]
+    if not isinstance(message, dict):
+        raise ValueError(f"Unsupported message format: {type(message).__name__}")
+    return message
+
+
+def memory_queue_consumer(host='localhost'):
     # 创建 Memory_Manager 实例
     memory_manager = Memory_Manager()
 
     # RabbitMQ连接参数
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=host))
     channel = connection.channel()
-    
-    # 声明交换机（确保交换机存在）
-    channel.exchange_declare(exchange='memory.direct', exchange_type='direct', durable=True)
-    
-    # 监听的队列名：memory.queue
-    queue_name = 'memory.queue'
-    
-    # 声明队列（确保队列存在）
-    channel.queue_declare(queue=queue_name, durable=True)
-    
-    # 绑定队列到交换机：通过路由键mory.info将队列memory.queue绑定到交换机memory.direct
-    channel.queue_bind(exchange='memory.direct', queue=queue_name, routing_key='memory.info')
+    declare_topology(channel)
 
     # 消费回调
     def callback(ch, method, properties, body):
         logger.info(f"Received message")
         try:
             # 解析消息体
-            message = json.loads(body)
-            question = message[0][0]["text"]
-            type = message[0][0]["type"]
+            message = parse_message(body)
+            question = message["text"]
+            type = message["type"]
             if question:
                 memory_manager.task_routing(question, type)  # 处理消息
             else:
@@ -45,19 +77,188 @@ def memory_queue_consumer():
     # 启动消费者（默认推送模式 - Push Model）
     # auto_ack=False表示需要手动确认消息处理完成
     channel.basic_consume(
-        queue=queue_name,
+        queue=QUEUE,
         on_message_callback=callback,  # 消息回调函数 - RabbitMQ推送消息时自动调用
         auto_ack=False  # 手动ACK模式，确保消息处理完成后才从队列删除
     )
 
-    logger.info(f"Waiting for messages in queue: {queue_name}")
+    logger.info(f"Waiting for messages in queue: {QUEUE}")
     try:
         channel.start_consuming()
     except KeyboardInterrupt:
         logger.info("Consumer stopped by user")
     finally:
         connection.close()
-        
-        
+
+
+class BatchMemoryConsumer:
+    """批量并发的记忆消费者
+
+    消息按数量或最长等待时间攒成一批，交给线程池并发处理；
+    ack/nack通过add_callback_threadsafe回到连接线程执行（pika的连接不是线程安全的）。
+    每条消息单独ack/nack，暂时失败（例如记忆写入出错）的消息重新入队一次，再次失败后丢弃。
+    """
+
+    def __init__(self, host='localhost', prefetch=64, batch_size=16, max_wait=0.5, workers=4):
+        self.host = host
+        # prefetch小于batch_size时一批永远攒不满，只能靠max_wait触发
+        self.prefetch = max(prefetch, batch_size)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.workers = workers
+        self.memory_manager = Memory_Manager()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="memory-worker")
+        self.connection = None
+        self.channel = None
+        self._buffer = []
+        self._first_at = None
+        self._inflight = 0
+        self._stop = threading.Event()
+
+    def _on_message(self, ch, method, properties, body):
+        if not self._buffer:
+            self._first_at = time.monotonic()
+        self._buffer.append((method.delivery_tag, body, getattr(method, "redelivered", False)))
+        if len(self._buffer) >= self.batch_size:
+            self._dispatch()
+
+    def _dispatch(self):
+        batch, self._buffer = self._buffer, []
+        self._inflight += 1
+        future = self.executor.submit(self._process, batch)
+        future.add_done_callback(functools.partial(self._on_done, batch))
+
+    def _process(self, batch):
+        """在worker线程中处理一批消息，返回每条消息的结果，含义同Memory_Manager.process_batch"""
+        results = [False] * len(batch)
+        parsed, indexes = [], []
+        for i, (tag, body, _) in enumerate(batch):
+            try:
+                message = parse_message(body)
+                if message.get("text"):
+                    parsed.append(message)
+                    indexes.append(i)
+                else:
+                    logger.warning("No 'text' field in message, skipping.")
+                    results[i] = True
+            except Exception as e:
+                logger.error(f"Error parsing message: {e}")
+        if parsed:
+            for i, ok in zip(indexes, self.memory_manager.process_batch(parsed)):
+                results[i] = ok
+        return results
+
+    def _on_done(self, batch, future):
+        try:
+            results = future.result()
+        except Exception as e:
+            logger.error(f"Error processing batch: {e}")
+            results = [None] * len(batch)
+        # 回到连接线程中ack/nack
+        self.connection.add_callback_threadsafe(functools.partial(self._settle, batch, results))
+
+    def _settle(self, batch, results):
+        self._inflight -= 1
+        if self.channel is None or self.channel.is_closed:
+            logger.warning("Channel closed before batch was settled, messages will be redelivered")
+            return
+        acked = requeued = 0
+        for (tag, _, redelivered), ok in zip(batch, results):
+            if ok:
+                self.channel.basic_ack(delivery_tag=tag)
+                acked += 1
+            elif ok is None and not redelivered:
+                self.channel.basic_nack(delivery_tag=tag, requeue=True)
+                requeued += 1
+            else:
+                self.channel.basic_nack(delivery_tag=tag, requeue=False)
+        logger.info(f"Batch settled: {acked} acked, {requeued} requeued, {len(results) - acked - requeued} nacked")
+
+    def run(self):
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+        self.channel = self.connection.channel()
+        declare_topology(self.channel)
+        self.channel.basic_qos(prefetch_count=self.prefetch)
+        self.channel.basic_consume(queue=QUEUE, on_message_callback=self._on_message, auto_ack=False)
+
+        logger.info(
+            f"Waiting for messages in queue: {QUEUE} "
+            f"(prefetch={self.prefetch}, batch_size={self.batch_size}, max_wait={self.max_wait}s, workers={self.workers})"
+        )
+        try:
+            while not self._stop.is_set():
+                self.connection.process_data_events(time_limit=min(self.max_wait, 0.1))
+                if self._buffer and time.monotonic() - self._first_at >= self.max_wait:
+                    self._dispatch()
+        except KeyboardInterrupt:
+            logger.info("Consumer stopped by user")
+        finally:
+            self.close()
+
+    def stop(self):
+        """从其它线程请求停止消费，run会在处理完已分发的批次后返回"""
+        self._stop.set()
+
+    def close(self):
+        # 处理完已经分发的批次再关闭连接，未分发的消息不ack，断开后会重新投递
+        self.executor.shutdown(wait=True)
+        try:
+            while self._inflight and self.connection.is_open:
+                self.connection.process_data_events(time_limit=0.1)
+            self.connection.close()
+        except Exception as e:
+            logger.warning(f"Error closing consumer connection: {e}")
+
+
+def _run_batch_consumer(kwargs):
+    BatchMemoryConsumer(**kwargs).run()
+
+
+def run_processes(processes: int, **kwargs):
+    """多进程运行批量消费者，每个进程有自己的连接和线程池"""
+    if processes <= 1:
+        _run_batch_consumer(kwargs)
+        return
+    children = [
+        multiprocessing.Process(target=_run_batch_consumer, args=(kwargs,), name=f"memory-consumer-{i}")
+        for i in range(processes)
+    ]
+    for child in children:
+        child.start()
+    try:
+        for child in children:
+            child.join()
+    except KeyboardInterrupt:
+        logger.info("Stopping consumer processes...")
+        for child in children:
+            child.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="memory.queue 消费者")
+    parser.add_argument("--mode", choices=["simple", "batch"], default="simple", help="simple为逐条处理，batch为批量并发处理")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--prefetch", type=int, default=64, help="basic_qos预取数量")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-wait", type=float, default=0.5, help="攒批的最长等待秒数")
+    parser.add_argument("--workers", type=int, default=4, help="每个进程的批处理线程数")
+    parser.add_argument("--processes", type=int, default=1, help="消费者进程数，默认1")
+    args = parser.parse_args()
+
+    # 子进程继承环境变量，同样生效
+    uncap_background_lane()
+    if args.mode == "simple":
+        memory_queue_consumer(args.host)
+        return
+    run_processes(
+        args.processes,
+        host=args.host,
+        prefetch=args.prefetch,
+        batch_size=args.batch_size,
+        max_wait=args.max_wait,
+        workers=args.workers,
+    )
+
+
 if __name__ == "__main__":
-    memory_queue_consumer()
+    main()
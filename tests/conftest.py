@@ -1,6 +1,27 @@
+import os
+import sys
+from unittest import mock
+
 import pytest
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks"))
+
 
 @pytest.fixture(scope="session")
 def anyio_backend():
     return "asyncio"
+
+
+@pytest.fixture(scope="module")
+def offline():
+    """把模型服务、zotero-mcp和RabbitMQ换成benchmarks/stubs.py中的本地替身
+
+    只在使用它的模块内生效，避免影响其它测试对pika的处理"""
+    import pika
+
+    from stubs import FakeBroker, FakeOpenAIServer, offline_env
+
+    with FakeOpenAIServer(latency=0.0, tokens_per_second=10000, tokens=8) as server:
+        with offline_env(server):
+            with mock.patch.object(pika, "BlockingConnection", FakeBroker().connection_factory()):
+                yield server
@@ -1,12 +1,100 @@
 import pytest
-
-from agent import graph
+from langchain_core.messages import HumanMessage
 
 pytestmark = pytest.mark.anyio
 
 
-@pytest.mark.langsmith
-async def test_agent_simple_passthrough() -> None:
-    inputs = {"changeme": "some_val"}
-    res = await graph.ainvoke(inputs)
-    assert res is not None
+async def test_agent_answers_offline(offline) -> None:
+    from agent.graph import graph
+
+    inputs = {"message": [HumanMessage(content="你好")], "type": ""}
+    res = await graph.ainvoke(inputs, {"configurable": {"thread_id": "test"}})
+    assert res["message"][-1].content
+    assert offline.requests
+
+
+async def test_anonymous_questions_leave_no_checkpoints(offline) -> None:
+    from agent.graph import Agent
+
+    agent = Agent()
+    try:
+        for _ in range(3):
+            assert await agent.aask("你好")
+        assert agent.ask("你好")
+        assert list(agent.checkpointer.list(None)) == []
+        # 指定thread_id的会话仍然保留，可以继续对话
+        await agent.aask("你好", thread_id="kept")
+        assert {item.config["configurable"]["thread_id"] for item in agent.checkpointer.list(None)} == {"kept"}
+    finally:
+        agent.close()
+    # 关闭后搜索缓存的SQLite连接也被释放
+    assert agent.search_cache._db is None
+
+
+def test_supervisor_fallback_is_opt_in_and_constrained(offline, monkeypatch) -> None:
+    from agent.graph import Agent
+
+    monkeypatch.setenv("SUPERVISOR_MODE", "free")
+    monkeypatch.delenv("SUPERVISOR_FALLBACK_MODEL", raising=False)
+    agent = Agent()
+    try:
+        assert len(agent.supervisor_router.backends) == 1
+    finally:
+        agent.close()
+
+    monkeypatch.setenv("SUPERVISOR_FALLBACK_MODEL", "qwen:qwen-turbo")
+    agent = Agent()
+    try:
+        primary, fallback = agent.supervisor_router.backends
+        assert primary.model is agent.supervisor_model
+        # 备用模型即使在free模式下也用json schema约束输出
+        assert fallback.model.kwargs["response_format"]["type"] == "json_schema"
+    finally:
+        agent.close()
+
+
+async def test_sync_and_async_questions_share_the_thread_lock(offline) -> None:
+    import asyncio
+
+    from agent.graph import Agent
+
+    agent = Agent()
+    try:
+        # 同步入口持有锁时，同一会话的异步提问要等待
+        lock = agent._thread_lock("shared")
+        lock.acquire()
+        task = asyncio.create_task(agent.aask("你好", thread_id="shared"))
+        await asyncio.sleep(0.2)
+        assert not task.done()
+        lock.release()
+        assert await task
+
+        # 等待中被取消的提问不会一直占着锁
+        lock.acquire()
+        task = asyncio.create_task(agent.aask("你好", thread_id="shared"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        lock.release()
+        await asyncio.sleep(0.1)
+        assert lock.acquire(timeout=1)
+        lock.release()
+    finally:
+        agent.close()
+
+
+async def test_many_waiters_on_one_thread_do_not_starve_the_executor(offline) -> None:
+    import asyncio
+    import os
+
+    from agent.graph import Agent
+
+    agent = Agent()
+    try:
+        # 等待者多于默认线程池的线程数（cpu+4），持有锁的请求仍然要能用to_thread完成checkpoint读写
+        callers = (os.cpu_count() or 1) + 8
+        answers = await asyncio.wait_for(
+            asyncio.gather(*(agent.aask("你好", thread_id="busy") for _ in range(callers))), timeout=60
+        )
+        assert len(answers) == callers and all(answers)
+    finally:
+        agent.close()
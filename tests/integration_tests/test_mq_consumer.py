@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+from unittest import mock
+
+import pika
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from stubs import FakeBroker
+
+from agent.memory_store import MemoryStore
+
+
+class FakeMemoryLLM:
+    """按问题文本返回提取结果，文本中包含fail时抛出异常，记录每次batch的问题"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches = []
+
+    def _extract(self, messages):
+        text = messages[-1].content
+        time.sleep(self.delay)
+        if "fail" in text:
+            raise ConnectionError("model down")
+        return AIMessage(content=f"<think>\n</think>\n记忆:{text}")
+
+    def batch(self, inputs, config=None, return_exceptions=False):
+        self.batches.append([messages[-1].content for messages in inputs])
+        return RunnableLambda(self._extract).batch(inputs, config=config, return_exceptions=return_exceptions)
+
+
+def _manager(tmp_path, llm):
+    from agent.memory_manager import Memory_Manager
+
+    manager = Memory_Manager()
+    manager.memory_llm = llm
+    manager.memory_store = MemoryStore(str(tmp_path / "memory.sqlite3"))
+    return manager
+
+
+def test_process_batch_dedupes_and_isolates_failures(offline, tmp_path) -> None:
+    llm = FakeMemoryLLM()
+    manager = _manager(tmp_path, llm)
+    results = manager.process_batch([
+        {"type": "extract", "text": "我在研究图神经网络"},
+        {"type": "extract", "text": "我在研究图神经网络", "user_id": "other"},
+        {"type": "extract", "text": "fail"},
+    ])
+    assert results == [True, True, False]
+    # 相同的问题只调用一次模型
+    assert llm.batches == [["我在研究图神经网络", "fail"]]
+    assert manager.memory_store.count() == 2
+
+    # 写入失败时，提取成功的消息标记为暂时失败
+    manager.memory_store.add_many = mock.Mock(side_effect=OSError("disk full"))
+    results = manager.process_batch([{"type": "extract", "text": "新问题"}, {"type": "extract", "text": "fail"}])
+    assert results == [None, False]
+
+
+@pytest.fixture()
+def consumer(offline, tmp_path):
+    """运行在后台线程中的BatchMemoryConsumer，连接到进程内的FakeBroker"""
+    from mq_consumer import BatchMemoryConsumer, declare_topology
+
+    broker = FakeBroker()
+    with mock.patch.object(pika, "BlockingConnection", broker.connection_factory()):
+        connection = broker.connection_factory()()
+        declare_topology(connection.channel())
+        connection.close()
+        consumer = BatchMemoryConsumer(host="fake", batch_size=3, max_wait=0.05, workers=2)
+        consumer.memory_manager.memory_llm = FakeMemoryLLM()
+        consumer.memory_manager.memory_store = MemoryStore(str(tmp_path / "memory.sqlite3"))
+        thread = threading.Thread(target=consumer.run, name="test-consumer", daemon=True)
+        consumer.broker, consumer.thread = broker, thread
+        yield consumer
+        consumer.stop()
+        if thread.is_alive():
+            thread.join(timeout=10)
+
+
+def _publish(broker: FakeBroker, *messages):
+    for message in messages:
+        body = message if isinstance(message, bytes) else json.dumps(message, ensure_ascii=False)
+        broker.publish("memory.direct", "memory.info", body)
+
+
+def test_batches_are_acked(consumer) -> None:
+    _publish(consumer.broker, *({"type": "extract", "text": f"问题{i}"} for i in range(3)))
+    consumer.thread.start()
+    assert consumer.broker.wait_settled(3, timeout=10)
+    assert (consumer.broker.acked, consumer.broker.nacked) == (3, 0)
+    # 攒满一批后一次处理
+    assert consumer.memory_manager.memory_llm.batches == [["问题0", "问题1", "问题2"]]
+    assert consumer.memory_manager.memory_store.count() == 3
+
+
+def test_failed_messages_are_nacked(consumer) -> None:
+    _publish(consumer.broker, {"type": "extract", "text": "问题"}, {"type": "extract", "text": "fail"}, b"not json")
+    consumer.thread.start()
+    assert consumer.broker.wait_settled(3, timeout=10)
+    # 模型调用失败和无法解析的消息被nack，不影响同一批中的其它消息
+    assert (consumer.broker.acked, consumer.broker.nacked) == (1, 2)
+    assert consumer.memory_manager.memory_store.count() == 1
+
+
+def test_store_failures_are_requeued(consumer) -> None:
+    from stubs import FakeChannel
+
+    consumer.memory_manager.memory_store.add_many = mock.Mock(side_effect=OSError("disk full"))
+    _publish(consumer.broker, {"type": "extract", "text": "问题"}, {"type": "extract", "text": "fail"}, b"not json")
+    with mock.patch.object(FakeChannel, "basic_nack", autospec=True, side_effect=FakeChannel.basic_nack) as nack:
+        consumer.thread.start()
+        assert consumer.broker.wait_settled(3, timeout=10)
+    # 记忆写入失败的消息重新入队，模型调用失败和无法解析的消息直接丢弃
+    requeue = sorted(call.kwargs["requeue"] for call in nack.call_args_list)
+    assert requeue == [False, False, True]
+
+
+def test_stop_settles_dispatched_batches(consumer) -> None:
+    consumer.memory_manager.memory_llm.delay = 0.3
+    _publish(consumer.broker, *({"type": "extract", "text": f"问题{i}"} for i in range(3)))
+    consumer.thread.start()
+    deadline = time.monotonic() + 5
+    while not consumer.memory_manager.memory_llm.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # 批次处理中请求停止，run等这一批ack后才关闭连接返回
+    consumer.stop()
+    consumer.thread.join(timeout=10)
+    assert not consumer.thread.is_alive()
+    assert (consumer.broker.acked, consumer.broker.nacked) == (3, 0)
+    assert consumer.connection.is_closed
+
+
+def test_consumer_process_uses_the_full_background_lane(monkeypatch) -> None:
+    import os
+
+    from mq_consumer import uncap_background_lane
+
+    monkeypatch.setattr(os, "environ", {k: v for k, v in os.environ.items() if not k.endswith("_CONCURRENCY")})
+    os.environ["QWEN_BACKGROUND_CONCURRENCY"] = "2"
+    uncap_background_lane()
+    # 后台请求可以用满Ollama的并发上限，显式配置的值不被覆盖
+    assert os.environ["OLLAMA_BACKGROUND_CONCURRENCY"] == "4"
+    assert os.environ["QWEN_BACKGROUND_CONCURRENCY"] == "2"
@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+import pytest
+
+from agent.batch_runner import completed_ids, run
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeAgent:
+    def __init__(self, fail: set[str] = frozenset()):
+        self.fail = fail
+        self.asked = []
+        self.running = self.peak = 0
+
+    async def astream(self, question: str):
+        self.asked.append(question)
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            if question in self.fail:
+                raise ConnectionError("model down")
+            yield {"type": "token", "node": "chat", "content": "a"}
+            yield {"type": "final", "content": f"answer to {question}"}
+        finally:
+            self.running -= 1
+
+
+def _write(path, records):
+    path.write_text("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records), encoding="utf-8")
+
+
+async def test_run_writes_results_and_resumes(tmp_path) -> None:
+    questions = tmp_path / "requests.jsonl"
+    _write(questions, [{"request_id": f"r{i}", "title": f"t{i}", "body": f"q{i}"} for i in range(6)])
+    output = tmp_path / "out" / "answers.jsonl"
+
+    agent = FakeAgent(fail={"q2"})
+    counts = await run(agent, str(questions), str(output), concurrency=3)
+    assert counts == {"ok": 5, "error": 1, "skipped": 0}
+    assert agent.peak == 3
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    ok = {r["id"]: r for r in records if r["status"] == "ok"}
+    assert ok["r0"]["answer"] == "answer to q0" and ok["r0"]["route"] == "chat"
+    assert ok["r0"]["ttft_s"] is not None and ok["r0"]["latency_s"] >= ok["r0"]["ttft_s"]
+
+    # 模拟中断时写了一半的行，续跑时只重跑失败的r2
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"id": "r5", "sta')
+    assert completed_ids(str(output)) == {"r0", "r1", "r3", "r4", "r5"}
+    agent = FakeAgent()
+    counts = await run(agent, str(questions), str(output), concurrency=3)
+    assert counts == {"ok": 1, "error": 0, "skipped": 5}
+    assert agent.asked == ["q2"]
+    # 半行被截掉，续跑写入的结果是完整的一行
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert all(json.loads(line) for line in lines)
+    assert completed_ids(str(output)) == {f"r{i}" for i in range(6)}
+
+
+async def test_question_fields_are_joined(tmp_path) -> None:
+    questions = tmp_path / "requests.jsonl"
+    _write(questions, [{"request_id": "r0", "title": "标题", "body": "正文"}])
+    agent = FakeAgent()
+    await run(agent, str(questions), str(tmp_path / "answers.jsonl"), question_fields=["title", "body"])
+    assert agent.asked == ["标题\n\n正文"]
@@ -0,0 +1,69 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import END, StateGraph
+
+import agent.state as state
+from agent.checkpointer import SQLiteCheckpointer
+
+
+def _graph(checkpointer):
+    def reply(s):
+        return {"message": [AIMessage(content=f"第{len(s['message'])}条")], "type": "chat"}
+
+    return (
+        StateGraph(state.State)
+        .add_node("reply", reply)
+        .set_entry_point("reply")
+        .add_edge("reply", END)
+        .compile(checkpointer=checkpointer)
+    )
+
+
+def test_session_survives_restart_and_old_checkpoints_are_pruned(tmp_path) -> None:
+    path = str(tmp_path / "checkpoints.sqlite3")
+    config = {"configurable": {"thread_id": "t1"}}
+
+    checkpointer = SQLiteCheckpointer(path, keep=2)
+    graph = _graph(checkpointer)
+    for i in range(3):
+        graph.invoke({"message": [HumanMessage(content=f"问题{i}")], "type": ""}, config)
+    assert len(list(checkpointer.list(config))) == 2
+    checkpointer.close()
+
+    # 重新打开文件，同一个thread_id继续对话
+    checkpointer = SQLiteCheckpointer(path, keep=2)
+    graph = _graph(checkpointer)
+    result = asyncio.run(graph.ainvoke({"message": [HumanMessage(content="问题3")], "type": ""}, config))
+    assert len(result["message"]) == 8
+    assert result["message"][-1].content == "第7条"
+
+
+def test_idle_threads_are_evicted(tmp_path) -> None:
+    checkpointer = SQLiteCheckpointer(str(tmp_path / "checkpoints.sqlite3"), cache_size=1)
+    graph = _graph(checkpointer)
+    for thread_id in ("a", "b"):
+        graph.invoke({"message": [HumanMessage(content="你好")], "type": ""}, {"configurable": {"thread_id": thread_id}})
+    # 内存中只缓存最近活跃的线程，淘汰的线程仍然可以从磁盘恢复
+    assert [key[0] for key in checkpointer._latest] == ["b"]
+    assert checkpointer.get_tuple({"configurable": {"thread_id": "a"}}) is not None
+
+    assert checkpointer.delete_idle_threads(max_idle=-1) == 2
+    assert checkpointer.get_tuple({"configurable": {"thread_id": "a"}}) is None
+
+
+def test_threads_and_messages_are_bounded(monkeypatch) -> None:
+    monkeypatch.setattr(state, "MAX_MESSAGES", 6)
+    checkpointer = SQLiteCheckpointer(":memory:", keep=2, max_threads=2)
+    graph = _graph(checkpointer)
+    config = {"configurable": {"thread_id": "t1"}}
+    for i in range(5):
+        result = graph.invoke({"message": [HumanMessage(content=f"问题{i}")], "type": ""}, config)
+        assert len(result["message"]) <= 6
+    # 超过上限后只保留最近的轮次，从用户消息开始
+    assert [m.content for m in result["message"]] == ["问题2", "第5条", "问题3", "第3条", "问题4", "第5条"]
+
+    for thread_id in ("t2", "t3"):
+        graph.invoke({"message": [HumanMessage(content="你好")], "type": ""}, {"configurable": {"thread_id": thread_id}})
+    # 最久没有活动的线程被删除
+    assert {item.config["configurable"]["thread_id"] for item in checkpointer.list(None)} == {"t2", "t3"}
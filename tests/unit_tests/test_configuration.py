@@ -1,9 +1,7 @@
 from langgraph.pregel import Pregel
 
-from agent.graph import graph
 
+def test_graph_is_compiled(offline) -> None:
+    from agent.graph import graph
 
-def test_placeholder() -> None:
-    # TODO: You can add actual unit tests
-    # for your graph and other logic here.
     assert isinstance(graph, Pregel)
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from agent.context_window import SUMMARY_PREFIX, ContextWindow, heuristic_count
+
+
+def _conversation(turns: int) -> list:
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"问题{i} " + "词" * 40, id=f"h{i}"))
+        messages.append(AIMessage(content=f"回答{i} " + "字" * 40, id=f"a{i}"))
+    return messages
+
+
+def test_heuristic_count() -> None:
+    assert heuristic_count("你好") == 2
+    assert heuristic_count("transformer") == 3
+
+
+def test_old_turns_are_replaced_by_incremental_summary() -> None:
+    calls = []
+
+    def summarize(previous, messages):
+        calls.append((previous, [m.id for m in messages]))
+        return f"摘要{len(calls)}"
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    window = ContextWindow(summarize, budget=200, executor=executor)
+    messages = _conversation(4) + [HumanMessage(content="现在的问题", id="q")]
+
+    context = window.build(messages)
+    assert context[-1].id == "q"
+    assert sum(heuristic_count(m.content) for m in context) <= 200
+    executor.shutdown(wait=True)
+    # 第一次只把挤出窗口的前缀交给摘要
+    assert calls[0][0] == ""
+    assert calls[0][1] == [m.id for m in messages[: len(messages) - len(context)]]
+
+    executor = window._executor = ThreadPoolExecutor(max_workers=1)
+    context = window.build(messages + [AIMessage(content="好的" + "字" * 80, id="r"), HumanMessage(content="下一个问题", id="q2")])
+    assert isinstance(context[0], SystemMessage) and context[0].content == SUMMARY_PREFIX + "摘要1"
+    executor.shutdown(wait=True)
+    # 第二次只合并上次摘要之后新挤出的消息
+    assert calls[1][0] == "摘要1"
+    assert calls[1][1] and set(calls[1][1]).isdisjoint(calls[0][1])
+
+
+def test_long_message_is_truncated_then_compressed() -> None:
+    executor = ThreadPoolExecutor(max_workers=1)
+    window = ContextWindow(lambda p, m: "", compress=lambda text: "压缩后的结果", budget=500, message_budget=50, executor=executor)
+    messages = [HumanMessage(content="搜索论文", id="h0"), AIMessage(content="结果" * 500, id="a0"), HumanMessage(content="继续", id="h1")]
+
+    context = window.build(messages)
+    assert heuristic_count(context[1].content) < 70
+    executor.shutdown(wait=True)
+    assert window.build(messages)[1].content == "压缩后的结果"
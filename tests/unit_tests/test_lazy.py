@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agent.lazy import lazy
+
+
+class Service:
+    def __init__(self):
+        self.created = 0
+
+    @lazy
+    def client(self):
+        """慢速创建的客户端"""
+        self.created += 1
+        time.sleep(0.05)
+        return object()
+
+
+def test_lazy_creates_once_under_concurrency() -> None:
+    service = Service()
+    assert not lazy.loaded(service, "client")
+    barrier = threading.Barrier(8)
+
+    def get(_):
+        barrier.wait()
+        return service.client
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(get, range(8)))
+    assert service.created == 1
+    assert all(client is clients[0] for client in clients)
+    assert lazy.loaded(service, "client")
+    assert lazy.timings(service)["client"] >= 0.05
+
+
+def test_lazy_attribute_can_be_replaced() -> None:
+    service = Service()
+    service.client = "stub"
+    assert service.client == "stub"
+    assert service.created == 0
+    assert Service.client.__doc__ == "慢速创建的客户端"
+
+
+def test_aget_creates_without_blocking_the_event_loop() -> None:
+    service = Service()
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.create_task(tick())
+        client = await lazy.aget(service, "client")
+        ticker.cancel()
+        # 创建期间事件循环继续运行其它协程
+        assert ticks > 2
+        assert await lazy.aget(service, "client") is client
+
+    asyncio.run(main())
+    assert service.created == 1
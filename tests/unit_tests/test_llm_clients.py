@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from stubs import FakeOpenAIServer
+
+from agent import llm_clients
+
+
+@pytest.fixture
+def fake_endpoint(monkeypatch):
+    with FakeOpenAIServer(latency=0.0, tokens_per_second=10000, tokens=4) as server:
+        monkeypatch.setenv("OLLAMA_API_BASE", server.base_url)
+        monkeypatch.setenv("OLLAMA_MAX_CONNECTIONS", "2")
+        yield server
+    llm_clients.close()
+
+
+def test_models_share_one_pool_per_endpoint(fake_endpoint) -> None:
+    first = llm_clients.chat_model("ollama", "model-a")
+    assert llm_clients.chat_model("ollama", "model-a") is first
+    second = llm_clients.chat_model("ollama", "model-b")
+    assert second is not first
+    assert second.http_client is first.http_client
+    assert second.http_async_client is first.http_async_client
+    assert llm_clients.embeddings("ollama", "embed").http_client is first.http_client
+
+
+def test_requests_reuse_keep_alive_connections(fake_endpoint) -> None:
+    llm = llm_clients.chat_model("ollama", "model-a")
+    for _ in range(5):
+        assert llm.invoke("hi").content == "token0 token1 token2 token3"
+    assert fake_endpoint.requests["completions"] == 5
+    assert fake_endpoint.connections == 1
+
+
+@pytest.mark.anyio
+async def test_async_requests_are_bounded_by_pool_limit(fake_endpoint) -> None:
+    fake_endpoint.latency = 0.05
+    llm = llm_clients.chat_model("ollama", "model-a")
+    await asyncio.gather(*(llm.ainvoke("hi") for _ in range(6)))
+    assert fake_endpoint.requests["completions"] == 6
+    assert fake_endpoint.connections <= 2
+
+
+def test_async_client_works_from_several_event_loops(fake_endpoint) -> None:
+    from agent.mcp_pool import BackgroundLoop
+
+    llm = llm_clients.chat_model("ollama", "model-a")
+    background = BackgroundLoop("test-loop")
+    try:
+        assert background.run(llm.ainvoke("hi"), timeout=10).content
+    finally:
+        background.stop()
+    # 每次asyncio.run都是新的事件循环，不能复用上一个循环中的连接
+    assert asyncio.run(llm.ainvoke("hi")).content
+    assert asyncio.run(llm.ainvoke("hi")).content
+    assert fake_endpoint.requests["completions"] == 3
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from agent.llm_scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    QUEUE_DEPTH,
+    AsyncSchedulingTransport,
+    Scheduler,
+    SchedulingTransport,
+    priority,
+)
+
+
+def _wait_queued(scheduler: Scheduler, n: int):
+    deadline = time.monotonic() + 2
+    while scheduler.queued() < n and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_interactive_requests_jump_the_background_queue() -> None:
+    scheduler = Scheduler("test-priority", concurrency=1)
+    order = []
+    level = scheduler.acquire()
+
+    def request(name, level):
+        scheduler.release(scheduler.acquire(level))
+        order.append(name)
+
+    threads = []
+    for i, (name, request_level) in enumerate(
+        [("bg1", BACKGROUND), ("bg2", BACKGROUND), ("chat", INTERACTIVE)]
+    ):
+        thread = threading.Thread(target=request, args=(name, request_level))
+        thread.start()
+        threads.append(thread)
+        _wait_queued(scheduler, i + 1)
+    assert QUEUE_DEPTH.value(backend="test-priority", priority="background") == 2
+
+    scheduler.release(level)
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == ["chat", "bg1", "bg2"]
+    assert QUEUE_DEPTH.value(backend="test-priority", priority="background") == 0
+
+
+def test_background_concurrency_leaves_room_for_interactive() -> None:
+    scheduler = Scheduler("test-background", concurrency=2, background_concurrency=1)
+    first = scheduler.acquire(BACKGROUND)
+    with pytest.raises(httpx.PoolTimeout):
+        scheduler.acquire(BACKGROUND, timeout=0.05)
+    # 排队超时的请求不会占用名额
+    assert scheduler.queued() == 0
+    second = scheduler.acquire(INTERACTIVE, timeout=0.05)
+    assert scheduler.active == 2
+    scheduler.release(first)
+    scheduler.release(second)
+    assert scheduler.active == 0
+
+
+def test_token_bucket_limits_request_rate() -> None:
+    scheduler = Scheduler("test-rate", concurrency=10, rpm=600, burst=2)
+    start = time.monotonic()
+    for _ in range(4):
+        scheduler.release(scheduler.acquire())
+    # 突发2个，之后每0.1秒一个
+    assert 0.15 <= time.monotonic() - start < 1.0
+
+
+@pytest.mark.anyio
+async def test_async_transport_caps_concurrency_until_stream_closed() -> None:
+    running = peak = 0
+
+    async def handler(request):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+        async def body():
+            yield b"ok"
+
+        # 生成器响应体不会被预先读取，和真实传输一样要等响应关闭才释放名额
+        return httpx.Response(200, content=body())
+
+    scheduler = Scheduler("test-async", concurrency=2)
+    transport = AsyncSchedulingTransport(httpx.MockTransport(handler), scheduler)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        with priority(BACKGROUND):
+            responses = await asyncio.gather(*(client.get("/") for _ in range(6)))
+    assert all(response.content == b"ok" for response in responses)
+    assert peak == 2
+    assert scheduler.active == 0 and scheduler.active_background == 0
+
+
+def test_sync_stream_holds_slot_until_closed() -> None:
+    scheduler = Scheduler("test-stream", concurrency=1)
+    transport = SchedulingTransport(
+        httpx.MockTransport(lambda request: httpx.Response(200, content=iter([b"x"]))), scheduler
+    )
+    with httpx.Client(transport=transport, base_url="http://test") as client:
+        with client.stream("GET", "/") as response:
+            assert scheduler.active == 1
+            response.read()
+        assert scheduler.active == 0
@@ -0,0 +1,69 @@
+import sys
+import textwrap
+
+import pytest
+
+from agent.mcp_pool import MCPSessionPool
+
+pytestmark = pytest.mark.anyio
+
+FAKE_SERVER = textwrap.dedent('''
+    import os
+    from mcp.server.fastmcp import FastMCP
+
+    mcp = FastMCP("fake-zotero")
+
+    @mcp.tool()
+    def zotero_search_items(query: str) -> str:
+        """search items"""
+        return f"{query}:{os.getpid()}"
+
+    @mcp.tool()
+    def crash() -> str:
+        """kill the server"""
+        os._exit(1)
+
+    @mcp.tool()
+    def zotero_add_note(note: str) -> str:
+        """record the call, then kill the server"""
+        with open(os.path.join(os.path.dirname(__file__), "notes.txt"), "a") as f:
+            f.write(note + "\\n")
+        os._exit(1)
+
+    mcp.run("stdio")
+''')
+
+
+@pytest.fixture
+def pool(tmp_path):
+    server = tmp_path / "fake_server.py"
+    server.write_text(FAKE_SERVER, encoding="utf-8")
+    pool = MCPSessionPool({"transport": "stdio", "command": sys.executable, "args": [str(server)]}, max_size=2)
+    yield pool
+    pool.close()
+
+
+async def test_sessions_are_reused(pool) -> None:
+    tools = {tool.name: tool for tool in pool.get_tools()}
+    first = await tools["zotero_search_items"].ainvoke({"query": "a"})
+    second = await tools["zotero_search_items"].ainvoke({"query": "b"})
+    # 串行调用复用同一个子进程
+    assert first.split(":")[1] == second.split(":")[1]
+
+
+async def test_crashed_session_is_replaced(pool) -> None:
+    tools = {tool.name: tool for tool in pool.get_tools()}
+    before = await tools["zotero_search_items"].ainvoke({"query": "a"})
+    await tools["crash"].ainvoke({})
+    after = await tools["zotero_search_items"].ainvoke({"query": "b"})
+    assert after.startswith("b:")
+    assert after.split(":")[1] != before.split(":")[1]
+    assert pool._size <= pool.max_size
+
+
+async def test_mutating_tool_is_not_retried_after_crash(pool, tmp_path) -> None:
+    tools = {tool.name: tool for tool in pool.get_tools()}
+    result = await tools["zotero_add_note"].ainvoke({"note": "n1"})
+    assert "调用失败" in result
+    # 崩溃的会话执行过一次，不会在新会话中再执行
+    assert (tmp_path / "notes.txt").read_text().splitlines() == ["n1"]
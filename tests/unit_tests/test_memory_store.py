@@ -0,0 +1,39 @@
+import json
+
+from agent.memory_store import MemoryStore
+
+
+def test_fulltext_search_ranks_relevant_memories(tmp_path) -> None:
+    store = MemoryStore(str(tmp_path / "memory.sqlite3"))
+    store.add_many([
+        {"memory": "用户正在研究图神经网络"},
+        {"memory": "用户喜欢Transformer模型"},
+        {"memory": "用户的导师姓王", "user_id": "other"},
+    ])
+    results = store.search("最近有什么图神经网络的新论文", k=2)
+    assert results[0]["memory"] == "用户正在研究图神经网络"
+    # 按用户隔离
+    assert store.search("导师", k=5) == []
+    assert store.count() == 3
+
+
+def test_vector_search_and_legacy_import(tmp_path) -> None:
+    vocab = ["graph", "transformer", "food"]
+
+    def embed(texts):
+        return [[float(word in text.lower()) for word in vocab] for text in texts]
+
+    legacy = tmp_path / "long_memory.jsonl"
+    legacy.write_text(
+        json.dumps({"time": "2025-01-01 10:00:00", "memory": "likes graph models"}) + "\n" + '{"memory": "broken"\n',
+        encoding="utf-8",
+    )
+    path = str(tmp_path / "memory.sqlite3")
+    store = MemoryStore(path, embed=embed)
+    assert store.import_jsonl(str(legacy)) == 1
+    store.add("studies transformer architectures")
+    store.close()
+
+    # 重启后向量矩阵从数据库恢复
+    reopened = MemoryStore(path, embed=embed)
+    assert reopened.search("Transformer", k=1)[0]["memory"] == "studies transformer architectures"
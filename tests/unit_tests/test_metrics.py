@@ -0,0 +1,64 @@
+import urllib.request
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.graph import END, StateGraph
+from typing_extensions import TypedDict
+
+from agent.metrics import MetricsCallback, Registry, serve
+
+
+class State(TypedDict):
+    answer: str
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "延迟", ("node",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, node="chat")
+    registry.counter("tokens_total", "token数", ("kind",)).inc(3, kind="prompt")
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{node="chat",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{node="chat",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{node="chat",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{node="chat"} 3' in text
+    assert 'tokens_total{kind="prompt"} 3.0' in text
+    assert "# TYPE latency_seconds histogram" in text
+
+
+def test_callback_records_nodes_llm_calls_and_tokens() -> None:
+    registry = Registry()
+    metrics = MetricsCallback(registry)
+    message = AIMessage(
+        content="hello world",
+        usage_metadata={"input_tokens": 7, "output_tokens": 2, "total_tokens": 9},
+    )
+    llm = GenericFakeChatModel(messages=iter([message, message]))
+
+    def answer(state: State):
+        # 流式调用记录首token延迟，普通调用带有token用量
+        streamed = "".join(chunk.content for chunk in llm.stream("hi"))
+        assert llm.invoke("hi").content == streamed
+        return {"answer": streamed}
+
+    graph = (
+        StateGraph(State).add_node("answer", answer).set_entry_point("answer").add_edge("answer", END)
+    ).compile().with_config(callbacks=[metrics])
+    assert graph.invoke({"answer": ""})["answer"] == "hello world"
+
+    assert metrics.node_duration.count(node="answer", status="ok") == 1
+    assert metrics.llm_duration.count(model="GenericFakeChatModel", status="ok") == 2
+    assert metrics.llm_ttft.count(model="GenericFakeChatModel") == 1
+    assert metrics.llm_tokens.value(model="GenericFakeChatModel", kind="prompt") == 7
+    assert metrics.llm_tokens.value(model="GenericFakeChatModel", kind="completion") == 2
+
+
+def test_serve_exposes_metrics_endpoint() -> None:
+    registry = Registry()
+    registry.counter("requests_total", "请求数").inc()
+    server = serve(0, host="127.0.0.1", registry=registry)
+    port = server.server_address[1]
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        assert "requests_total 1.0" in response.read().decode("utf-8")
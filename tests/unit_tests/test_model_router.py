@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from agent.model_router import HEDGES, Backend, Health, ModelRouter
+
+
+def _model(name: str, delay: float = 0.0, fail: bool = False):
+    def call(_):
+        time.sleep(delay)
+        if fail:
+            raise ConnectionError(f"{name} down")
+        return name
+
+    async def acall(_):
+        await asyncio.sleep(delay)
+        if fail:
+            raise ConnectionError(f"{name} down")
+        return name
+
+    return RunnableLambda(call, afunc=acall)
+
+
+def _router(name, primary, backup, **kwargs) -> ModelRouter:
+    # 每个测试使用自己的端点名，熔断状态互不影响
+    return ModelRouter(
+        name,
+        [Backend("primary", f"{name}-primary", primary), Backend("backup", f"{name}-backup", backup)],
+        **kwargs,
+    )
+
+
+def test_slow_primary_is_hedged_to_backup() -> None:
+    router = _router("hedge", _model("primary", delay=0.5), _model("backup"), hedge_delay=0.05)
+    hedges = HEDGES.value(router="hedge", backend="backup")
+    start = time.monotonic()
+    assert router.invoke("q") == "backup"
+    assert time.monotonic() - start < 0.4
+    assert HEDGES.value(router="hedge", backend="backup") == hedges + 1
+
+
+def test_failed_primary_falls_back_and_opens_circuit() -> None:
+    router = _router("fallback", _model("primary", fail=True), _model("backup"), hedge=False)
+    health = router.backends[0].health
+    health.failure_threshold = 2
+    assert router.invoke("q") == "backup"
+    assert router.invoke("q") == "backup"
+    assert health.state == "open"
+    # 熔断期间直接使用备用后端
+    assert router.stream("q").__next__() == "backup"
+    health.reset_timeout = 0
+    router.backends[0].model = _model("primary")
+    # 熔断到期后放行探测请求，成功后恢复
+    assert router.invoke("q") == "primary"
+    assert health.state == "closed"
+
+
+def test_base_exception_in_backend_reaches_sync_caller() -> None:
+    import threading
+
+    class Abort(BaseException):
+        pass
+
+    def abort(_):
+        raise Abort()
+
+    router = _router("abort", RunnableLambda(abort), _model("backup"), hedge=False)
+    outcome = []
+    caller = threading.Thread(target=lambda: outcome.append(pytest.raises(Abort, router.invoke, "q")), daemon=True)
+    caller.start()
+    caller.join(timeout=5)
+    # 没有截止时间时调用方也不会一直阻塞，异常不会被当作后端故障切换到备用后端
+    assert not caller.is_alive()
+    assert len(outcome) == 1
+    assert router.backends[0].health.state == "closed"
+
+
+def test_hedge_delay_tracks_p95() -> None:
+    router = _router("p95", _model("primary"), _model("backup"), hedge_delay=5.0, min_hedge_delay=0.01)
+    backend = router.backends[0]
+    assert router.delay(backend, "invoke") == 5.0
+    for i in range(100):
+        router._window(backend, "invoke").observe(0.01 * (i + 1))
+    assert router.delay(backend, "invoke") == pytest.approx(0.96)
+
+
+@pytest.mark.anyio
+async def test_async_deadline_cancels_all_backends() -> None:
+    router = _router("deadline", _model("primary", delay=1.0), _model("backup", delay=1.0), hedge_delay=0.01, deadline=0.1)
+    with pytest.raises(TimeoutError):
+        await router.ainvoke("q")
+    assert [chunk async for chunk in _router("astream", _model("p"), _model("b")).astream("q")] == ["p"]
+
+
+def test_health_probe_released_when_cancelled() -> None:
+    health = Health("probe", failure_threshold=1, reset_timeout=0)
+    health.failure()
+    assert health.allow() and not health.allow()
+    health.release()
+    assert health.allow()
@@ -0,0 +1,100 @@
+import json
+import time
+
+from agent.celery.publisher import AsyncMemoryPublisher
+
+
+def test_publish_never_blocks_and_spills_when_broker_is_down(tmp_path) -> None:
+    spill_path = tmp_path / "spill.jsonl"
+    # 127.0.0.1:5672 上没有broker，连接会失败
+    publisher = AsyncMemoryPublisher(mode="direct", host="127.0.0.1", spill_path=str(spill_path), flush_interval=0.01)
+    start = time.perf_counter()
+    assert publisher.publish({"type": "extract", "text": "hello"})
+    assert time.perf_counter() - start < 0.05
+
+    deadline = time.time() + 10
+    while not spill_path.exists() and time.time() < deadline:
+        time.sleep(0.05)
+    publisher.close()
+    lines = [json.loads(line) for line in spill_path.read_text(encoding="utf-8").splitlines()]
+    assert {"type": "extract", "text": "hello"} in lines
+    assert publisher.stats()["published"] == 0
+
+
+def test_drop_policy_when_buffer_is_full(tmp_path) -> None:
+    publisher = AsyncMemoryPublisher(mode="direct", host="127.0.0.1", max_buffer=1, overflow="drop", flush_interval=0.01)
+    publisher._stop.set()  # 让后台线程不再取消息
+    publisher._thread.join()
+    publisher._queue.put_nowait({"text": "first"})
+    assert not publisher.publish({"text": "second"})
+    assert publisher.stats()["dropped"] == 1
+
+
+def _stopped_publisher(tmp_path, **kwargs) -> AsyncMemoryPublisher:
+    publisher = AsyncMemoryPublisher(
+        mode="direct", host="127.0.0.1", spill_path=str(tmp_path / "spill.jsonl"), flush_interval=0.01, **kwargs
+    )
+    publisher._stop.set()  # 让后台线程退出，测试中手动调用
+    publisher._thread.join()
+    return publisher
+
+
+def test_full_buffer_spills_on_the_background_thread(tmp_path) -> None:
+    publisher = _stopped_publisher(tmp_path, max_buffer=1)
+    publisher._queue.put_nowait({"text": "first"})
+    assert not publisher.publish({"text": "second"})
+    # publish不写磁盘，由后台线程写入
+    assert not (tmp_path / "spill.jsonl").exists()
+    publisher._spill_overflowed()
+    assert json.loads((tmp_path / "spill.jsonl").read_text(encoding="utf-8")) == {"text": "second"}
+    assert publisher.stats()["spilled"] == 1
+
+
+def test_replay_skips_corrupt_lines_and_keeps_previous_replay(tmp_path) -> None:
+    publisher = _stopped_publisher(tmp_path)
+    sent = []
+    publisher._send = sent.extend
+    # 上次重放中断留下的.replay，以及新的磁盘消息，其中一行损坏
+    (tmp_path / "spill.jsonl.replay").write_text('{"text": "old"}\n', encoding="utf-8")
+    (tmp_path / "spill.jsonl").write_text('{"text": "a"}\n{"text": \n{"text": "b"}\n', encoding="utf-8")
+    publisher._replay_spill()
+    assert sent == [{"text": "old"}, {"text": "a"}, {"text": "b"}]
+    assert not (tmp_path / "spill.jsonl").exists()
+    assert not (tmp_path / "spill.jsonl.replay").exists()
+
+
+def test_direct_mode_declares_the_consumer_queue(tmp_path) -> None:
+    from unittest import mock
+
+    import pika
+    from stubs import FakeBroker
+
+    broker = FakeBroker()
+    with mock.patch.object(pika, "BlockingConnection", broker.connection_factory()):
+        publisher = AsyncMemoryPublisher(mode="direct", spill_path=str(tmp_path / "spill.jsonl"), flush_interval=0.01)
+        assert publisher.publish({"text": "before any consumer"})
+        publisher.close()
+    # 消费者还没有启动，消息也已经进入memory.queue
+    assert [json.loads(body) for body in broker.queues["memory.queue"]] == [{"text": "before any consumer"}]
+
+
+def test_failed_replay_backs_off(tmp_path) -> None:
+    from agent.celery.publisher import _PublishError
+
+    publisher = _stopped_publisher(tmp_path)
+    attempts = []
+
+    def send(batch):
+        attempts.append(batch)
+        raise _PublishError(batch)
+
+    publisher._send = send
+    (tmp_path / "spill.jsonl").write_text('{"text": "a"}\n', encoding="utf-8")
+    try:
+        publisher._replay_spill()
+    except _PublishError as e:
+        publisher._overflow(e.pending, "重放失败")
+    # 退避期间不再重放
+    publisher._replay_spill()
+    assert len(attempts) == 1
+    assert (tmp_path / "spill.jsonl").exists()
@@ -0,0 +1,66 @@
+import json
+import time
+from unittest import mock
+
+import pika
+import pytest
+from stubs import FakeBroker
+
+from agent.celery.queue_client import MemoryQueueClient, PooledChannel, RabbitMQConnectionPool
+
+
+@pytest.fixture()
+def broker():
+    broker = FakeBroker()
+    with mock.patch.object(pika, "BlockingConnection", broker.connection_factory()):
+        yield broker
+    RabbitMQConnectionPool.reset_instance()
+
+
+def test_send_through_pool(broker) -> None:
+    MemoryQueueClient().send({"type": "extract", "text": "hello"})
+    MemoryQueueClient().send({"type": "extract", "text": "again"})
+    assert [json.loads(body) for body in broker.queues["memory.queue"]] == [
+        {"type": "extract", "text": "hello"},
+        {"type": "extract", "text": "again"},
+    ]
+    # 两个客户端共享同一个池和同一个连接
+    assert RabbitMQConnectionPool().stats()["size"] == 1
+
+
+def test_instances_follow_constructor_args(broker) -> None:
+    assert RabbitMQConnectionPool(host="a") is RabbitMQConnectionPool(host="a")
+    pool = RabbitMQConnectionPool(host="b", max_size=2)
+    assert pool is not RabbitMQConnectionPool(host="a")
+    assert (pool.host, pool.max_size) == ("b", 2)
+
+
+def test_health_check_runs_outside_the_lock(broker) -> None:
+    pool = RabbitMQConnectionPool(max_size=1)
+    pool.release(pool.acquire())
+    checked = []
+    healthy = PooledChannel.healthy
+
+    def check(pooled):
+        # 其它线程在健康检查期间仍然可以拿到池的锁
+        assert pool._available.acquire(blocking=False)
+        pool._available.release()
+        checked.append(pooled)
+        return healthy(pooled)
+
+    with mock.patch.object(PooledChannel, "healthy", check):
+        pooled = pool.acquire()
+    assert checked == [pooled]
+    pool.release(pooled)
+
+
+def test_stale_idle_connection_is_replaced(broker) -> None:
+    pool = RabbitMQConnectionPool(max_idle=0.01)
+    first = pool.acquire()
+    pool.release(first)
+    time.sleep(0.05)
+    second = pool.acquire()
+    assert second is not first
+    assert first.connection.is_closed
+    assert pool.stats()["size"] == 1
+    pool.release(second)
@@ -0,0 +1,49 @@
+import json
+
+from agent.router import PreClassifier
+
+
+def test_rules_short_circuit() -> None:
+    classifier = PreClassifier()
+    assert classifier.classify("我想找一篇介绍Transformer的论文")[0] == "search"
+    assert classifier.classify("你好！")[0] == "chat"
+    # 关于用户自己文献库的问题不由规则决定，rag还是search交给分类器和大模型
+    assert classifier.classify("我的zotero里有没有关于图神经网络的论文")[0] is None
+    assert classifier.classify("帮我在库里找一下Transformer的论文")[0] is None
+    assert classifier.classify("find papers in my library about graph networks")[0] is None
+    assert classifier.classify("Find recent papers about graph networks")[0] == "search"
+    # 无规则命中且分类器未训练时交给大模型
+    assert classifier.classify("解释一下注意力机制")[0] is None
+
+
+def test_ngram_classifier_learns_from_log(tmp_path) -> None:
+    log_path = tmp_path / "decisions.jsonl"
+    samples = [("帮我总结知识库里关于图神经网络的内容", "rag"), ("今天天气怎么样", "other")] * 30
+    log_path.write_text("".join(json.dumps({"text": t, "label": l}, ensure_ascii=False) + "\n" for t, l in samples), encoding="utf-8")
+
+    classifier = PreClassifier.from_log(str(log_path), rules={}, min_samples=10)
+    label, confidence, source = classifier.classify("总结知识库里图神经网络的内容")
+    assert (label, source) == ("rag", "ngram")
+    assert confidence >= classifier.threshold
+
+
+def test_record_appends_decisions(tmp_path) -> None:
+    log_path = tmp_path / "sub" / "decisions.jsonl"
+    classifier = PreClassifier(log_path=str(log_path))
+    classifier.record("hello", "chat")
+    classifier.record("ignored", "not-a-label")
+    # 后台线程写入，close时写完
+    classifier.close()
+    assert log_path.read_text(encoding="utf-8").count("\n") == 1
+
+
+def test_decision_log_is_rotated(tmp_path) -> None:
+    log_path = tmp_path / "decisions.jsonl"
+    classifier = PreClassifier(log_path=str(log_path), max_log_bytes=100)
+    for i in range(10):
+        classifier.record(f"问题{i}" * 5, "chat")
+        classifier.close()
+    assert log_path.stat().st_size < 200
+    assert (tmp_path / "decisions.jsonl.1").exists()
+    # 训练时同时读取轮转出去的备份
+    assert PreClassifier.from_log(str(log_path)).classifier.size > log_path.read_text(encoding="utf-8").count("\n")
@@ -0,0 +1,37 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agent.search_cache import SearchResultCache
+
+
+def test_exact_hit_survives_restart(tmp_path) -> None:
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SearchResultCache(path=path)
+    cache.put([HumanMessage(content="找一篇 Transformer 的论文？")], "answer")
+    cache.close()
+
+    restored = SearchResultCache(path=path)
+    # 归一化后标点和大小写不影响命中
+    assert restored.get([HumanMessage(content="找一篇transformer的论文")]) == "answer"
+    # 上下文窗口不同则不命中
+    assert restored.get([AIMessage(content="之前的回答"), HumanMessage(content="找一篇transformer的论文")]) is None
+    assert restored.stats()["hits"] == 1
+
+
+def test_lru_and_ttl_eviction() -> None:
+    cache = SearchResultCache(max_entries=2)
+    for question in ("a", "b", "c"):
+        cache.put([HumanMessage(content=question)], question)
+    assert cache.get([HumanMessage(content="a")]) is None
+    assert cache.get([HumanMessage(content="c")]) == "c"
+
+    expired = SearchResultCache(ttl=-1)
+    expired.put([HumanMessage(content="a")], "a")
+    assert expired.get([HumanMessage(content="a")]) is None
+
+
+def test_similar_question_hit() -> None:
+    vectors = {"graph neural networks survey": [1.0, 0.0], "survey of gnns": [0.99, 0.05], "cooking": [0.0, 1.0]}
+    cache = SearchResultCache(embed=lambda text: vectors[text])
+    cache.put([HumanMessage(content="graph neural networks survey")], "gnn")
+    assert cache.get([HumanMessage(content="survey of GNNs")]) == "gnn"
+    assert cache.get([HumanMessage(content="cooking")]) is None
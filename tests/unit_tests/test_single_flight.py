@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from agent.single_flight import SingleFlight, request_key
+
+
+def test_request_key_ignores_message_ids() -> None:
+    assert request_key("m", [HumanMessage(content="hi", id="1")]) == request_key("m", [HumanMessage(content="hi", id="2")])
+    assert request_key("m", [HumanMessage(content="hi")]) != request_key("m", [HumanMessage(content="hello")])
+    assert request_key("m", "hi", temperature=0) != request_key("m", "hi", temperature=1)
+
+
+def test_concurrent_identical_calls_share_one_upstream_call() -> None:
+    flights = SingleFlight("test")
+    calls = 0
+    barrier = threading.Barrier(4)
+
+    def upstream():
+        nonlocal calls
+        calls += 1
+        time.sleep(0.1)
+        return "answer"
+
+    def call(_):
+        barrier.wait()
+        return flights.do("q", upstream)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(call, range(4)))
+    assert results == ["answer"] * 4
+    assert calls == 1
+    assert len(flights) == 0
+    # 请求结束后不保留结果
+    assert flights.do("q", upstream) == "answer" and calls == 2
+
+
+def test_late_stream_follower_replays_from_the_start() -> None:
+    flights = SingleFlight("test")
+    first_chunk = threading.Event()
+    release = threading.Event()
+    calls = 0
+
+    def upstream():
+        nonlocal calls
+        calls += 1
+        yield "a"
+        first_chunk.set()
+        release.wait()
+        yield "b"
+
+    leader = flights.stream("q", upstream)
+    assert next(leader) == "a"
+    first_chunk.wait()
+    follower = flights.stream("q", upstream)
+    assert next(follower) == "a"
+    release.set()
+    assert list(leader) == ["b"] and list(follower) == ["b"]
+    assert calls == 1
+
+
+@pytest.mark.anyio
+async def test_async_errors_are_shared_and_cancel_is_isolated() -> None:
+    flights = SingleFlight("test")
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream down")
+
+    results = await asyncio.gather(*(flights.ado("e", failing) for _ in range(3)), return_exceptions=True)
+    assert calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    first = asyncio.create_task(flights.ado("s", slow))
+    second = asyncio.create_task(flights.ado("s", slow))
+    await asyncio.sleep(0)
+    # 第一个调用方退出不影响共享同一请求的其他调用方
+    first.cancel()
+    assert await second == "ok"
+    assert first.cancelled()
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from agent.speculation import SPECULATIONS, Speculations
+from agent.streaming import EventSink
+
+pytestmark = pytest.mark.anyio
+
+
+class ListSink(EventSink):
+    def __init__(self):
+        self.events = []
+
+    async def emit(self, event: dict):
+        self.events.append(event)
+
+    def emit_sync(self, event: dict):
+        self.events.append(event)
+
+
+async def _search(sink, started: asyncio.Event, release: asyncio.Event) -> str:
+    await sink.emit({"type": "token", "content": "a"})
+    started.set()
+    await release.wait()
+    await sink.emit({"type": "token", "content": "b"})
+    return "ab"
+
+
+async def test_hit_replays_buffered_events_in_order() -> None:
+    speculations = Speculations()
+    started, release = asyncio.Event(), asyncio.Event()
+    hits = SPECULATIONS.value(outcome="hit")
+    speculations.start("m1", lambda sink: _search(sink, started, release))
+    await started.wait()
+
+    target = ListSink()
+    speculation = speculations.take("m1")
+    release.set()
+    assert await speculation.result(target) == "ab"
+    assert [event["content"] for event in target.events] == ["a", "b"]
+    assert SPECULATIONS.value(outcome="hit") == hits + 1
+    assert len(speculations) == 0
+
+
+async def test_miss_cancels_running_work() -> None:
+    speculations = Speculations()
+    started, release = asyncio.Event(), asyncio.Event()
+    misses = SPECULATIONS.value(outcome="miss")
+    speculation = speculations.start("m2", lambda sink: _search(sink, started, release))
+    await started.wait()
+
+    speculations.cancel("m2")
+    with pytest.raises(asyncio.CancelledError):
+        await speculation.task
+    assert SPECULATIONS.value(outcome="miss") == misses + 1
+    assert speculations.take("m2") is None
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+from agent.streaming import QueueSink, current_sink, reset_sink, set_sink
+
+
+def test_queue_sink_applies_backpressure_and_crosses_threads() -> None:
+    async def main():
+        sink = QueueSink(maxsize=1)
+        produced = []
+
+        def producer():
+            for i in range(3):
+                sink.emit_sync({"type": "token", "content": str(i)})
+                produced.append(i)
+            asyncio.run_coroutine_threadsafe(sink.close(), sink.loop)
+
+        thread = threading.Thread(target=producer)
+        thread.start()
+        await asyncio.sleep(0.05)
+        # 队列容量为1，消费者还没读时生产者最多放进去一条
+        assert len(produced) <= 1
+        events = [event["content"] async for event in sink]
+        thread.join()
+        return events
+
+    assert asyncio.run(main()) == ["0", "1", "2"]
+
+
+def test_sink_is_scoped_to_context() -> None:
+    async def main():
+        sink = QueueSink()
+        token = set_sink(sink)
+        try:
+            inner = await asyncio.create_task(asyncio.sleep(0, result=current_sink()))
+        finally:
+            reset_sink(token)
+        return sink, inner
+
+    sink, inner = asyncio.run(main())
+    assert inner is sink
+    assert current_sink() is None
@@ -0,0 +1,27 @@
+import pytest
+
+from agent.supervisor import bind_supervisor, parse_label
+
+LABELS = ["search", "rag", "chat", "other"]
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("<think>\n也许是chat\n</think>\n\nsearch", "search"),
+        ('{"label": "rag"}', "rag"),
+        ("Chat.", "chat"),
+        ("分析如下\nother", "other"),
+        ("<think>\n\n</think>\n\n", None),
+        ("unknown", None),
+    ],
+)
+def test_parse_label(text, expected) -> None:
+    assert parse_label(text, LABELS) == expected
+
+
+def test_free_mode_keeps_model_unbound() -> None:
+    llm = object()
+    assert bind_supervisor(llm, "free", LABELS) is llm
+    with pytest.raises(ValueError):
+        bind_supervisor(llm, "fast", LABELS)
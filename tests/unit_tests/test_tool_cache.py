@@ -0,0 +1,47 @@
+import pytest
+from langchain_core.tools import StructuredTool, ToolException
+
+from agent.tool_cache import ToolCallCache
+
+pytestmark = pytest.mark.anyio
+
+
+def _tool(name, calls, fail=False):
+    async def _arun(query: str) -> str:
+        calls.append(query)
+        if fail:
+            raise ToolException("zotero offline")
+        return f"{name}:{query}"
+
+    return StructuredTool.from_function(coroutine=_arun, name=name, description=name)
+
+
+async def test_repeated_calls_are_memoized() -> None:
+    calls = []
+    cache = ToolCallCache()
+    [tool] = cache.wrap([_tool("zotero_search_items", calls)])
+    assert await tool.ainvoke({"query": "GNN"}) == "zotero_search_items:GNN"
+    # 参数规范化后命中同一个缓存键
+    assert await tool.ainvoke({"query": " GNN "}) == "zotero_search_items:GNN"
+    assert calls == ["GNN"]
+    assert cache.stats()["hits"] == {"zotero_search_items": 1}
+
+
+async def test_mutating_tools_and_errors_are_not_cached() -> None:
+    calls = []
+    cache = ToolCallCache()
+    create, failing = cache.wrap([_tool("zotero_create_note", calls), _tool("zotero_search_items", calls, fail=True)])
+    await create.ainvoke({"query": "a"})
+    await create.ainvoke({"query": "a"})
+    assert "zotero offline" in await failing.ainvoke({"query": "b"})
+    assert "zotero offline" in await failing.ainvoke({"query": "b"})
+    assert calls == ["a", "a", "b", "b"]
+
+
+def test_mutating_verbs_match_whole_name_tokens() -> None:
+    cache = ToolCallCache()
+    for name in ("zotero_create_note", "zotero_add_note", "set-tags", "items.delete", "sync"):
+        assert not cache.cacheable(name)
+    # 动词只是名称中的一部分字母时仍然可以缓存
+    for name in ("get_dataset", "get_settings", "search_by_address", "zotero_get_collections"):
+        assert cache.cacheable(name)
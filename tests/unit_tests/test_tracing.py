@@ -0,0 +1,99 @@
+import json
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from agent.tracing import BackgroundExporter, JsonlSink, TracingCallback
+
+
+class ListSink:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.traces = []
+
+    def write(self, traces):
+        time.sleep(self.delay)
+        self.traces.extend(traces)
+
+
+def _pipeline(sleep: float = 0.0, fail: bool = False):
+    def step(text: str) -> str:
+        time.sleep(sleep)
+        if fail:
+            raise ValueError("boom")
+        return text.upper()
+
+    return RunnableLambda(step, name="step") | RunnableLambda(lambda text: text + "!", name="finish")
+
+
+def test_head_sampled_runs_keep_payloads() -> None:
+    sink = ListSink()
+    exporter = BackgroundExporter(sink, flush_interval=0.05)
+    tracer = TracingCallback(exporter, sample_rate=1.0)
+    assert _pipeline().invoke("hi", {"callbacks": [tracer]}) == "HI!"
+    exporter.close()
+
+    (trace,) = sink.traces
+    names = [span.name for span in trace.spans]
+    assert names[1:] == ["step", "finish"]
+    assert all(span.parent_id == trace.root_id for span in trace.spans[1:])
+    assert trace.spans[1].inputs == {"value": "hi"}
+    assert trace.root.outputs == {"value": "HI!"}
+
+
+def test_tail_sampling_keeps_only_slow_or_failed_runs() -> None:
+    sink = ListSink()
+    exporter = BackgroundExporter(sink, flush_interval=0.05)
+    tracer = TracingCallback(exporter, sample_rate=0.0, slow_threshold=0.05)
+    _pipeline().invoke("fast", {"callbacks": [tracer]})
+    _pipeline(sleep=0.1).invoke("slow", {"callbacks": [tracer]})
+    with pytest.raises(ValueError):
+        _pipeline(fail=True).invoke("bad", {"callbacks": [tracer]})
+    exporter.close()
+
+    assert len(sink.traces) == 2
+    slow, failed = sink.traces
+    assert slow.duration >= 0.1 and not slow.failed
+    assert failed.failed
+    # 未抽中的调用不记录输入输出
+    assert all(span.inputs is None and span.outputs is None for span in slow.spans)
+    assert not tracer._runs and not tracer._spans
+
+
+def test_runs_beyond_max_spans_are_not_leaked() -> None:
+    sink = ListSink()
+    exporter = BackgroundExporter(sink, flush_interval=0.05)
+    tracer = TracingCallback(exporter, sample_rate=1.0, max_spans=2)
+    pipeline = RunnableLambda(lambda text: text, name="step") | _pipeline()
+    assert pipeline.invoke("hi", {"callbacks": [tracer]}) == "HI!"
+    exporter.close()
+
+    (trace,) = sink.traces
+    assert len(trace.spans) == 2 and trace.dropped_spans > 0
+    assert not tracer._runs and not tracer._spans
+
+
+def test_full_queue_drops_instead_of_blocking() -> None:
+    exporter = BackgroundExporter(ListSink(delay=0.5), maxsize=1, batch_size=1, flush_interval=0.01)
+    tracer = TracingCallback(exporter, sample_rate=1.0)
+    start = time.perf_counter()
+    for i in range(20):
+        _pipeline().invoke(str(i), {"callbacks": [tracer]})
+    assert time.perf_counter() - start < 0.5
+    assert exporter.dropped > 0
+
+
+def test_jsonl_sink_writes_otlp_spans(tmp_path) -> None:
+    path = tmp_path / "traces.jsonl"
+    exporter = BackgroundExporter(JsonlSink(str(path)), flush_interval=0.05)
+    tracer = TracingCallback(exporter, sample_rate=1.0)
+    _pipeline().invoke("hi", {"callbacks": [tracer]})
+    exporter.close()
+
+    (line,) = path.read_text(encoding="utf-8").splitlines()
+    spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(spans) == 3
+    assert len({span["traceId"] for span in spans}) == 1
+    assert spans[1]["parentSpanId"] == spans[0]["spanId"]
+    assert spans[0]["status"] == {"code": 1}
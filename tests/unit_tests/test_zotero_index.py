@@ -0,0 +1,101 @@
+import sqlite3
+import zlib
+
+import numpy as np
+
+from agent.zotero_index import ZoteroIndex, ZoteroLibrary, chunk_text
+
+SCHEMA = """
+CREATE TABLE itemTypes (itemTypeID INTEGER PRIMARY KEY, typeName TEXT);
+CREATE TABLE items (itemID INTEGER PRIMARY KEY, itemTypeID INT, key TEXT, dateModified TEXT);
+CREATE TABLE deletedItems (itemID INTEGER PRIMARY KEY);
+CREATE TABLE fields (fieldID INTEGER PRIMARY KEY, fieldName TEXT);
+CREATE TABLE itemDataValues (valueID INTEGER PRIMARY KEY, value TEXT);
+CREATE TABLE itemData (itemID INT, fieldID INT, valueID INT);
+CREATE TABLE creators (creatorID INTEGER PRIMARY KEY, firstName TEXT, lastName TEXT);
+CREATE TABLE itemCreators (itemID INT, creatorID INT, orderIndex INT);
+CREATE TABLE itemNotes (itemID INTEGER PRIMARY KEY, parentItemID INT, note TEXT);
+CREATE TABLE itemAttachments (itemID INTEGER PRIMARY KEY, parentItemID INT, contentType TEXT);
+INSERT INTO itemTypes VALUES (1, 'journalArticle'), (2, 'attachment'), (3, 'note');
+INSERT INTO fields VALUES (1, 'title'), (2, 'abstractNote'), (3, 'date');
+"""
+
+
+class FakeEmbedder:
+    """按词哈希到固定维度的词袋向量"""
+
+    name = "fake-bow"
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, texts):
+        self.calls += len(texts)
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, zlib.crc32(word.encode()) % 64] += 1
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+
+
+def _library(tmp_path):
+    db = sqlite3.connect(tmp_path / "zotero.sqlite")
+    db.executescript(SCHEMA)
+    papers = [
+        (1, "AAAA", "Attention Is All You Need", "transformer self attention machine translation", "Vaswani"),
+        (2, "BBBB", "Deep Residual Learning", "residual networks image recognition", "He"),
+        (3, "CCCC", "图神经网络综述", "图神经网络 节点分类 消息传递", "周"),
+    ]
+    for item_id, key, title, abstract, author in papers:
+        db.execute("INSERT INTO items VALUES (?, 1, ?, '2024-01-01')", (item_id, key))
+        for field_id, value in ((1, title), (2, abstract), (3, "2017-06-12")):
+            value_id = db.execute("INSERT INTO itemDataValues (value) VALUES (?)", (value,)).lastrowid
+            db.execute("INSERT INTO itemData VALUES (?, ?, ?)", (item_id, field_id, value_id))
+        creator_id = db.execute("INSERT INTO creators (firstName, lastName) VALUES ('', ?)", (author,)).lastrowid
+        db.execute("INSERT INTO itemCreators VALUES (?, ?, 0)", (item_id, creator_id))
+    # 第2篇有PDF全文缓存
+    db.execute("INSERT INTO items VALUES (10, 2, 'PDF1', '2024-01-01')")
+    db.execute("INSERT INTO itemAttachments VALUES (10, 2, 'application/pdf')")
+    (tmp_path / "storage" / "PDF1").mkdir(parents=True)
+    (tmp_path / "storage" / "PDF1" / ".zotero-ft-cache").write_text("We train a 152 layer residual net on ImageNet.")
+    db.commit()
+    return db, ZoteroLibrary(str(tmp_path))
+
+
+def test_chunk_text_overlaps() -> None:
+    chunks = chunk_text("a" * 2000, size=800, overlap=100)
+    assert len(chunks) == 3
+    assert all(len(chunk) <= 800 for chunk in chunks)
+
+
+def test_hybrid_search_and_incremental_update(tmp_path) -> None:
+    db, library = _library(tmp_path)
+    embed = FakeEmbedder()
+    index = ZoteroIndex(str(tmp_path / "index"), embed=embed)
+
+    stats = index.update(library)
+    assert stats["changed"] == 3
+    assert index.search("residual net ImageNet", k=1)[0]["key"] == "BBBB"
+    assert index.search("图神经网络", k=1)[0]["key"] == "CCCC"
+
+    # 没有变化时不重新计算向量
+    calls = embed.calls
+    assert index.update(library)["changed"] == 0
+    assert embed.calls == calls
+
+    # 修改一篇、删除一篇
+    db.execute("UPDATE itemDataValues SET value = 'graph attention networks' WHERE value = '图神经网络 节点分类 消息传递'")
+    db.execute("UPDATE items SET dateModified = '2024-02-01' WHERE key = 'CCCC'")
+    db.execute("INSERT INTO deletedItems VALUES (1)")
+    db.commit()
+    stats = index.update(library)
+    assert (stats["changed"], stats["removed"]) == (1, 1)
+    assert index.search("graph attention", k=1)[0]["key"] == "CCCC"
+    assert all(hit["key"] != "AAAA" for hit in index.search("transformer translation"))
+    index.close()
+
+    # 重新打开后向量矩阵通过内存映射加载
+    reopened = ZoteroIndex(str(tmp_path / "index"), embed=FakeEmbedder())
+    assert reopened.count()["items"] == 2
+    assert reopened.search("residual", k=1)[0]["key"] == "BBBB"
+    reopened.close()